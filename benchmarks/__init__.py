@@ -0,0 +1,3 @@
+"""
+无硬件基准测试：模拟相机、打印机、按钮和AI接口
+"""
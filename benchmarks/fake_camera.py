@@ -0,0 +1,173 @@
+"""
+Picamera2 替身
+
+以固定帧率循环播放夹具照片（目录中的 JPEG，未提供时生成合成画面），
+实现 src/camera.py 用到的接口：双流配置、post_callback、capture_request、
+capture_file、capture_array 和 capture_metadata。
+使用前调用 install() 把本模块注册为 picamera2，再导入 src.camera
+"""
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_frames(size: tuple[int, int], count: int = 4) -> list[Image.Image]:
+    """生成几张不同的合成画面（渐变 + 色块），用于没有夹具照片时"""
+    width, height = size
+    frames = []
+    rng = np.random.default_rng(0)
+    for index in range(count):
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        rgb = np.empty((height, width, 3), dtype=np.float32)
+        rgb[..., 0] = x
+        rgb[..., 1] = y
+        rgb[..., 2] = (x + y) / 2
+        rgb = np.roll(rgb, index * width // count, axis=1)
+        for _ in range(6):
+            cx, cy = rng.integers(0, width), rng.integers(0, height)
+            rgb[max(cy - 40, 0):cy + 40, max(cx - 60, 0):cx + 60] = rng.integers(0, 255, 3)
+        rgb += rng.normal(0, 6, rgb.shape)
+        frames.append(Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)))
+    return frames
+
+
+def load_frames(directory: Optional[Path], size: tuple[int, int]) -> list[Image.Image]:
+    """读取夹具目录中的照片并缩放到主画面尺寸"""
+    paths = sorted(directory.glob("*.jpg")) if directory else []
+    if not paths:
+        return synthetic_frames(size)
+    return [Image.open(path).convert("RGB").resize(size, Image.Resampling.BILINEAR) for path in paths]
+
+
+def to_yuv420(image: Image.Image) -> np.ndarray:
+    """把 RGB 画面转为 Picamera2 lores 流的 I420 数组 (height*3/2, width)"""
+    width, height = image.size
+    y, cb, cr = image.convert("YCbCr").split()
+    half = (width // 2, height // 2)
+    u = np.asarray(cb.resize(half, Image.Resampling.BOX), dtype=np.uint8)
+    v = np.asarray(cr.resize(half, Image.Resampling.BOX), dtype=np.uint8)
+    chroma = np.concatenate([u.reshape(-1), v.reshape(-1)]).reshape(height // 2, width)
+    return np.concatenate([np.asarray(y, dtype=np.uint8), chroma])
+
+
+class FakeRequest:
+    """capture_request() 返回的一帧"""
+
+    def __init__(self, camera: "FakePicamera2", index: int) -> None:
+        self._camera = camera
+        self._index = index
+
+    def make_array(self, name: str) -> np.ndarray:
+        if name == "lores":
+            return self._camera._lores_frames[self._index]
+        return np.asarray(self._camera._main_frames[self._index])
+
+    def save(self, name: str, output: Any, format: str = "jpeg"):
+        self._camera._main_frames[self._index].save(output, format="JPEG", quality=self._camera.jpeg_quality)
+
+    def release(self):
+        pass
+
+
+class FakePicamera2:
+    """按固定帧率“取流”的 Picamera2 替身"""
+
+    # 由 install() 设置
+    frames_dir: Optional[Path] = None
+    fps = 30.0
+    jpeg_quality = 90
+    # 每次切换夹具照片前播放的帧数（模拟场景变化）
+    frames_per_scene = 90
+
+    def __init__(self) -> None:
+        self.post_callback: Optional[Callable[[FakeRequest], None]] = None
+        self._main_frames: list[Image.Image] = []
+        self._lores_frames: list[np.ndarray] = []
+        self._frame_no = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def create_still_configuration(self, main: dict, lores: Optional[dict] = None, **kwargs) -> dict:
+        camera_config = {"main": dict(main)}
+        if lores is not None:
+            camera_config["lores"] = dict(lores)
+        return camera_config
+
+    create_video_configuration = create_still_configuration
+
+    def align_configuration(self, camera_config: dict):
+        for stream in camera_config.values():
+            width, height = stream["size"]
+            stream["size"] = (width // 2 * 2, height // 2 * 2)
+
+    def configure(self, camera_config: dict):
+        main_size = tuple(camera_config["main"]["size"])
+        self._main_frames = load_frames(self.frames_dir, main_size)
+        lores = camera_config.get("lores")
+        if lores is not None:
+            lores_size = tuple(lores["size"])
+            self._lores_frames = [
+                to_yuv420(frame.resize(lores_size, Image.Resampling.BILINEAR)) for frame in self._main_frames
+            ]
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="fake-camera", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        while self._running:
+            time.sleep(interval)
+            self._frame_no += 1
+            if self.post_callback is not None:
+                self.post_callback(FakeRequest(self, self._index()))
+
+    def _index(self) -> int:
+        return (self._frame_no // self.frames_per_scene) % len(self._main_frames)
+
+    def _next_frame(self) -> int:
+        """等到下一帧（与真实相机一样，取帧最多等待一个帧间隔）"""
+        target = self._frame_no + 1
+        while self._running and self._frame_no < target:
+            time.sleep(0.002)
+        return self._index()
+
+    def capture_request(self) -> FakeRequest:
+        return FakeRequest(self, self._next_frame())
+
+    def capture_file(self, output: Any, format: str = "jpeg"):
+        # output 可以是文件路径或文件对象
+        self._main_frames[self._next_frame()].save(output, format="JPEG", quality=self.jpeg_quality)
+
+    def capture_array(self, name: str = "main") -> np.ndarray:
+        return FakeRequest(self, self._next_frame()).make_array(name)
+
+    def capture_metadata(self) -> dict:
+        self._next_frame()
+        return {"AeLocked": True, "ExposureTime": 10000, "AnalogueGain": 1.0, "ColourGains": (1.5, 1.5)}
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    def close(self):
+        self.stop()
+
+
+def install(frames_dir: Optional[Path] = None, fps: float = 30.0):
+    """把替身注册为 picamera2 模块（需在导入 src.camera 之前调用）"""
+    FakePicamera2.frames_dir = frames_dir
+    FakePicamera2.fps = fps
+    module = types.ModuleType("picamera2")
+    module.Picamera2 = FakePicamera2
+    sys.modules["picamera2"] = module
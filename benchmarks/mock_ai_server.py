@@ -0,0 +1,270 @@
+"""
+模拟 Replicate 和 OpenAI 兼容（DeepSeek）接口的本地 HTTP 服务
+
+延迟按可配置的分布抽样：
+- fixed:1.5            固定 1.5 秒
+- uniform:0.5,2.0      0.5~2.0 秒均匀分布
+- lognormal:1.2,0.4    中位数 1.2 秒、sigma 0.4 的对数正态分布（长尾，最接近真实 API）
+
+另可设置失败率（返回 HTTP 500），用于观察重试、对冲和熔断的效果
+"""
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CAPTION = "a person standing next to a window with a plant on the sill"
+POEM = """窗台上的绿萝
+又长出一片叶子
+你站在它旁边
+像在等一封信
+阳光从左边进来
+落在你的袖口
+你没有说话
+叶子替你轻轻晃了一下"""
+
+
+@dataclass
+class Latency:
+    """延迟分布"""
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v] or [0.0]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"未知的延迟分布: {spec}")
+        return cls(kind, values[0], values[1] if len(values) > 1 else 0.0)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(max(self.a, 1e-6)), self.b)
+        return self.a
+
+
+@dataclass
+class Endpoint:
+    """一个模拟接口的行为"""
+    latency: Latency
+    error_rate: float = 0.0
+    calls: int = 0
+    errors: int = 0
+
+
+class MockAIServer:
+    """在后台线程中运行的模拟 API 服务"""
+
+    def __init__(
+        self,
+        caption_latency: str = "lognormal:1.5,0.4",
+        poem_latency: str = "lognormal:2.5,0.4",
+        token_interval: float = 0.05,
+        batch_factor: float = 0.35,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.replicate = Endpoint(Latency.parse(caption_latency), error_rate)
+        self.chat = Endpoint(Latency.parse(poem_latency), error_rate)
+        self.token_interval = token_interval
+        # 批量请求（突发模式）每多一首诗增加的延迟比例（输出 token 随条数线性增长）
+        self.batch_factor = batch_factor
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._predictions: dict[str, dict] = {}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                server.logger.debug("mock: " + format, *args)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                server._route(self, "GET")
+
+            def do_POST(self):
+                server._route(self, "POST")
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-ai", daemon=True)
+
+    def start(self) -> "MockAIServer":
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # ------------------------------------------------------------------
+
+    def _delay(self, endpoint: Endpoint) -> tuple[float, bool]:
+        """抽样本次调用的延迟和是否失败"""
+        with self._rng_lock:
+            endpoint.calls += 1
+            delay = endpoint.latency.sample(self._rng)
+            failed = self._rng.random() < endpoint.error_rate
+            if failed:
+                endpoint.errors += 1
+        return delay, failed
+
+    @staticmethod
+    def _send_json(handler: BaseHTTPRequestHandler, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _route(self, handler: BaseHTTPRequestHandler, method: str):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        path = handler.path.split("?")[0]
+
+        if method == "POST" and path.endswith("/chat/completions"):
+            self._chat(handler, json.loads(body or b"{}"))
+        elif method == "POST" and path == "/v1/files":
+            # 字段与 replicate 客户端的 File 模型一致（1.x 起校验 etag/checksums/metadata）
+            file_id = uuid.uuid4().hex
+            md5 = hashlib.md5(body).hexdigest()
+            self._send_json(handler, 201, {
+                "id": file_id,
+                "name": "image.jpg",
+                "content_type": "image/jpeg",
+                "size": len(body),
+                "etag": md5,
+                "checksums": {"md5": md5, "sha256": hashlib.sha256(body).hexdigest()},
+                "metadata": {},
+                "urls": {"get": f"{self.base_url}/v1/files/{file_id}"},
+                "created_at": self._now(),
+                "expires_at": None
+            })
+        elif method == "POST" and re.fullmatch(r"/v1/(models/[^/]+/[^/]+/|deployments/[^/]+/[^/]+/)?predictions", path):
+            self._create_prediction(handler, json.loads(body or b"{}"))
+        elif method == "GET" and path.startswith("/v1/predictions/"):
+            prediction = self._predictions.get(path.rsplit("/", 1)[-1])
+            if prediction is None:
+                self._send_json(handler, 404, {"detail": "Not found"})
+            else:
+                self._send_json(handler, 200, prediction)
+        elif method == "GET" and re.fullmatch(r"/v1/models/[^/]+/[^/]+/versions/[^/]+", path):
+            self._send_json(handler, 200, {
+                "id": path.rsplit("/", 1)[-1],
+                "created_at": self._now(),
+                "cog_version": "0.8.0",
+                "openapi_schema": {}
+            })
+        else:
+            self._send_json(handler, 404, {"detail": f"{method} {path} 未模拟"})
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def _create_prediction(self, handler: BaseHTTPRequestHandler, request: dict):
+        """Replicate 预测：等待抽样的延迟后直接返回已完成的结果（客户端无需轮询）"""
+        delay, failed = self._delay(self.replicate)
+        time.sleep(delay)
+        prediction_id = uuid.uuid4().hex
+        prediction = {
+            "id": prediction_id,
+            "model": "andreasjansson/blip-2",
+            "version": request.get("version", ""),
+            "input": {"caption": True},
+            "output": None if failed else CAPTION,
+            "logs": "",
+            "error": "mock failure" if failed else None,
+            "status": "failed" if failed else "succeeded",
+            "created_at": self._now(),
+            "started_at": self._now(),
+            "completed_at": self._now(),
+            "metrics": {"predict_time": delay},
+            "urls": {
+                "get": f"{self.base_url}/v1/predictions/{prediction_id}",
+                "cancel": f"{self.base_url}/v1/predictions/{prediction_id}/cancel"
+            }
+        }
+        self._predictions[prediction_id] = prediction
+        self._send_json(handler, 201, prediction)
+
+    def _chat(self, handler: BaseHTTPRequestHandler, request: dict):
+        """OpenAI 兼容的 chat completions（支持 SSE 流式）"""
+        delay, failed = self._delay(self.chat)
+        # 多模态请求（单次调用模式）返回 JSON 格式的描述和诗歌，批量请求返回 N 首诗
+        messages = request.get("messages", [])
+        vision = any(isinstance(message.get("content"), list) for message in messages)
+        batch = re.search(r"共有 (\d+) 个编号的场景", str(messages[-1].get("content", "")) if messages else "")
+        if vision:
+            content = json.dumps({"caption": CAPTION, "poem": POEM}, ensure_ascii=False)
+        elif batch:
+            count = int(batch.group(1))
+            delay *= 1 + self.batch_factor * (count - 1)
+            content = json.dumps({"poems": [POEM] * count}, ensure_ascii=False)
+        else:
+            content = POEM
+
+        if failed:
+            time.sleep(delay)
+            self._send_json(handler, 500, {"error": {"message": "mock failure"}})
+            return
+
+        if not request.get("stream"):
+            time.sleep(delay)
+            self._send_json(handler, 200, {
+                "id": uuid.uuid4().hex,
+                "object": "chat.completion",
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+            })
+            return
+
+        # 流式：首个增量在 delay 的一半后到达，之后每行间隔 token_interval
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+        def send(payload: str):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            handler.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            handler.wfile.flush()
+
+        time.sleep(delay / 2)
+        for line in content.splitlines(keepends=True):
+            send(json.dumps({"choices": [{"index": 0, "delta": {"content": line}}]}, ensure_ascii=False))
+            time.sleep(self.token_interval)
+        send("[DONE]")
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
+
+    def describe(self) -> str:
+        return (
+            f"replicate {self.replicate.calls} 次 (失败 {self.replicate.errors}), "
+            f"chat {self.chat.calls} 次 (失败 {self.chat.errors})"
+        )
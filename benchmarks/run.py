@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+无硬件端到端基准测试
+
+用模拟组件代替硬件和外部服务，按脚本化的按键驱动完整流水线：
+- Picamera2 替身循环播放夹具照片（benchmarks/fake_camera.py）
+- pty 上的虚拟 ESC/POS 打印机按波特率和打印速度消耗时间（benchmarks/virtual_printer.py）
+- 本地 HTTP 服务模拟 Replicate 和 DeepSeek 接口的延迟分布（benchmarks/mock_ai_server.py）
+
+输出各环节的 p50/p95/p99 和吞吐量，结果追加到 benchmarks/results.jsonl（带 git 提交号），
+并与同一场景的上一次结果对比
+
+用法: python -m benchmarks.run [-n 按键次数] [--rate 每秒按键数] [--scenario 名称] ...
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmarks import fake_camera
+from benchmarks.mock_ai_server import MockAIServer
+from benchmarks.virtual_printer import VirtualPrinter
+
+RESULTS_FILE = Path(__file__).parent / "results.jsonl"
+# 对比时关注的环节
+HEADLINE_SPANS = ("press.total", "camera.capture", "ai.caption", "ai.poem", "ai.poem_batch", "ai.vision", "printer.print")
+
+
+def git_commit() -> str:
+    """当前提交号（工作区有改动时加 -dirty）"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=project_root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=project_root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def configure_environment(args: argparse.Namespace, workdir: Path, server: MockAIServer, printer: VirtualPrinter):
+    """在导入 src.config 之前设置环境变量（已存在的 .env 不会覆盖这些值）"""
+    providers = [{"name": "mock", "url": f"{server.base_url}/v1/chat/completions", "model": "mock-chat", "api_key": "bench"}]
+    os.environ.update({
+        "DATA_DIR": str(workdir / "data"),
+        "POEM_ARCHIVE_DIR": str(workdir / "poems"),
+        "LOG_FILE": str(workdir / "bench.log"),
+        "TRACE_FILE": str(workdir / "traces.jsonl"),
+        "TRACE_ENABLED": "true",
+        "METRICS_PORT": "0",
+        "SERIAL_PORT": printer.port,
+        "PRINTER_BAUD": str(args.baud),
+        "PRINTER_FLOW_CONTROL": args.flow_control,
+        "DEEPSEEK_API_KEY": "",
+        "LLM_PROVIDERS": json.dumps(providers),
+        "VISION_PROVIDERS": json.dumps(providers),
+        "AI_STRATEGY": args.strategy,
+        "REPLICATE_API_TOKEN": "bench",
+        "REPLICATE_BASE_URL": server.base_url,
+        "CAPTION_BACKEND": "remote",
+        "POEM_STREAMING": "true" if args.streaming else "false",
+        "BURST_MODE": "true" if args.burst else "false",
+        "HTTP2_ENABLED": "false",
+        # 每次按键都走完整流程，不受缓存、离线队列和预生成影响
+        "CACHE_ENABLED": "false",
+        "OFFLINE_QUEUE": "false",
+        "SPECULATE": "false",
+    })
+
+
+def summarize(snapshot: dict[str, dict]) -> dict[str, dict]:
+    """把 tracer.snapshot() 转成可序列化的摘要"""
+    spans = {}
+    for name, item in sorted(snapshot.items()):
+        q = item["quantiles"]
+        if not q:
+            continue
+        spans[name] = {
+            "count": item["count"],
+            "errors": item["errors"],
+            "p50": round(q[0.5], 4),
+            "p95": round(q[0.95], 4),
+            "p99": round(q[0.99], 4),
+        }
+    return spans
+
+
+def previous_result(scenario: str) -> Optional[dict]:
+    """同一场景最近一次的结果"""
+    if not RESULTS_FILE.exists():
+        return None
+    previous = None
+    for line in RESULTS_FILE.read_text(encoding="utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if record.get("scenario") == scenario:
+            previous = record
+    return previous
+
+
+def report(result: dict, previous: Optional[dict]):
+    """打印本次结果及与上一次的对比"""
+    print()
+    print(f"场景 {result['scenario']} @ {result['commit']}")
+    print(
+        f"按键 {result['presses']}  完成 {result['completed']}  丢弃 {result['dropped']}  "
+        f"用时 {result['duration']:.1f}s  吞吐 {result['throughput_per_min']:.2f} 首/分钟"
+    )
+    print()
+    print(f"{'环节':24s} {'n':>4s} {'err':>4s} {'p50':>8s} {'p95':>8s} {'p99':>8s}")
+    for name, span in result["spans"].items():
+        print(
+            f"{name:24s} {span['count']:4d} {span['errors']:4d} "
+            f"{span['p50']:7.3f}s {span['p95']:7.3f}s {span['p99']:7.3f}s"
+        )
+
+    if previous is None:
+        return
+    print()
+    print(f"对比 {previous['commit']} ({previous['timestamp']}):")
+    old_spans = previous.get("spans", {})
+    for name in HEADLINE_SPANS:
+        new, old = result["spans"].get(name), old_spans.get(name)
+        if not new or not old:
+            continue
+        deltas = []
+        for key in ("p50", "p95"):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            deltas.append(f"{key} {old[key]:.3f}s → {new[key]:.3f}s ({change:+.1f}%)")
+        print(f"  {name:22s} " + ", ".join(deltas))
+    old_throughput = previous.get("throughput_per_min")
+    if old_throughput:
+        change = (result["throughput_per_min"] - old_throughput) / old_throughput * 100
+        print(f"  {'吞吐':22s} {old_throughput:.2f} → {result['throughput_per_min']:.2f} 首/分钟 ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无硬件端到端基准测试")
+    parser.add_argument("-n", "--presses", type=int, default=8, help="按键次数")
+    parser.add_argument("--rate", type=float, default=0.1, help="平均每秒按键次数（泊松到达）")
+    parser.add_argument("--scenario", default="", help="场景名称（用于跨提交对比，默认由参数生成）")
+    parser.add_argument("--frames", type=Path, default=None, help="夹具照片目录（默认使用合成画面）")
+    parser.add_argument("--caption-latency", default="lognormal:1.5,0.4", help="Replicate 延迟分布")
+    parser.add_argument("--poem-latency", default="lognormal:2.5,0.4", help="DeepSeek 延迟分布")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟接口的失败率")
+    parser.add_argument("--strategy", choices=("two_step", "vision"), default="two_step", help="AI 调用方式")
+    parser.add_argument("--streaming", action="store_true", help="启用流式生成边生成边打印")
+    parser.add_argument("--burst", action="store_true", help="启用突发模式（连续按键合并处理）")
+    parser.add_argument("--baud", type=int, default=9600, help="虚拟打印机波特率")
+    parser.add_argument("--flow-control", default="status", help="打印机流控方式")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--no-save", action="store_true", help="不写入 results.jsonl")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出流水线日志")
+    args = parser.parse_args()
+
+    scenario = args.scenario or (
+        f"{args.strategy}{'-stream' if args.streaming else ''}{'-burst' if args.burst else ''}-n{args.presses}-r{args.rate:g}"
+        f"-{args.caption_latency}-{args.poem_latency}-e{args.error_rate:g}-{args.baud}-{args.flow_control}"
+    )
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s.%(msecs)03d | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%H:%M:%S"
+    )
+
+    server = MockAIServer(
+        caption_latency=args.caption_latency,
+        poem_latency=args.poem_latency,
+        error_rate=args.error_rate,
+        seed=args.seed
+    ).start()
+    virtual_printer = VirtualPrinter(baud=args.baud).start()
+    workdir = Path(tempfile.mkdtemp(prefix="poetry-bench-"))
+    configure_environment(args, workdir, server, virtual_printer)
+    fake_camera.install(args.frames)
+
+    # 环境变量和替身就绪后再导入项目模块
+    from benchmarks.scripted_button import ScriptedButton, poisson_schedule
+    from src.ai_service import AIService
+    from src.archive import PoemArchive
+    from src.camera import Camera
+    from src.image_store import ImageStore
+    from src.pipeline import PoemPipeline
+    from src.printer import ThermalPrinter
+    from src.tracing import tracer
+
+    image_store = ImageStore()
+    camera = Camera(image_store=image_store)
+    printer = ThermalPrinter()
+    ai_service = AIService()
+    archive = PoemArchive()
+    pipeline = PoemPipeline(camera=camera, ai_service=ai_service, printer=printer, archive=archive)
+    button = ScriptedButton(poisson_schedule(args.presses, args.rate, args.seed))
+
+    for name, component in (("打印机", printer), ("相机", camera), ("AI服务", ai_service)):
+        if not component.initialize():
+            print(f"❌ {name}初始化失败")
+            return 1
+    pipeline.start()
+
+    print(f"场景 {scenario}: {args.presses} 次按键, 工作目录 {workdir}")
+    dropped = 0
+    started = time.monotonic()
+    try:
+        button.start()
+        while not button.exhausted:
+            event = button.wait_for_event()
+            if event is not None and not pipeline.submit(pressed_at=event.pressed_at):
+                dropped += 1
+        while not pipeline.is_idle():
+            time.sleep(0.05)
+        virtual_printer.wait_idle()
+        duration = time.monotonic() - started
+    finally:
+        pipeline.stop()
+        camera.close()
+        image_store.close()
+        printer.close()
+        ai_service.shutdown()
+        archive.close()
+        server.close()
+        virtual_printer.close()
+
+    spans = summarize(tracer.snapshot())
+    completed = spans.get("press.total", {}).get("count", 0) - spans.get("press.total", {}).get("errors", 0)
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "scenario": scenario,
+        "presses": args.presses,
+        "completed": completed,
+        "dropped": dropped,
+        "duration": round(duration, 3),
+        "throughput_per_min": round(completed / duration * 60, 3) if duration > 0 else 0.0,
+        "printer": {
+            "bytes": virtual_printer.stats.bytes_received,
+            "lines": len(virtual_printer.stats.lines),
+            "cuts": virtual_printer.stats.cuts,
+        },
+        "mock": server.describe(),
+        "spans": spans,
+    }
+
+    report(result, previous_result(scenario))
+    if not args.no_save:
+        with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+脚本化按钮
+
+与 GPIOController 的 wait_for_event 接口一致，按预定时刻（或泊松到达）产生短按事件，
+用于在没有 GPIO 的机器上驱动主循环
+"""
+import random
+import threading
+import time
+from typing import Optional, Sequence
+
+from src.gpio_controller import ButtonEvent
+
+
+def poisson_schedule(count: int, rate: float, seed: int = 0) -> list[float]:
+    """
+    生成泊松到达的按键时刻
+
+    Args:
+        count: 按键次数
+        rate: 平均每秒按键次数
+        seed: 随机种子
+
+    Returns:
+        相对开始时刻的偏移（秒）
+    """
+    rng = random.Random(seed)
+    offsets, t = [], 0.0
+    for _ in range(count):
+        offsets.append(t)
+        t += rng.expovariate(rate)
+    return offsets
+
+
+class ScriptedButton:
+    """按时间表产生按钮事件"""
+
+    def __init__(self, offsets: Sequence[float], kind: str = "SHORT") -> None:
+        self.offsets = sorted(offsets)
+        self.kind = kind
+        self._next = 0
+        self._started_at: Optional[float] = None
+        self._woken = threading.Event()
+
+    def initialize(self) -> bool:
+        """与 GPIOController 接口一致（可直接替换 PoetryCamera.gpio）"""
+        return True
+
+    def start(self):
+        """从现在开始计时"""
+        self._started_at = time.monotonic()
+
+    @property
+    def exhausted(self) -> bool:
+        return self._next >= len(self.offsets)
+
+    def wait_for_event(self, timeout: Optional[float] = None) -> Optional[ButtonEvent]:
+        """阻塞到下一个按键时刻，时间表用完、超时或被 wake() 唤醒时返回None"""
+        if self._started_at is None:
+            self.start()
+        if self.exhausted:
+            return None
+
+        due = self._started_at + self.offsets[self._next]
+        wait = max(0.0, due - time.monotonic())
+        if timeout is not None and wait > timeout:
+            self._woken.wait(timeout)
+            return None
+        if self._woken.wait(wait):
+            self._woken.clear()
+            return None
+
+        self._next += 1
+        # 与边沿中断一样记录按下时刻（按计划时刻，不含调度延迟）
+        return ButtonEvent(self.kind, pressed_at=due)
+
+    def wake(self):
+        self._woken.set()
+
+    def cleanup(self):
+        self.wake()
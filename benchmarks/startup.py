@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+启动耗时基准测试
+
+1. 导入耗时：在子进程中以 python -X importtime 导入 main，统计总耗时和主要第三方库的累计耗时
+2. 启动耗时：在子进程中用模拟硬件（见 benchmarks/run.py）启动 PoetryCamera，
+   分别记录快速启动（FAST_START=true）和顺序启动时“按钮可用”和“全部组件就绪”的耗时
+
+结果追加到 benchmarks/results.jsonl（场景 startup），并与上一次结果对比
+
+用法: python -m benchmarks.startup [--runs 3]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmarks.run import RESULTS_FILE, git_commit, previous_result
+
+SCENARIO = "startup"
+# 单独列出的较慢模块
+HEAVY_MODULES = ("httpx", "replicate", "picamera2", "numpy", "PIL", "serial", "dotenv", "RPi")
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+CHILD_MARKER = "STARTUP_RESULT "
+
+
+def measure_imports() -> dict[str, float]:
+    """
+    以 -X importtime 导入 main 一次
+
+    Returns:
+        模块名 -> 累计导入耗时（秒），"total" 为导入 main 的总耗时
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=project_root, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "导入 main 失败")
+
+    times: dict[str, float] = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, name = int(match.group(2)) / 1e6, match.group(4)
+        top = name.split(".")[0]
+        # 同一顶层包取最外层（最大）的累计值
+        if top in HEAVY_MODULES:
+            times[top] = max(times.get(top, 0.0), cumulative)
+        if name == "main":
+            times["total"] = cumulative
+    return times
+
+
+def measure_boot(fast_start: bool) -> dict[str, float]:
+    """在子进程中启动一次，返回按钮可用和全部就绪的耗时（秒）"""
+    env = dict(os.environ, FAST_START="true" if fast_start else "false")
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child"],
+        cwd=project_root, capture_output=True, text=True, env=env, timeout=120
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith(CHILD_MARKER):
+            return json.loads(line[len(CHILD_MARKER):])
+    raise RuntimeError((proc.stderr.strip() or proc.stdout.strip() or "子进程无输出").splitlines()[-1])
+
+
+def child():
+    """子进程：用模拟硬件启动 PoetryCamera 并输出耗时"""
+    from benchmarks import fake_camera
+    from benchmarks.mock_ai_server import MockAIServer
+    from benchmarks.run import configure_environment
+    from benchmarks.virtual_printer import VirtualPrinter
+
+    server = MockAIServer().start()
+    virtual_printer = VirtualPrinter().start()
+    workdir = Path(tempfile.mkdtemp(prefix="poetry-startup-"))
+    args = argparse.Namespace(
+        baud=9600, flow_control="none", strategy="two_step", streaming=False, burst=False
+    )
+    configure_environment(args, workdir, server, virtual_printer)
+    os.environ["LOG_LEVEL"] = "ERROR"
+    fake_camera.install()
+
+    # 计时从导入 main 开始（模拟硬件已预先加载 numpy/PIL，导入耗时以 importtime 的结果为准）
+    started = time.monotonic()
+    import main
+    from benchmarks.scripted_button import ScriptedButton
+
+    camera = main.PoetryCamera()
+    camera.gpio = ScriptedButton([])
+    if not camera.initialize():
+        raise SystemExit("初始化失败")
+    ready = time.monotonic() - started
+    if camera.warmup is not None and not camera.warmup.wait_all(60):
+        raise SystemExit(f"预热失败: {camera.warmup.describe()}")
+    warm = time.monotonic() - started
+
+    camera.shutdown()
+    server.close()
+    virtual_printer.close()
+    print(CHILD_MARKER + json.dumps({"ready": round(ready, 4), "warm": round(warm, 4)}), flush=True)
+
+
+def best(samples: list[dict[str, float]]) -> dict[str, float]:
+    """多次测量中每项取最小值（排除磁盘缓存和调度抖动）"""
+    keys = {key for sample in samples for key in sample}
+    return {key: round(min(s[key] for s in samples if key in s), 4) for key in sorted(keys)}
+
+
+def report(result: dict, previous: Optional[dict]):
+    print()
+    print(f"启动耗时 @ {result['commit']}")
+    imports = result["imports"]
+    print(f"导入 main: {imports.get('total', 0):.3f}s")
+    for name in HEAVY_MODULES:
+        if name in imports:
+            print(f"  {name:12s} {imports[name]:.3f}s")
+    not_loaded = [name for name in HEAVY_MODULES if name not in imports]
+    if not_loaded:
+        print(f"  启动时未导入: {', '.join(not_loaded)}")
+    for mode in ("fast", "sequential"):
+        boot = result.get(mode)
+        if boot:
+            print(f"{mode:10s} 按钮可用 {boot['ready']:.3f}s  全部就绪 {boot['warm']:.3f}s")
+
+    if previous is None:
+        return
+    print()
+    print(f"对比 {previous['commit']} ({previous['timestamp']}):")
+    pairs = [("导入 main", previous.get("imports", {}).get("total"), imports.get("total"))]
+    for mode in ("fast", "sequential"):
+        for key in ("ready", "warm"):
+            pairs.append((f"{mode}.{key}", previous.get(mode, {}).get(key), result.get(mode, {}).get(key)))
+    for name, old, new in pairs:
+        if old and new:
+            print(f"  {name:16s} {old:.3f}s → {new:.3f}s ({(new - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=3, help="每项测量次数（取最小值）")
+    parser.add_argument("--no-boot", action="store_true", help="只测导入耗时")
+    parser.add_argument("--no-save", action="store_true", help="不写入 results.jsonl")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return 0
+
+    # 第一次导入会编译 .pyc，不计入
+    measure_imports()
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "scenario": SCENARIO,
+        "imports": best([measure_imports() for _ in range(args.runs)]),
+    }
+    if not args.no_boot:
+        for mode, fast_start in (("fast", True), ("sequential", False)):
+            try:
+                result[mode] = best([measure_boot(fast_start) for _ in range(args.runs)])
+            except Exception as e:
+                print(f"⚠️ {mode} 启动测量失败: {e}")
+
+    report(result, previous_result(SCENARIO))
+    if not args.no_save:
+        with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+基于伪终端（pty）的虚拟 ESC/POS 打印机
+
+ThermalPrinter 照常用 pyserial 打开 VirtualPrinter.port。虚拟打印机：
+- 按波特率（每字节 10 位）的速度从串口读取数据，接收缓冲区满时停止读取，
+  背压经 pty 传回发送方
+- 立即回应实时状态查询 DLE EOT n
+- 按顺序解析命令，文本行、走纸和光栅图按打印速度消耗机械时间，
+  处理到 GS r 时才回应（与真实打印机一样表示之前的数据已处理完）
+- 记录解码出的文本行、光栅图和切纸次数
+"""
+import collections
+import logging
+import os
+import threading
+import time
+import tty
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+ESC, GS, DLE, FS = 0x1B, 0x1D, 0x10, 0x1C
+EOT, LF, CR, CAN = 0x04, 0x0A, 0x0D, 0x18
+
+# ESC 命令的参数字节数（src/printer.py 用到的命令）
+ESC_ARGS = {
+    ord("@"): 0, ord("7"): 3, ord(" "): 1, ord("3"): 1, ord("2"): 0,
+    ord("a"): 1, ord("d"): 1, ord("!"): 1, ord("8"): 0, ord("E"): 1, ord("J"): 1,
+}
+
+# 实时状态回应：第 4 位固定为 1，其余为 0 表示正常
+STATUS_OK = 0x12
+DOTS_PER_MM = 8
+
+
+@dataclass
+class PrinterStats:
+    """虚拟打印机收到的内容"""
+    bytes_received: int = 0
+    lines: list[str] = field(default_factory=list)
+    rasters: list[tuple[int, int]] = field(default_factory=list)
+    cuts: int = 0
+    status_queries: int = 0
+    acks: int = 0
+    # 打印头移动的总点行数
+    dots_fed: int = 0
+
+
+class VirtualPrinter:
+    """pty 上的虚拟热敏打印机"""
+
+    def __init__(
+        self,
+        baud: int = 9600,
+        buffer_size: int = 4096,
+        speed_mm_s: float = 50.0,
+        encoding: str = "gb18030"
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.baud = baud
+        self.buffer_size = buffer_size
+        self.speed_dots_s = speed_mm_s * DOTS_PER_MM
+        self.encoding = encoding
+        self.stats = PrinterStats()
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._buffer: "collections.deque[int]" = collections.deque()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._write_lock = threading.Lock()
+        self._line = bytearray()
+        self._line_spacing = 30
+        self._font_scale = 1
+        self._threads = [
+            threading.Thread(target=self._receive, name="vprinter-rx", daemon=True),
+            threading.Thread(target=self._process, name="vprinter-mech", daemon=True),
+        ]
+
+    def start(self) -> "VirtualPrinter":
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    # ------------------------------------------------------------------
+    # 串口接收
+    # ------------------------------------------------------------------
+
+    def _reply(self, value: int):
+        with self._write_lock:
+            os.write(self._master, bytes([value]))
+
+    def _receive(self):
+        byte_time = 10 / self.baud
+        previous = bytearray()
+        while not self._stop.is_set():
+            # 接收缓冲区满时停止读取
+            with self._cond:
+                while len(self._buffer) >= self.buffer_size and not self._stop.is_set():
+                    self._cond.wait(0.1)
+            try:
+                data = os.read(self._master, 64)
+            except OSError:
+                return
+            if not data:
+                return
+
+            started = time.monotonic()
+            # 实时命令 DLE EOT n 在接收时立即回应（可能跨越两次读取）
+            window = previous + data
+            for i in range(len(previous), len(window)):
+                if i >= 2 and window[i - 2] == DLE and window[i - 1] == EOT and window[i] in (1, 2, 3, 4):
+                    self.stats.status_queries += 1
+                    self._reply(STATUS_OK)
+            previous = window[-2:]
+
+            self.stats.bytes_received += len(data)
+            with self._cond:
+                self._buffer.extend(data)
+                self._idle.clear()
+                self._cond.notify_all()
+
+            # 按波特率模拟传输时间
+            remaining = len(data) * byte_time - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    # ------------------------------------------------------------------
+    # 命令处理与机械时间
+    # ------------------------------------------------------------------
+
+    def _take(self, count: int = 1) -> bytes:
+        """从接收缓冲区按顺序取出字节（不足时等待）"""
+        out = bytearray()
+        with self._cond:
+            while len(out) < count:
+                while not self._buffer:
+                    self._idle.set()
+                    self._cond.wait(0.1)
+                    if self._stop.is_set():
+                        raise EOFError
+                self._idle.clear()
+                while self._buffer and len(out) < count:
+                    out.append(self._buffer.popleft())
+            self._cond.notify_all()
+        return bytes(out)
+
+    def _advance(self, dots: int):
+        """走纸若干点行（按打印速度消耗时间）"""
+        self.stats.dots_fed += dots
+        time.sleep(dots / self.speed_dots_s)
+
+    def _end_line(self):
+        text = bytes(self._line).decode(self.encoding, errors="replace")
+        self.stats.lines.append(text)
+        self._line.clear()
+        self._advance(max(self._line_spacing, 24 * self._font_scale))
+
+    def _process(self):
+        try:
+            while not self._stop.is_set():
+                byte = self._take()[0]
+                if byte == ESC:
+                    self._esc(self._take()[0])
+                elif byte == GS:
+                    self._gs(self._take()[0])
+                elif byte == DLE:
+                    # 实时命令已在接收时回应
+                    self._take(2)
+                elif byte == FS:
+                    self._take()
+                elif byte == CAN:
+                    self._line.clear()
+                elif byte == LF:
+                    self._end_line()
+                elif byte != CR:
+                    self._line.append(byte)
+        except EOFError:
+            return
+
+    def _esc(self, command: int):
+        count = ESC_ARGS.get(command, 0)
+        args = self._take(count) if count else b""
+        if command == ord("@"):
+            self._line.clear()
+            self._line_spacing = 30
+            self._font_scale = 1
+        elif command == ord("3"):
+            self._line_spacing = args[0]
+        elif command == ord("2"):
+            self._line_spacing = 30
+        elif command == ord("d"):
+            if self._line:
+                self._end_line()
+            self._advance(args[0] * self._line_spacing)
+        elif command == ord("J"):
+            self._advance(args[0])
+
+    def _gs(self, command: int):
+        if command == ord("!"):
+            size = self._take()[0]
+            self._font_scale = (size & 0x0F) + 1
+        elif command == ord("V"):
+            mode = self._take()[0]
+            if mode in (65, 66, 97, 98, 103, 104):
+                self._take()
+            self.stats.cuts += 1
+        elif command == ord("v"):
+            header = self._take(6)
+            width_bytes = header[2] | (header[3] << 8)
+            height = header[4] | (header[5] << 8)
+            self._take(width_bytes * height)
+            self.stats.rasters.append((width_bytes * 8, height))
+            self._advance(height)
+        elif command == ord("r"):
+            self._take()
+            # 处理到此处才回应：之前的数据都已打印
+            self.stats.acks += 1
+            self._reply(0x00)
+
+    # ------------------------------------------------------------------
+
+    def wait_idle(self, timeout: float = 60.0) -> bool:
+        """等待接收缓冲区处理完毕"""
+        return self._idle.wait(timeout)
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
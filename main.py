@@ -8,19 +8,30 @@ import sys
 import logging
 from logging.handlers import RotatingFileHandler
 import signal
+import threading
 import time
 from pathlib import Path
 
+# 启动计时起点（用于统计从启动到按钮可用的耗时）
+BOOT_STARTED = time.monotonic()
+
 # 添加项目根目录到Python路径
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
 from src.config import config
 from src.camera import Camera
+from src.image_store import ImageStore
 from src.printer import ThermalPrinter
 from src.ai_service import AIService
 from src.gpio_controller import GPIOController
 from src.archive import PoemArchive
+from src.offline_queue import OfflineQueue
+from src.pipeline import PoemPipeline
+from src.speculator import Speculator
+from src.supervisor import Supervisor
+from src.tracing import tracer
+from src.warmup import AI, CAMERA, GPIO, LABELS, PRINTER, Warmup
 
 
 class PoetryCamera:
@@ -31,11 +42,32 @@ class PoetryCamera:
         self.logger = logging.getLogger(__name__)
         
         # 组件
-        self.camera = Camera()
+        self.image_store = ImageStore()
+        self.camera = Camera(image_store=self.image_store)
         self.printer = ThermalPrinter()
         self.ai_service = AIService()
         self.gpio = GPIOController(enable_led=False)  # 禁用LED
         self.archive = PoemArchive()
+        self.offline_queue = OfflineQueue(self.ai_service) if config.offline_queue_enabled else None
+        self.speculator = Speculator(self.camera, self.ai_service) if config.speculate_enabled else None
+        # 组件自愈：各组件在后台初始化，故障时只重新初始化出错的组件
+        self.supervisor = Supervisor() if config.supervisor_enabled else None
+        if self.supervisor is not None:
+            self.warmup = self.supervisor
+        elif config.fast_start:
+            # 快速启动：相机/打印机/AI服务在后台并行初始化
+            self.warmup = Warmup(on_failure=self._on_warmup_failure)
+        else:
+            self.warmup = None
+        self.pipeline = PoemPipeline(
+            camera=self.camera,
+            ai_service=self.ai_service,
+            printer=self.printer,
+            archive=self.archive,
+            offline_queue=self.offline_queue,
+            speculator=self.speculator,
+            warmup=self.warmup
+        )
         
         # 运行标志
         self.running = True
@@ -48,7 +80,7 @@ class PoetryCamera:
         """配置日志"""
         log_level = getattr(logging, config.log_level, logging.INFO)
         formatter = logging.Formatter(
-            "%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+            "%(asctime)s.%(msecs)03d | %(levelname)s | %(name)s | %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S"
         )
 
@@ -75,6 +107,7 @@ class PoetryCamera:
         """信号处理器"""
         self.logger.info(f"收到信号 {signum}，准备退出...")
         self.running = False
+        self.gpio.wake()
     
     def initialize(self) -> bool:
         """
@@ -96,72 +129,102 @@ class PoetryCamera:
             return False
         
         # 初始化GPIO
-        if not self.gpio.initialize():
+        if self.supervisor is not None:
+            # 失败时在后台按退避重试，等到按钮可用再继续
+            self.supervisor.start(GPIO, self.gpio.initialize, reset=self.gpio.cleanup)
+            while self.running and not self.supervisor.wait(GPIO, 1.0):
+                pass
+            if not self.running:
+                return False
+        elif not self.gpio.initialize():
             self.logger.error("GPIO初始化失败")
             return False
         
-        # 初始化打印机
-        if not self.printer.initialize():
-            self.logger.error("打印机初始化失败")
-            return False
+        if self.supervisor is not None:
+            self.supervisor.start(
+                PRINTER, self.printer.initialize,
+                check=self.printer.check_health, reset=self.printer.close
+            )
+            self.supervisor.start(
+                CAMERA, self.camera.initialize,
+                check=self.camera.check_health, reset=self.camera.close
+            )
+            self.supervisor.start(AI, self.ai_service.initialize)
+            if not config.fast_start:
+                # 全部组件就绪后才接受按键（失败的组件一直重试）
+                while self.running and not self.supervisor.wait_all(1.0):
+                    pass
+                if not self.running:
+                    return False
+            threading.Thread(target=self._report_warmup, name="warmup-report", daemon=True).start()
+        elif self.warmup is not None:
+            # 快速启动：按钮立即可用，预热完成前按下的任务在流水线中排队
+            self.warmup.start(PRINTER, self.printer.initialize)
+            self.warmup.start(CAMERA, self.camera.initialize)
+            self.warmup.start(AI, self.ai_service.initialize)
+            threading.Thread(target=self._report_warmup, name="warmup-report", daemon=True).start()
+        else:
+            # 初始化打印机
+            if not self.printer.initialize():
+                self.logger.error("打印机初始化失败")
+                return False
+            
+            # 初始化相机
+            if not self.camera.initialize():
+                self.logger.error("相机初始化失败")
+                return False
+            
+            # 初始化AI服务（长连接客户端）
+            if not self.ai_service.initialize():
+                self.logger.error("AI服务初始化失败")
+                return False
         
-        # 初始化相机
-        if not self.camera.initialize():
-            self.logger.error("相机初始化失败")
-            return False
+        # 启动拍照流水线
+        self.pipeline.start()
         
-        self.logger.info("所有组件初始化成功")
+        # 回放上次未处理完的离线任务
+        if self.offline_queue:
+            self.offline_queue.start()
+        
+        # 空闲时在后台重新压缩照片
+        self.image_store.start_maintenance(idle=self.pipeline.is_idle)
+        
+        # 局域网指标服务
+        tracer.start_server()
+        
+        # 空闲时按当前场景预生成诗歌
+        if self.speculator:
+            self.speculator.start(idle=self._speculation_idle)
+        
+        ready = time.monotonic() - BOOT_STARTED
+        tracer.record("startup.ready", ready)
+        if self.warmup is not None and config.fast_start:
+            self.logger.info("按钮已就绪 (启动 %.2fs)，其余组件后台预热中", ready)
+        else:
+            self.logger.info("所有组件初始化成功 (启动 %.2fs)", ready)
         self.logger.info("日志输出到: %s", config.log_path)
         self.logger.info("诗歌归档目录: %s", config.poems_dir)
         
         return True
     
-    def capture_and_print(self):
-        """执行拍照和打印流程"""
-        try:
-            self.logger.info("=" * 50)
-            self.logger.info("开始拍照...")
-            
-            # 拍照
-            image_path = self.camera.capture()
-            if not image_path:
-                self.logger.error("❌ 拍照失败")
-                return
-            
-            self.logger.info("✓ 拍照成功")
-            self.logger.info("正在处理图像...")
-            
-            # 生成诗歌
-            result = self.ai_service.process_image_to_poem(image_path)
-            if not result:
-                self.logger.error("❌ 诗歌生成失败")
-                return
-            
-            self.logger.info("✓ 诗歌生成成功")
-            self.logger.info("图像描述: %s", result.caption)
-            self.logger.info("生成的诗歌:\n%s", result.poem)
-            
-            # 打印诗歌
-            self.logger.info("开始打印...")
-            self.printer.print_poem(result.poem)
-
-            archived = self.archive.save(
-                poem=result.poem,
-                caption=result.caption,
-                image_path=image_path
-            )
-            if archived:
-                self.logger.info(
-                    "记录已归档 -> poem: %s, image: %s",
-                    archived.poem_path.name,
-                    archived.image_path.name
-                )
-            
-            self.logger.info("✓ 流程完成")
-            self.logger.info("=" * 50)
-            
-        except Exception as e:
-            self.logger.error(f"❌ 执行流程时出错: {e}", exc_info=True)
+    def _report_warmup(self):
+        """等待后台预热结束并记录启动耗时"""
+        if self.warmup.wait_all():
+            elapsed = time.monotonic() - BOOT_STARTED
+            tracer.record("startup.warm", elapsed)
+            self.logger.info("所有组件预热完成 (启动 %.2fs): %s", elapsed, self.warmup.describe())
+    
+    def _on_warmup_failure(self, name: str):
+        """后台初始化失败：与顺序启动时一样退出程序"""
+        self.logger.error("%s初始化失败，退出", LABELS[name])
+        self.running = False
+        self.gpio.wake()
+    
+    def _speculation_idle(self) -> bool:
+        """流水线空闲且网络可用时才预生成"""
+        if not self.pipeline.is_idle():
+            return False
+        return self.offline_queue is None or self.offline_queue.online
     
     def run(self):
         """主运行循环"""
@@ -175,39 +238,32 @@ class PoetryCamera:
             self.logger.info("=" * 50)
             self.logger.info("操作说明:")
             self.logger.info("  - 短按按钮: 拍照并打印诗歌")
-            self.logger.info("  - 长按按钮(2秒): 退出程序")
+            self.logger.info("  - 长按按钮(%s秒): 退出程序", config.button_long_press)
+            if config.button_double_window > 0:
+                self.logger.info("  - 双击按钮: 重新打印上一首")
             self.logger.info("  - Ctrl+C: 强制退出")
             self.logger.info("=" * 50)
             
-            wait_count = 0
-            
             while self.running:
-                # 等待按钮按下（带超时，以便可以响应 Ctrl+C）
-                press_type = self.gpio.wait_for_button_press(
-                    long_press_duration=2.0,
-                    timeout=2.0  # 2秒超时
-                )
-                
-                if press_type == "TIMEOUT":
-                    # 超时，继续循环
-                    wait_count += 1
-                    if wait_count % 5 == 0:  # 每10秒提示一次
-                        self.logger.info(f"等待按钮... ({wait_count * 2}秒)")
+                # 阻塞等待按钮事件（信号处理器会调用 gpio.wake() 唤醒）
+                event = self.gpio.wait_for_event()
+                if event is None:
                     continue
                 
-                elif press_type == "LONG":
+                if event.kind == "LONG":
                     # 长按 - 退出程序
                     self.logger.info("检测到长按，准备退出...")
                     break
                 
-                elif press_type == "SHORT":
-                    # 短按 - 拍照并打印
-                    wait_count = 0  # 重置计数
-                    self.logger.info("检测到短按，开始拍照...")
-                    self.capture_and_print()
+                elif event.kind == "SHORT":
+                    # 短按 - 提交到流水线，立即返回继续监听按钮
+                    self.logger.info("检测到短按，提交拍照任务...")
+                    self.pipeline.submit(pressed_at=event.pressed_at)
                 
-                # 短暂延迟，防止重复触发
-                time.sleep(0.5)
+                elif event.kind == "DOUBLE":
+                    # 双击 - 重新打印上一首
+                    self.logger.info("检测到双击，重新打印上一首...")
+                    self.pipeline.reprint_last()
         
         except KeyboardInterrupt:
             self.logger.info("\n收到键盘中断")
@@ -223,10 +279,26 @@ class PoetryCamera:
         self.logger.info("正在关闭诗歌相机...")
         
         try:
-            # 关闭各组件
+            # 不再重试故障组件，等待恢复中的任务随即放弃
+            if self.supervisor is not None:
+                self.supervisor.stop()
+            # 等待仍在进行的后台初始化，避免关闭初始化到一半的组件
+            if self.warmup is not None and not self.warmup.wait_all(config.warmup_timeout):
+                self.logger.warning("部分组件未完成初始化: %s", self.warmup.describe())
+            
+            # 先停止离线回放并处理完已排队的任务，再关闭各组件
+            if self.offline_queue:
+                self.offline_queue.stop()
+            if self.speculator:
+                self.speculator.stop()
+            self.pipeline.stop()
             self.camera.close()
+            self.image_store.close()
             self.printer.close()
             self.gpio.cleanup()
+            self.ai_service.shutdown()
+            self.archive.close()
+            tracer.close()
             
             self.logger.info("诗歌相机已关闭")
             
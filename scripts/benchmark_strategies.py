@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+比较两步调用（图像描述 + 诗歌生成）和单次调用（多模态模型）的端到端延迟
+
+用法: python scripts/benchmark_strategies.py [-n 轮数] 照片1.jpg [照片2.jpg ...]
+
+测试时关闭缓存，两种方式交替执行以抵消网络波动
+"""
+import argparse
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.ai_service import AIService
+
+
+def summarize(name: str, samples: list[float], failures: int):
+    if not samples:
+        print(f"{name:10s} 全部失败 ({failures} 次)")
+        return
+    ordered = sorted(samples)
+    p95 = ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)]
+    print(
+        f"{name:10s} 成功 {len(samples):3d}  失败 {failures:3d}  "
+        f"平均 {statistics.mean(samples):6.2f}s  p50 {statistics.median(samples):6.2f}s  p95 {p95:6.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较两步调用与单次调用的端到端延迟")
+    parser.add_argument("images", nargs="+", type=Path, help="测试照片")
+    parser.add_argument("-n", "--rounds", type=int, default=3, help="每张照片的轮数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    ai_service = AIService()
+    # 关闭缓存，每次都真实调用
+    ai_service.cache = None
+    if not ai_service.initialize():
+        print("❌ AI服务初始化失败")
+        return
+
+    strategies = {"two_step": ai_service.two_step_to_poem_async}
+    if ai_service.vision_llm.providers:
+        strategies["vision"] = ai_service.vision_to_poem_async
+    else:
+        print("⚠️ 未配置 VISION_PROVIDERS，只测试两步调用")
+
+    samples = {name: [] for name in strategies}
+    failures = {name: 0 for name in strategies}
+    try:
+        for round_no in range(1, args.rounds + 1):
+            for image in args.images:
+                data = image.read_bytes()
+                for name, run in strategies.items():
+                    started = time.monotonic()
+                    result = ai_service.run(run(data))
+                    elapsed = time.monotonic() - started
+                    if result:
+                        samples[name].append(elapsed)
+                    else:
+                        failures[name] += 1
+                    print(f"[{round_no}] {image.name} {name}: {elapsed:.2f}s {'✓' if result else '✗'}")
+    finally:
+        ai_service.shutdown()
+
+    print()
+    for name in strategies:
+        summarize(name, samples[name], failures[name])
+
+
+if __name__ == "__main__":
+    main()
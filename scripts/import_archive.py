@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+把旧版 poems.jsonl + poem_*.txt 归档导入 SQLite 数据库
+
+可重复执行，已导入的记录会被跳过
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.archive_db import PoemDatabase
+from src.config import config
+
+
+def main():
+    index_path = config.poems_dir / "poems.jsonl"
+    if len(sys.argv) > 1:
+        index_path = Path(sys.argv[1])
+
+    if not index_path.exists():
+        print(f"❌ 找不到归档索引: {index_path}")
+        return
+
+    db = PoemDatabase()
+    try:
+        imported = db.import_legacy(index_path)
+        print(f"✅ 导入 {imported} 条，数据库共 {db.count()} 条: {db.path}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,55 @@ AI服务模块
 
 封装图像识别和诗歌生成API调用
 """
+import asyncio
+import hashlib
+import io
+import json
 import logging
+import random
+import threading
+import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
-import httpx
-import replicate
-from tenacity import retry, stop_after_attempt, wait_fixed
+from typing import IO, TYPE_CHECKING, Any, AsyncIterator, Callable, Coroutine, Optional, TypeVar, Union
 
+from .cache import AICache, dhash
+from .captioners import CaptionRouter, LlamaCppCaptioner, LlamaServerCaptioner, ReplicateCaptioner, data_uri
 from .config import config
+from .imaging import mime_type_of, prepare_for_upload
+from .llm_router import BATCH, LLMRouter, parse_providers, providers_from_config
+from .resilience import Budget, bind_budget, budget_exhausted, budget_slice, current_budget
+from .tracing import tracer
+from .utils import LineWrapper
+
+if TYPE_CHECKING:
+    # httpx 和 replicate 导入较慢，推迟到 initialize() 创建客户端时
+    import httpx
+    import replicate
+
+
+T = TypeVar("T")
+
+# 图像输入：文件路径或内存中的JPEG字节
+ImageInput = Union[Path, bytes]
+
+
+def open_image(image: ImageInput, filename: str = "image.jpg") -> IO[bytes]:
+    """
+    以二进制文件对象打开图像输入
+    
+    Args:
+        image: 文件路径或编码后的图像字节
+        filename: 内存数据使用的文件名（上传时据此识别类型）
+        
+    Returns:
+        可读取的文件对象
+    """
+    if isinstance(image, bytes):
+        buffer = io.BytesIO(image)
+        buffer.name = filename
+        return buffer
+    return open(image, "rb")
 
 
 @dataclass
@@ -19,6 +59,8 @@ class PoemResult:
     """AI生成结果"""
     caption: str
     poem: str
+    # 时间预算用尽时使用的备用诗歌（不写入缓存）
+    fallback: bool = False
 
 
 class AIService:
@@ -44,6 +86,50 @@ class AIService:
 场景描述: {description}
 """
     
+    # 单次调用模式：照片随提示词一起发给多模态模型，要求同时返回描述和诗歌
+    VISION_OUTPUT_INSTRUCTION = """
+场景描述就是随附的照片。先用一句简短的英文描述照片中的场景，再根据照片写诗。
+只输出一个 JSON 对象，不要输出其他内容，格式为:
+{"caption": "照片的英文描述", "poem": "诗歌全文"}
+"""
+    
+    # 突发模式：一次请求为多个场景各写一首诗
+    BATCH_OUTPUT_INSTRUCTION = """
+上面共有 {count} 个编号的场景，为每个场景各写一首诗，各首之间不要重复用词和意象。
+只输出一个 JSON 对象，不要输出其他内容，poems 按场景编号顺序排列，格式为:
+{{"poems": ["第1个场景的诗歌全文", "第2个场景的诗歌全文", ...]}}
+"""
+    
+    # 时间预算用尽时随机选用的备用诗歌
+    FALLBACK_POEMS = (
+        """镜头多看了你一会儿
+想把你记得更清楚一些
+可是今天的字
+走得比平时慢
+先把这张纸给你
+空白的地方
+留给你回家的路上
+自己写完""",
+        """快门响过之后
+光还留在你的肩上
+我找了很久
+没找到合适的词
+就把这一小片光
+原样递给你
+折起来
+放进口袋""",
+        """你站过的地方
+鞋印还是温的
+风从窗缝进来
+翻动桌上的纸
+它们都没有开口
+我也学着它们
+把这一页
+空着留给你""",
+    )
+    
+    REPLICATE_URL = "https://api.replicate.com/v1/"
+    
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         
@@ -51,41 +137,259 @@ class AIService:
         if config.replicate_api_token:
             import os
             os.environ['REPLICATE_API_TOKEN'] = config.replicate_api_token
+        
+        # 后台事件循环与长连接客户端（在 initialize() 中创建）
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._http: Optional["httpx.AsyncClient"] = None
+        self._lan_http: Optional["httpx.AsyncClient"] = None
+        self._replicate: Optional["replicate.Client"] = None
+        
+        # 图像描述后端（远程 BLIP-2 / 本地 llama.cpp / 局域网 llama.cpp server）
+        self.captioner = CaptionRouter([
+            ReplicateCaptioner(lambda: self._replicate, open_image),
+            LlamaCppCaptioner(),
+            LlamaServerCaptioner(lambda: self._lan_http),
+        ])
+        # 诗歌生成提供方（DeepSeek 及 LLM_PROVIDERS 中的 OpenAI 兼容接口）
+        self.llm = LLMRouter(providers_from_config(), lambda: self._http)
+        # 多模态提供方（AI_STRATEGY=vision 时使用）
+        self.vision_llm = LLMRouter(parse_providers(config.vision_providers), lambda: self._http)
+        self._init_lock = threading.Lock()
+        
+        # 结果缓存（提示词变化时诗歌缓存自动失效）
+        self.cache = AICache() if config.cache_enabled else None
+        self.prompt_version = hashlib.sha1(
+            (self.SYSTEM_PROMPT + self.PROMPT_TEMPLATE).encode("utf-8")
+        ).hexdigest()[:12]
+        
+        if config.ai_strategy == "vision" and not self.vision_llm.providers:
+            self.logger.warning("AI_STRATEGY=vision 但未配置 VISION_PROVIDERS，使用两步模式")
     
-    def generate_image_caption(self, image_path: Path) -> Optional[str]:
+    def initialize(self) -> bool:
         """
-        使用BLIP-2生成图像描述
+        启动后台事件循环并创建共享的 HTTP 客户端
+        
+        Returns:
+            是否成功初始化
+        """
+        with self._init_lock:
+            if self._loop is not None:
+                return True
+            
+            try:
+                self.logger.info("正在初始化AI服务...")
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever,
+                    name="ai-service-loop",
+                    daemon=True
+                )
+                thread.start()
+                
+                asyncio.run_coroutine_threadsafe(self._open_clients(), loop).result()
+                
+                self._loop = loop
+                self._loop_thread = thread
+                # 本地模型在后台加载，首次拍照时已就绪
+                self.captioner.warm()
+                self.logger.info(
+                    "AI服务初始化成功 (HTTP/2: %s, 连接池: %s)",
+                    config.http2_enabled,
+                    config.http_max_connections
+                )
+                return True
+                
+            except Exception as e:
+                self.logger.error(f"AI服务初始化失败: {e}", exc_info=True)
+                return False
+    
+    async def _open_clients(self):
+        """在事件循环内创建长连接客户端"""
+        import httpx
+        import replicate
+        
+        # 连接超时单独设置：网络不通时尽早失败，不占用整段读超时
+        timeout = httpx.Timeout(config.http_timeout, connect=config.http_connect_timeout)
+        limits = httpx.Limits(
+            max_connections=config.http_max_connections,
+            max_keepalive_connections=config.http_max_keepalive,
+            keepalive_expiry=config.http_keepalive_expiry
+        )
+        self._http = httpx.AsyncClient(
+            http2=config.http2_enabled,
+            limits=limits,
+            timeout=timeout
+        )
+        # 局域网描述服务使用独立客户端（不启用 HTTP/2）
+        self._lan_http = httpx.AsyncClient(http2=False, limits=limits, timeout=timeout)
+        # Replicate 客户端同样复用带连接池的传输层
+        self._replicate = replicate.Client(
+            api_token=config.replicate_api_token or None,
+            base_url=config.replicate_base_url or None,
+            timeout=timeout,
+            transport=httpx.AsyncHTTPTransport(http2=config.http2_enabled, limits=limits)
+        )
+    
+    async def _close_clients(self):
+        """在事件循环内关闭客户端"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._lan_http is not None:
+            await self._lan_http.aclose()
+            self._lan_http = None
+        if self._replicate is not None:
+            await self._replicate._async_client.aclose()
+            self._replicate = None
+    
+    def run(
+        self,
+        coro: Coroutine[Any, Any, T],
+        timeout: Optional[float] = None,
+        budget: Optional[Budget] = None
+    ) -> T:
+        """
+        在后台事件循环中执行协程并等待结果（供同步代码调用）
         
         Args:
-            image_path: 图像文件路径
+            coro: 要执行的协程
+            timeout: 等待超时（秒）
+            budget: 本次按键的时间预算（为None时不限时，也不使用备用诗歌）
+            
+        Returns:
+            协程返回值
+        """
+        if self._loop is None and not self.initialize():
+            coro.close()
+            raise RuntimeError("AI服务未初始化")
+        # 调用方线程的追踪 ID 和时间预算随协程带入事件循环
+        coro = tracer.bind_coro(bind_budget(coro, budget))
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+    
+    def _caption_allowance(self) -> Optional[float]:
+        """
+        图像描述可用的秒数：为诗歌生成预留其近期 p95，
+        但至少留给图像描述剩余预算的 AI_CAPTION_SHARE（没有预算时返回None）
+        """
+        budget = current_budget()
+        if budget is None:
+            return None
+        remaining = budget.remaining()
+        ceiling = remaining * (1 - config.ai_caption_share)
+        candidates = self.llm.candidates()
+        expected = candidates[0].p95() if candidates else None
+        return remaining - (ceiling if expected is None else min(expected, ceiling))
+    
+    def fallback_result(self, caption: str = "") -> Optional[PoemResult]:
+        """
+        时间预算用尽时的备用诗歌
+        
+        Returns:
+            备用结果，AI_FALLBACK_POEM=false 时返回None
+        """
+        if not config.ai_fallback_poem:
+            return None
+        self.logger.warning("时间预算已用尽，使用备用诗歌")
+        return PoemResult(caption=caption, poem=random.choice(self.FALLBACK_POEMS), fallback=True)
+    
+    def shutdown(self):
+        """关闭 HTTP 客户端并停止事件循环"""
+        with self._init_lock:
+            if self._loop is None:
+                return
+            
+            try:
+                self.logger.info("正在关闭AI服务...")
+                asyncio.run_coroutine_threadsafe(self._close_clients(), self._loop).result(5)
+            except Exception as e:
+                self.logger.error(f"关闭AI服务客户端时出错: {e}", exc_info=True)
+            finally:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                if self._loop_thread:
+                    self._loop_thread.join(5)
+                self._loop.close()
+                self._loop = None
+                self._loop_thread = None
+                self.captioner.close()
+                if self.llm.providers:
+                    self.logger.info("诗歌生成提供方: %s", self.llm.describe())
+                if self.vision_llm.providers:
+                    self.logger.info("多模态提供方: %s", self.vision_llm.describe())
+                if self.cache:
+                    self.cache.flush()
+                    self.logger.info("AI缓存统计: %s", self.cache.stats.describe())
+                self.logger.info("AI服务已关闭")
+    
+    async def _prepare_image(self, image: ImageInput) -> tuple[ImageInput, str, Optional[int]]:
+        """
+        上传前预处理图像并计算感知哈希
+        
+        Returns:
+            (上传用图像, MIME 类型, 感知哈希；未启用缓存或计算失败时为None)
+        """
+        mime_type = mime_type_of(image) if isinstance(image, bytes) else "image/jpeg"
+        if config.upload_preprocess:
+            try:
+                prepared = await asyncio.to_thread(prepare_for_upload, image)
+                self.logger.info(f"上传图像: {prepared.describe()}")
+                image = prepared.data
+                mime_type = prepared.mime_type
+            except Exception as e:
+                self.logger.warning(f"图像预处理失败，上传原图: {e}")
+        
+        image_hash = None
+        if self.cache:
+            try:
+                image_hash = await asyncio.to_thread(dhash, image)
+            except Exception as e:
+                self.logger.warning(f"计算图像哈希失败，跳过缓存: {e}")
+        return image, mime_type, image_hash
+    
+    @tracer.traced("ai.caption")
+    async def generate_image_caption_async(self, image: ImageInput) -> Optional[str]:
+        """
+        生成图像描述（按 CAPTION_BACKEND 选择远程或本地后端）
+        
+        Args:
+            image: 图像文件路径或内存中的JPEG字节
             
         Returns:
             图像描述文本，失败返回None
         """
+        image, mime_type, image_hash = await self._prepare_image(image)
+        if image_hash is not None:
+            cached = self.cache.get_caption(image_hash)
+            if cached:
+                self.logger.info(f"图像描述(缓存): {cached}")
+                return cached
+        
         try:
-            self.logger.info(f"正在分析图像: {image_path}")
-            
-            with open(image_path, "rb") as f:
-                output = replicate.run(
-                    "andreasjansson/blip-2:4b32258c42e9efd4288bb9910bc532a69727f9acd26aa08e175713a0a857a608",
-                    input={
-                        "image": f,
-                        "caption": True,
-                    }
-                )
+            if isinstance(image, bytes):
+                self.logger.info(f"正在分析图像: <内存 {len(image) // 1024} KB>")
+            else:
+                self.logger.info(f"正在分析图像: {image}")
+            started = time.monotonic()
             
-            caption = str(output).strip()
+            # 图像描述只能用去预算的一部分，其余留给诗歌生成
+            with budget_slice(self._caption_allowance()):
+                caption = await self.captioner.caption(image, mime_type)
+            if not caption:
+                self.logger.error("所有图像描述后端均失败")
+                return None
             self.logger.info(f"图像描述: {caption}")
+            
+            if self.cache and image_hash is not None and caption:
+                self.cache.put_caption(image_hash, caption, time.monotonic() - started)
             return caption
             
         except Exception as e:
             self.logger.error(f"图像识别失败: {e}", exc_info=True)
             return None
     
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-    def _call_deepseek_api(self, messages: list) -> dict:
+    async def _call_deepseek_api(self, messages: list) -> dict:
         """
-        调用DeepSeek API（带重试机制）
+        调用诗歌生成接口（由 LLMRouter 选择提供方、对冲慢请求并在失败时切换）
         
         Args:
             messages: 消息列表
@@ -93,23 +397,46 @@ class AIService:
         Returns:
             API响应
         """
-        url = "https://api.deepseek.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {config.deepseek_api_key}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": "deepseek-chat",
-            "messages": messages,
-            "stream": False
-        }
-        
-        with httpx.Client(timeout=config.http_timeout) as client:
-            response = client.post(url, json=data, headers=headers)
-            response.raise_for_status()
-            return response.json()
+        return await self.llm.complete(messages)
     
-    def generate_poem(self, image_description: str, poem_format: str = "8行自由诗") -> Optional[str]:
+    async def _stream_deepseek_api(self, messages: list) -> AsyncIterator[str]:
+        """
+        以流式（SSE）方式调用诗歌生成接口
+        
+        Args:
+            messages: 消息列表
+            
+        Yields:
+            逐段到达的文本增量
+        """
+        async for delta in self.llm.stream(messages):
+            yield delta
+    
+    def _build_messages(self, image_description: str, poem_format: str) -> list:
+        """构建诗歌生成的消息列表"""
+        # 构建提示词
+        user_prompt = self.PROMPT_TEMPLATE.format(
+            format=poem_format,
+            description=image_description
+        )
+        
+        # 清理特殊字符
+        user_prompt = user_prompt.replace("[", "").replace("]", "")
+        user_prompt = user_prompt.replace("{", "").replace("}", "")
+        
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def _poem_cache_key(self, image_description: str, poem_format: str) -> Optional[str]:
+        """诗歌缓存键，未启用缓存时返回None"""
+        if not self.cache:
+            return None
+        return self.cache.poem_key(image_description, poem_format, self.prompt_version)
+    
+    @tracer.traced("ai.poem")
+    async def generate_poem_async(self, image_description: str, poem_format: str = "8行自由诗") -> Optional[str]:
         """
         根据图像描述生成诗歌
         
@@ -120,57 +447,423 @@ class AIService:
         Returns:
             生成的诗歌，失败返回None
         """
+        cache_key = self._poem_cache_key(image_description, poem_format)
+        if cache_key:
+            cached = self.cache.get_poem(cache_key)
+            if cached:
+                return cached
+        
         try:
             self.logger.info("正在生成诗歌...")
+            started = time.monotonic()
             
-            # 构建提示词
-            user_prompt = self.PROMPT_TEMPLATE.format(
-                format=poem_format,
-                description=image_description
-            )
+            messages = self._build_messages(image_description, poem_format)
+            result = await self._call_deepseek_api(messages)
+            poem = result['choices'][0]['message']['content'].strip()
             
-            # 清理特殊字符
-            user_prompt = user_prompt.replace("[", "").replace("]", "")
-            user_prompt = user_prompt.replace("{", "").replace("}", "")
+            self.logger.info("诗歌生成成功")
+            self.logger.info(f"生成的诗歌:\n{poem}")
             
-            # 调用API
-            messages = [
-                {"role": "system", "content": self.SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ]
+            if cache_key and poem:
+                self.cache.add_poem(cache_key, poem, time.monotonic() - started)
+            return poem
             
-            result = self._call_deepseek_api(messages)
-            poem = result['choices'][0]['message']['content'].strip()
+        except Exception as e:
+            self.logger.error(f"诗歌生成失败: {e}", exc_info=True)
+            return None
+    
+    @tracer.traced("ai.poem_stream")
+    async def stream_poem_async(
+        self,
+        image_description: str,
+        on_line: Callable[[str], None],
+        poem_format: str = "8行自由诗",
+        width: int = 32
+    ) -> Optional[str]:
+        """
+        流式生成诗歌，每凑满一行（按打印宽度换行）立即回调
+        
+        Args:
+            image_description: 图像描述
+            on_line: 每完成一行时的回调（在事件循环线程中调用）
+            poem_format: 诗歌格式
+            width: 打印宽度（与 wrap_text 一致）
+            
+        Returns:
+            完整的诗歌，失败返回None（已回调的行不会撤回）
+        """
+        wrapper = LineWrapper(width)
+        chunks = []
+        started = False
+        pending_blank = 0
+        
+        def emit(lines: list[str]):
+            nonlocal started, pending_blank
+            for line in lines:
+                # 去掉开头的空行，结尾的空行等有后续内容时再补发
+                if not line.strip():
+                    if started:
+                        pending_blank += 1
+                    continue
+                for _ in range(pending_blank):
+                    on_line("")
+                pending_blank = 0
+                started = True
+                on_line(line)
+        
+        cache_key = self._poem_cache_key(image_description, poem_format)
+        if cache_key:
+            cached = self.cache.get_poem(cache_key)
+            if cached:
+                emit(wrapper.feed(cached))
+                emit(wrapper.flush())
+                return cached
+        
+        try:
+            self.logger.info("正在流式生成诗歌...")
+            t0 = time.monotonic()
+            
+            messages = self._build_messages(image_description, poem_format)
+            async for delta in self._stream_deepseek_api(messages):
+                chunks.append(delta)
+                emit(wrapper.feed(delta))
+            emit(wrapper.flush())
+            
+            poem = "".join(chunks).strip()
+            if not poem:
+                self.logger.error("流式生成返回空内容")
+                return None
             
             self.logger.info("诗歌生成成功")
             self.logger.info(f"生成的诗歌:\n{poem}")
             
+            if cache_key:
+                self.cache.add_poem(cache_key, poem, time.monotonic() - t0)
             return poem
             
         except Exception as e:
-            self.logger.error(f"诗歌生成失败: {e}", exc_info=True)
+            self.logger.error(f"流式诗歌生成失败: {e}", exc_info=True)
+            # 还没打印任何诗句时改为打印备用诗歌
+            fallback = self.fallback_result(image_description) if not chunks and budget_exhausted() else None
+            if fallback is None:
+                return None
+            emit(wrapper.feed(fallback.poem))
+            emit(wrapper.flush())
+            return fallback.poem
+    
+    def _build_vision_messages(self, image: ImageInput, mime_type: str, poem_format: str) -> list:
+        """构建单次调用模式的消息列表（照片 + 诗歌提示词 + 结构化输出要求）"""
+        user_prompt = self.PROMPT_TEMPLATE.format(format=poem_format, description="见随附的照片")
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": [
+                {"type": "image_url", "image_url": {"url": data_uri(image, mime_type)}},
+                {"type": "text", "text": user_prompt + self.VISION_OUTPUT_INSTRUCTION},
+            ]}
+        ]
+    
+    @staticmethod
+    def _parse_vision_output(content: str) -> PoemResult:
+        """从模型输出中解析描述和诗歌（容忍 Markdown 代码块和前后多余文字）"""
+        start, end = content.find("{"), content.rfind("}")
+        if start < 0 or end <= start:
+            raise ValueError(f"未找到 JSON 输出: {content[:80]!r}")
+        data = json.loads(content[start:end + 1])
+        caption = str(data.get("caption") or "").strip()
+        poem = str(data.get("poem") or "").strip()
+        if not caption or not poem:
+            raise ValueError("输出缺少 caption 或 poem")
+        return PoemResult(caption=caption, poem=poem)
+    
+    @tracer.traced("ai.vision")
+    async def vision_to_poem_async(
+        self,
+        image: ImageInput,
+        poem_format: str = "8行自由诗"
+    ) -> Optional[PoemResult]:
+        """
+        单次调用：把照片直接发给多模态模型，同时得到描述和诗歌
+        
+        同一场景的描述已在缓存中时只生成诗歌（诗歌缓存同样适用）
+        
+        Args:
+            image: 图像文件路径或内存中的JPEG字节
+            poem_format: 诗歌格式
+            
+        Returns:
+            生成结果，失败返回None
+        """
+        image, mime_type, image_hash = await self._prepare_image(image)
+        if image_hash is not None:
+            cached = self.cache.get_caption(image_hash)
+            if cached:
+                self.logger.info(f"图像描述(缓存): {cached}")
+                poem = await self.generate_poem_async(cached, poem_format)
+                return PoemResult(caption=cached, poem=poem) if poem else None
+        
+        try:
+            self.logger.info("正在以单次调用生成描述和诗歌...")
+            started = time.monotonic()
+            
+            messages = self._build_vision_messages(image, mime_type, poem_format)
+            response = await self.vision_llm.complete(
+                messages, response_format={"type": "json_object"}
+            )
+            result = self._parse_vision_output(response['choices'][0]['message']['content'])
+            elapsed = time.monotonic() - started
+            self.logger.info(f"图像描述: {result.caption}")
+            self.logger.info(f"生成的诗歌:\n{result.poem}")
+            
+            if self.cache:
+                if image_hash is not None:
+                    self.cache.put_caption(image_hash, result.caption, elapsed)
+                cache_key = self._poem_cache_key(result.caption, poem_format)
+                self.cache.add_poem(cache_key, result.poem, elapsed)
+            return result
+            
+        except Exception as e:
+            self.logger.error(f"单次调用生成失败: {e}", exc_info=True)
             return None
     
-    def process_image_to_poem(self, image_path: Path) -> Optional[PoemResult]:
+    async def two_step_to_poem_async(self, image: ImageInput) -> Optional[PoemResult]:
         """
-        完整流程：图像 -> 描述 -> 诗歌
+        两步调用：图像 -> 描述 -> 诗歌
+        
+        时间预算用尽时返回备用诗歌（未启用时返回None）
         
         Args:
-            image_path: 图像文件路径
+            image: 图像文件路径或内存中的JPEG字节
             
         Returns:
-            生成的诗歌，失败返回None
+            生成结果，失败返回None
         """
         # 生成图像描述
-        caption = self.generate_image_caption(image_path)
+        caption = await self.generate_image_caption_async(image)
         if not caption:
             self.logger.error("无法生成图像描述")
-            return None
+            return self.fallback_result() if budget_exhausted() else None
         
         # 生成诗歌
-        poem = self.generate_poem(caption)
+        poem = await self.generate_poem_async(caption)
         if not poem:
             self.logger.error("无法生成诗歌")
-            return None
+            return self.fallback_result(caption) if budget_exhausted() else None
         
         return PoemResult(caption=caption, poem=poem)
+    
+    def _build_batch_messages(self, captions: list[str], poem_format: str) -> list:
+        """构建批量生成的消息列表（编号的场景描述 + 结构化输出要求）"""
+        scenes = "\n".join(f"{i}. {caption}" for i, caption in enumerate(captions, 1))
+        user_prompt = self.PROMPT_TEMPLATE.format(format=poem_format, description="\n" + scenes)
+        
+        # 清理特殊字符
+        user_prompt = user_prompt.replace("[", "").replace("]", "")
+        user_prompt = user_prompt.replace("{", "").replace("}", "")
+        
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt + self.BATCH_OUTPUT_INSTRUCTION.format(count=len(captions))}
+        ]
+    
+    @staticmethod
+    def _parse_batch_output(content: str, count: int) -> list[str]:
+        """从模型输出中解析按场景顺序排列的诗歌（空字符串表示该首缺失）"""
+        start, end = content.find("{"), content.rfind("}")
+        if start < 0 or end <= start:
+            raise ValueError(f"未找到 JSON 输出: {content[:80]!r}")
+        poems = json.loads(content[start:end + 1]).get("poems")
+        if not isinstance(poems, list) or len(poems) != count:
+            found = len(poems) if isinstance(poems, list) else 0
+            raise ValueError(f"期望 {count} 首诗，实际 {found} 首")
+        return [str(poem or "").strip() for poem in poems]
+    
+    @tracer.traced("ai.poem_batch")
+    async def generate_poems_batch_async(
+        self,
+        captions: list[str],
+        poem_format: str = "8行自由诗"
+    ) -> Optional[list[Optional[str]]]:
+        """
+        一次请求为多个图像描述各生成一首诗（命中诗歌缓存的不再请求）
+        
+        Args:
+            captions: 图像描述列表
+            poem_format: 诗歌格式
+            
+        Returns:
+            与 captions 一一对应的诗歌（缺失的为None），请求失败返回None
+        """
+        keys = [self._poem_cache_key(caption, poem_format) for caption in captions]
+        poems: list[Optional[str]] = [self.cache.get_poem(key) if key else None for key in keys]
+        pending = [i for i, poem in enumerate(poems) if not poem]
+        if not pending:
+            return poems
+        
+        try:
+            self.logger.info("正在批量生成 %s 首诗歌...", len(pending))
+            started = time.monotonic()
+            
+            messages = self._build_batch_messages([captions[i] for i in pending], poem_format)
+            response = await self.llm.complete(
+                messages, kind=BATCH, response_format={"type": "json_object"}
+            )
+            generated = self._parse_batch_output(response['choices'][0]['message']['content'], len(pending))
+            elapsed = time.monotonic() - started
+            self.logger.info("批量生成 %s 首诗歌成功 (%.2fs)", len(pending), elapsed)
+            
+            for i, poem in zip(pending, generated):
+                poems[i] = poem or None
+                if keys[i] and poem:
+                    self.cache.add_poem(keys[i], poem, elapsed / len(pending))
+            return poems
+            
+        except Exception as e:
+            self.logger.error(f"批量生成诗歌失败: {e}", exc_info=True)
+            return None
+    
+    async def process_burst_async(
+        self,
+        images: list[ImageInput],
+        trace_ids: Optional[list[Optional[str]]] = None
+    ) -> list[Optional[PoemResult]]:
+        """
+        突发模式：一批照片并发获取描述（并发数受 BURST_CAPTION_CONCURRENCY 限制），
+        诗歌以一次请求批量生成；批量请求失败或漏掉的诗逐首补生成。
+        整批共用一个时间预算，用尽时未完成的照片使用备用诗歌
+        
+        单次调用模式下每张照片各自调用多模态模型（同样受并发上限约束）
+        
+        Args:
+            images: 按按键顺序排列的照片
+            trace_ids: 各照片所属任务的追踪 ID（描述请求的耗时记入对应任务）
+            
+        Returns:
+            与 images 一一对应的生成结果，失败的为None
+        """
+        trace_ids = trace_ids or [None] * len(images)
+        semaphore = asyncio.Semaphore(max(config.burst_caption_concurrency, 1))
+        
+        async def bounded(coro: Coroutine[Any, Any, T]) -> T:
+            async with semaphore:
+                return await coro
+        
+        if self.uses_vision:
+            return list(await asyncio.gather(*(
+                bounded(tracer.bind_coro(self.process_image_to_poem_async(image), trace_id))
+                for image, trace_id in zip(images, trace_ids)
+            )))
+        
+        captions = await asyncio.gather(*(
+            bounded(tracer.bind_coro(self.generate_image_caption_async(image), trace_id))
+            for image, trace_id in zip(images, trace_ids)
+        ))
+        indexes = [i for i, caption in enumerate(captions) if caption]
+        poems: list[Optional[str]] = [None] * len(images)
+        if indexes:
+            batch = await self.generate_poems_batch_async([captions[i] for i in indexes])
+            for i, poem in zip(indexes, batch or []):
+                poems[i] = poem
+        
+        missing = [i for i in indexes if not poems[i]]
+        if missing:
+            self.logger.warning("批量生成缺少 %s 首，逐首补生成", len(missing))
+            retried = await asyncio.gather(*(
+                tracer.bind_coro(self.generate_poem_async(captions[i]), trace_ids[i]) for i in missing
+            ))
+            for i, poem in zip(missing, retried):
+                poems[i] = poem
+        
+        results = [
+            PoemResult(caption=caption, poem=poem) if caption and poem else None
+            for caption, poem in zip(captions, poems)
+        ]
+        if budget_exhausted():
+            results = [result or self.fallback_result(caption or "") for result, caption in zip(results, captions)]
+        return results
+    
+    @property
+    def uses_vision(self) -> bool:
+        """当前是否使用单次调用模式"""
+        return config.ai_strategy == "vision" and bool(self.vision_llm.providers)
+    
+    async def process_image_to_poem_async(self, image: ImageInput) -> Optional[PoemResult]:
+        """
+        完整流程：图像 -> 描述 + 诗歌
+        
+        AI_STRATEGY=vision 时单次调用多模态模型，失败时退回两步调用
+        
+        Args:
+            image: 图像文件路径或内存中的JPEG字节
+            
+        Returns:
+            生成的诗歌，失败返回None
+        """
+        if self.uses_vision:
+            result = await self.vision_to_poem_async(image)
+            if result:
+                return result
+            self.logger.warning("单次调用失败，退回两步调用")
+        return await self.two_step_to_poem_async(image)
+    
+    async def check_connectivity_async(self) -> bool:
+        """
+        探测所用服务是否可达（收到任何 HTTP 响应即视为可达）
+        
+        两步模式探测 Replicate 和首选诗歌生成提供方，单次调用模式探测首选多模态提供方
+        
+        Returns:
+            服务是否都可达
+        """
+        router = self.vision_llm if self.uses_vision else self.llm
+        candidates = router.candidates()
+        if not candidates:
+            return False
+        urls = [candidates[0].url]
+        if not self.uses_vision:
+            urls.append(config.replicate_base_url.rstrip("/") + "/v1/" if config.replicate_base_url else self.REPLICATE_URL)
+        try:
+            await asyncio.gather(*(
+                self._http.head(url, timeout=config.offline_probe_timeout) for url in urls
+            ))
+            return True
+        except Exception as e:
+            self.logger.debug("网络探测失败: %s", e)
+            return False
+    
+    def check_connectivity(self) -> bool:
+        """同步版本的 check_connectivity_async"""
+        try:
+            return self.run(self.check_connectivity_async())
+        except Exception:
+            return False
+    
+    def generate_image_caption(self, image: ImageInput, budget: Optional[Budget] = None) -> Optional[str]:
+        """同步版本的 generate_image_caption_async"""
+        return self.run(self.generate_image_caption_async(image), budget=budget)
+    
+    def generate_poem(self, image_description: str, poem_format: str = "8行自由诗") -> Optional[str]:
+        """同步版本的 generate_poem_async"""
+        return self.run(self.generate_poem_async(image_description, poem_format))
+    
+    def generate_poem_stream(
+        self,
+        image_description: str,
+        on_line: Callable[[str], None],
+        poem_format: str = "8行自由诗",
+        budget: Optional[Budget] = None
+    ) -> Optional[str]:
+        """同步版本的 stream_poem_async"""
+        return self.run(self.stream_poem_async(image_description, on_line, poem_format), budget=budget)
+    
+    def process_image_to_poem(self, image: ImageInput, budget: Optional[Budget] = None) -> Optional[PoemResult]:
+        """同步版本的 process_image_to_poem_async"""
+        return self.run(self.process_image_to_poem_async(image), budget=budget)
+    
+    def process_burst(
+        self,
+        images: list[ImageInput],
+        trace_ids: Optional[list[Optional[str]]] = None,
+        budget: Optional[Budget] = None
+    ) -> list[Optional[PoemResult]]:
+        """同步版本的 process_burst_async"""
+        return self.run(self.process_burst_async(images, trace_ids), budget=budget)
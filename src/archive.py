@@ -1,14 +1,38 @@
 """
 诗歌归档模块
+
+归档在独立的写入线程中完成：save() 只把记录放入内存队列，
+写入线程按批提交（每批一次 fsync），打印流程不再等待存储
 """
 import json
 import logging
+import os
+import queue
+import threading
+import time
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
+from .archive_db import PoemDatabase, PoemRecord
 from .config import config
+from .tracing import current_trace_id, tracer
+
+
+def _relative(path: Path) -> Path:
+    """项目内的路径转为相对路径"""
+    try:
+        return path.relative_to(config.project_root)
+    except ValueError:
+        return path
+
+
+def atomic_write_text(path: Path, text: str):
+    """先写临时文件再重命名，文件要么是旧内容要么是完整的新内容"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
 
 
 @dataclass
@@ -16,29 +40,39 @@ class PoemEntry:
     """保存一次打印结果"""
     poem: str
     caption: str
-    image_path: Path
-    poem_path: Path
+    image_path: Optional[Path]
+    # 文件归档时的诗歌文本路径（SQLite 归档时为None）
+    poem_path: Optional[Path]
     created_at: datetime
+    # SQLite 归档时的记录 id（写入线程提交后才有）
+    record_id: Optional[int] = None
+    # 所属按键的追踪 ID
+    trace_id: Optional[str] = None
 
-    def to_record(self) -> dict:
-        try:
-            poem_path = self.poem_path.relative_to(config.project_root)
-        except ValueError:
-            poem_path = self.poem_path
-
-        try:
-            image_path = self.image_path.relative_to(config.project_root)
-        except ValueError:
-            image_path = self.image_path
+    @property
+    def label(self) -> str:
+        """日志中显示的归档位置"""
+        if self.poem_path is not None:
+            return self.poem_path.name
+        if self.record_id is not None:
+            return f"#{self.record_id}"
+        return "(等待写入)"
 
+    def to_record(self) -> dict:
         return {
-            "poem_file": str(poem_path),
-            "image": str(image_path),
+            "poem_file": str(_relative(self.poem_path)) if self.poem_path is not None else None,
+            "image": str(_relative(self.image_path)) if self.image_path is not None else None,
             "caption": self.caption,
-            "created_at": self.created_at.isoformat(timespec="seconds")
+            "created_at": self.created_at.isoformat(timespec="seconds"),
+            # 日志中保留诗歌全文，崩溃后可据此恢复诗歌文件
+            "poem": self.poem
         }
 
 
+# 写入线程停止信号
+_STOP = object()
+
+
 class PoemArchive:
     """管理诗歌归档"""
 
@@ -48,28 +82,199 @@ class PoemArchive:
         self.archive_dir.mkdir(exist_ok=True)
         self.index_path = self.archive_dir / "poems.jsonl"
 
-    def save(self, poem: str, caption: str, image_path: Path) -> Optional[PoemEntry]:
-        """保存诗歌文本和元数据"""
+        self.db: Optional[PoemDatabase] = None
+        if config.archive_backend == "sqlite":
+            self.db = PoemDatabase()
+        else:
+            self.recover()
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name="archive-writer", daemon=True)
+        self._writer.start()
+
+    @tracer.traced("archive.save")
+    def save(self, poem: str, caption: str, image_path: Optional[Path]) -> Optional[PoemEntry]:
+        """
+        保存诗歌文本和元数据（放入写入队列后立即返回）
+
+        Returns:
+            归档条目，实际写入在后台完成
+        """
         try:
             timestamp = datetime.now()
-            identifier = timestamp.strftime("%Y%m%d_%H%M%S_%f")
-            poem_file = self.archive_dir / f"poem_{identifier}.txt"
-            poem_file.write_text(poem, encoding="utf-8")
+            poem_file = None
+            if self.db is None:
+                identifier = timestamp.strftime("%Y%m%d_%H%M%S_%f")
+                poem_file = self.archive_dir / f"poem_{identifier}.txt"
 
             entry = PoemEntry(
                 poem=poem,
                 caption=caption,
                 image_path=image_path,
                 poem_path=poem_file,
-                created_at=timestamp
+                created_at=timestamp,
+                trace_id=current_trace_id()
             )
-
-            with self.index_path.open("a", encoding="utf-8") as fh:
-                json.dump(entry.to_record(), fh, ensure_ascii=False)
-                fh.write("\n")
-
-            self.logger.info("诗歌已归档: %s", poem_file.name)
+            self._queue.put(entry)
             return entry
         except Exception:
             self.logger.exception("保存诗歌归档失败")
-            return None
\ No newline at end of file
+            return None
+
+    # ------------------------------------------------------------------
+    # 写入线程
+    # ------------------------------------------------------------------
+
+    def _import_legacy(self):
+        """首次启用数据库时导入旧版 JSONL/txt 归档（在写入线程中进行，不阻塞启动）"""
+        try:
+            if self.db.count() == 0 and self.index_path.exists():
+                self.logger.info("正在把旧版归档导入数据库...")
+                self.recover()
+                self.db.import_legacy(self.index_path)
+        except Exception:
+            self.logger.exception("导入旧版归档失败")
+
+    def _run(self):
+        """写入线程：先导入旧版归档，再攒批提交（导入期间的新记录在队列中等待）"""
+        if self.db is not None:
+            self._import_legacy()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + config.archive_batch_window
+            while len(batch) < config.archive_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                with tracer.span(
+                    "archive.commit",
+                    batch=len(batch),
+                    traces=[entry.trace_id for entry in batch if entry.trace_id]
+                ):
+                    self._commit(batch)
+            except Exception:
+                self.logger.exception("诗歌归档写入失败 (%s 条)", len(batch))
+
+    def _commit(self, batch: list[PoemEntry]):
+        """提交一批归档"""
+        started = time.monotonic()
+        if self.db is not None:
+            records = [
+                PoemRecord(
+                    id=None,
+                    created_at=entry.created_at,
+                    poem=entry.poem,
+                    caption=entry.caption,
+                    image=str(_relative(entry.image_path)) if entry.image_path is not None else None
+                )
+                for entry in batch
+            ]
+            # 一个事务，WAL + synchronous=FULL 下每次提交一次 fsync
+            self.db.add_many(records)
+            for entry, record in zip(batch, records):
+                entry.record_id = record.id
+        else:
+            # 先追加日志并 fsync（提交点），再写诗歌文件；
+            # 诗歌文件在提交后丢失或损坏可由 recover() 从日志恢复
+            with self.index_path.open("a", encoding="utf-8") as fh:
+                for entry in batch:
+                    fh.write(json.dumps(entry.to_record(), ensure_ascii=False) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+            for entry in batch:
+                atomic_write_text(entry.poem_path, entry.poem)
+
+        self.logger.info(
+            "诗歌已归档: %s (%s 条, %.0f ms)",
+            ", ".join(entry.label for entry in batch),
+            len(batch),
+            (time.monotonic() - started) * 1000
+        )
+
+    # ------------------------------------------------------------------
+    # 崩溃恢复
+    # ------------------------------------------------------------------
+
+    def recover(self, tail_bytes: int = 65536):
+        """
+        启动时修复归档：截掉 poems.jsonl 末尾写了一半的行，
+        并根据日志恢复最近丢失或未完成的诗歌文件
+
+        Args:
+            tail_bytes: 检查日志末尾的字节数
+        """
+        for tmp_path in self.archive_dir.glob("poem_*.txt.tmp"):
+            tmp_path.unlink(missing_ok=True)
+
+        if not self.index_path.exists():
+            return
+
+        with self.index_path.open("r+b") as fh:
+            size = fh.seek(0, os.SEEK_END)
+            start = max(0, size - tail_bytes)
+            fh.seek(start)
+            tail = fh.read()
+
+            # 从尾部开始的第一行可能不完整（被 tail_bytes 截断），只作为边界
+            lines = tail.split(b"\n")
+            if start > 0:
+                offset = start + len(lines[0]) + 1
+                lines = lines[1:]
+            else:
+                offset = 0
+
+            good_end = offset
+            records = []
+            for raw in lines:
+                end = offset + len(raw) + 1
+                if end > size:
+                    # 最后一段没有换行符，说明写入被中断
+                    break
+                if raw.strip():
+                    try:
+                        records.append(json.loads(raw))
+                    except ValueError:
+                        break
+                good_end = offset = end
+
+            if good_end < size:
+                self.logger.warning("修复归档日志: 截掉末尾 %s 字节不完整的记录", size - good_end)
+                fh.truncate(good_end)
+                fh.flush()
+                os.fsync(fh.fileno())
+
+        restored = 0
+        for record in records:
+            poem = record.get("poem")
+            poem_file = record.get("poem_file")
+            if not poem or not poem_file:
+                continue
+            path = Path(poem_file)
+            if not path.is_absolute():
+                path = config.project_root / path
+            if not path.exists():
+                atomic_write_text(path, poem)
+                restored += 1
+        if restored:
+            self.logger.warning("已从归档日志恢复 %s 个诗歌文件", restored)
+
+    def close(self):
+        """写完队列中的归档并关闭数据库"""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join(config.archive_close_timeout)
+        if self.db is not None:
+            self.db.close()
+            self.db = None
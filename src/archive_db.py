@@ -0,0 +1,273 @@
+"""
+诗歌归档数据库模块
+
+以 SQLite（WAL 模式）保存诗歌记录，created_at 建索引，
+诗歌和图像描述建 FTS5 全文索引，支持按日期、关键词查询和分页列表
+"""
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .config import config
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS poems (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    poem TEXT NOT NULL,
+    caption TEXT NOT NULL DEFAULT '',
+    image TEXT,
+    -- 旧版 poem_*.txt 文件名，导入时用于去重
+    legacy_file TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS idx_poems_created_at ON poems(created_at);
+
+CREATE TRIGGER IF NOT EXISTS poems_ai AFTER INSERT ON poems BEGIN
+    INSERT INTO poems_fts(rowid, poem, caption) VALUES (new.id, new.poem, new.caption);
+END;
+CREATE TRIGGER IF NOT EXISTS poems_ad AFTER DELETE ON poems BEGIN
+    INSERT INTO poems_fts(poems_fts, rowid, poem, caption) VALUES ('delete', old.id, old.poem, old.caption);
+END;
+CREATE TRIGGER IF NOT EXISTS poems_au AFTER UPDATE ON poems BEGIN
+    INSERT INTO poems_fts(poems_fts, rowid, poem, caption) VALUES ('delete', old.id, old.poem, old.caption);
+    INSERT INTO poems_fts(rowid, poem, caption) VALUES (new.id, new.poem, new.caption);
+END;
+"""
+
+# trigram 分词支持中文子串匹配（SQLite 3.34+），更早的版本退回 unicode61
+_FTS_TRIGRAM = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS poems_fts USING fts5("
+    "poem, caption, content='poems', content_rowid='id', tokenize='trigram')"
+)
+_FTS_UNICODE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS poems_fts USING fts5("
+    "poem, caption, content='poems', content_rowid='id')"
+)
+
+_COLUMNS = "id, created_at, poem, caption, image"
+
+
+@dataclass
+class PoemRecord:
+    """数据库中的一条诗歌记录"""
+    id: Optional[int]
+    created_at: datetime
+    poem: str
+    caption: str
+    image: Optional[str] = None
+    legacy_file: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> 'PoemRecord':
+        return cls(
+            id=row["id"],
+            created_at=datetime.fromisoformat(row["created_at"]),
+            poem=row["poem"],
+            caption=row["caption"],
+            image=row["image"]
+        )
+
+
+class PoemDatabase:
+    """SQLite 诗歌归档"""
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.path = path or config.archive_db_path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        # 流水线打印阶段和主线程都会访问，统一加锁
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 下 FULL 只在每次提交时 fsync 一次，配合批量提交开销很小
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._trigram = self._create_schema()
+
+    def _create_schema(self) -> bool:
+        """建表，返回全文索引是否使用 trigram 分词"""
+        with self._conn:
+            try:
+                self._conn.execute(_FTS_TRIGRAM)
+                trigram = True
+            except sqlite3.OperationalError:
+                self._conn.execute(_FTS_UNICODE)
+                trigram = False
+            self._conn.executescript(_SCHEMA)
+        return trigram
+
+    def add(self, record: PoemRecord) -> Optional[int]:
+        """
+        插入一条记录
+
+        Returns:
+            新记录的 id，旧文件已导入过时返回None
+        """
+        ids = self.add_many([record])
+        return ids[0] if ids else None
+
+    def add_many(self, records: Iterable[PoemRecord]) -> list[int]:
+        """
+        在一个事务中批量插入记录（已导入过的旧文件会被跳过）
+
+        Returns:
+            新插入记录的 id 列表
+        """
+        ids = []
+        with self._lock, self._conn:
+            for record in records:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO poems (created_at, poem, caption, image, legacy_file) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        record.created_at.isoformat(timespec="seconds"),
+                        record.poem,
+                        record.caption,
+                        record.image,
+                        record.legacy_file
+                    )
+                )
+                if cursor.rowcount:
+                    record.id = cursor.lastrowid
+                    ids.append(cursor.lastrowid)
+        return ids
+
+    def _select(self, sql: str, params: tuple) -> list[PoemRecord]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [PoemRecord.from_row(row) for row in rows]
+
+    def get(self, poem_id: int) -> Optional[PoemRecord]:
+        """按 id 读取记录"""
+        records = self._select(f"SELECT {_COLUMNS} FROM poems WHERE id = ?", (poem_id,))
+        return records[0] if records else None
+
+    def count(self) -> int:
+        """记录总数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM poems").fetchone()[0]
+
+    def list_page(self, page: int = 1, page_size: int = 20) -> list[PoemRecord]:
+        """
+        按时间倒序分页列出记录
+
+        Args:
+            page: 页码（从 1 开始）
+            page_size: 每页条数
+        """
+        offset = max(page - 1, 0) * page_size
+        return self._select(
+            f"SELECT {_COLUMNS} FROM poems ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+            (page_size, offset)
+        )
+
+    def between(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = 100,
+        offset: int = 0
+    ) -> list[PoemRecord]:
+        """
+        按日期范围查询（走 created_at 索引）
+
+        Args:
+            start: 起始时间（含），None 表示不限
+            end: 结束时间（不含），None 表示不限
+        """
+        start_text = start.isoformat(timespec="seconds") if start else ""
+        end_text = end.isoformat(timespec="seconds") if end else "9999"
+        return self._select(
+            f"SELECT {_COLUMNS} FROM poems WHERE created_at >= ? AND created_at < ? "
+            "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+            (start_text, end_text, limit, offset)
+        )
+
+    def search(self, keyword: str, limit: int = 20, offset: int = 0) -> list[PoemRecord]:
+        """
+        在诗歌和图像描述中全文搜索
+
+        trigram 分词要求关键词至少 3 个字符，更短的关键词退回 LIKE 扫描
+
+        Args:
+            keyword: 关键词
+        """
+        keyword = keyword.strip()
+        if not keyword:
+            return []
+
+        if self._trigram and len(keyword) < 3:
+            pattern = "%" + keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            return self._select(
+                f"SELECT {_COLUMNS} FROM poems "
+                "WHERE poem LIKE ? ESCAPE '\\' OR caption LIKE ? ESCAPE '\\' "
+                "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                (pattern, pattern, limit, offset)
+            )
+
+        # 作为短语查询，避免关键词中的引号或运算符被解析为 FTS 语法
+        phrase = '"' + keyword.replace('"', '""') + '"'
+        return self._select(
+            "SELECT p.id, p.created_at, p.poem, p.caption, p.image "
+            "FROM poems_fts JOIN poems p ON p.id = poems_fts.rowid "
+            "WHERE poems_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+            (phrase, limit, offset)
+        )
+
+    def import_legacy(self, index_path: Path, batch_size: int = 500) -> int:
+        """
+        一次性导入旧版 poems.jsonl + poem_*.txt 归档（可重复执行，已导入的会跳过）
+
+        Args:
+            index_path: poems.jsonl 路径
+            batch_size: 每个事务插入的条数
+
+        Returns:
+            新导入的条数
+        """
+        if not index_path.exists():
+            return 0
+
+        imported = 0
+        batch: list[PoemRecord] = []
+        with index_path.open("r", encoding="utf-8") as fh:
+            for line_no, line in enumerate(fh, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                    poem_file = Path(item["poem_file"])
+                    if not poem_file.is_absolute():
+                        poem_file = config.project_root / poem_file
+                    batch.append(PoemRecord(
+                        id=None,
+                        created_at=datetime.fromisoformat(item["created_at"]),
+                        poem=poem_file.read_text(encoding="utf-8"),
+                        caption=item.get("caption") or "",
+                        image=item.get("image"),
+                        legacy_file=poem_file.name
+                    ))
+                except Exception as e:
+                    self.logger.warning("跳过无法导入的记录 (第 %s 行): %s", line_no, e)
+                    continue
+
+                if len(batch) >= batch_size:
+                    imported += len(self.add_many(batch))
+                    batch = []
+
+        if batch:
+            imported += len(self.add_many(batch))
+        self.logger.info("已从 %s 导入 %s 条诗歌记录", index_path.name, imported)
+        return imported
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
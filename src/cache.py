@@ -0,0 +1,310 @@
+"""
+AI结果缓存模块
+
+以图像感知哈希为键缓存图像描述，以 (描述, 诗歌格式, 提示词版本) 为键缓存诗歌，
+同一场景重复拍摄时可跳过 Replicate / DeepSeek 调用。
+查询只读写内存；新增条目后在后台线程中合并写盘，命中时更新的使用记录随下一次写盘保存
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+from PIL import Image
+
+from .config import config
+
+
+def dhash(image: Union[Path, bytes, Image.Image], hash_size: int = 8) -> int:
+    """
+    计算图像的差异哈希（dHash）
+
+    Args:
+        image: 图像路径、JPEG字节或 PIL 图像
+        hash_size: 哈希边长，结果为 hash_size * hash_size 位
+
+    Returns:
+        整数形式的哈希值
+    """
+    if isinstance(image, Image.Image):
+        img = image
+    else:
+        img = Image.open(io.BytesIO(image) if isinstance(image, bytes) else image)
+        # JPEG 可在解码时直接缩小，避免完整解码大图
+        img.draft("L", (hash_size * 8, hash_size * 8))
+
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """两个哈希之间的汉明距离"""
+    return bin(a ^ b).count("1")
+
+
+@dataclass
+class CacheStats:
+    """缓存命中统计"""
+    caption_hits: int = 0
+    caption_misses: int = 0
+    poem_hits: int = 0
+    poem_misses: int = 0
+    saved_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        """总体命中率"""
+        hits = self.caption_hits + self.poem_hits
+        total = hits + self.caption_misses + self.poem_misses
+        return hits / total if total else 0.0
+
+    def describe(self) -> str:
+        """日志描述"""
+        return (
+            f"描述 {self.caption_hits}/{self.caption_hits + self.caption_misses}, "
+            f"诗歌 {self.poem_hits}/{self.poem_hits + self.poem_misses}, "
+            f"命中率 {self.hit_rate:.0%}, 累计节省 {self.saved_seconds:.1f}s"
+        )
+
+
+@dataclass
+class _Entry:
+    """缓存条目"""
+    value: list
+    latency: float
+    created_at: float
+    last_used: float
+    uses: int = 0
+
+
+class AICache:
+    """持久化的描述/诗歌缓存（TTL + LRU 淘汰）"""
+
+    # 诗歌变化策略
+    POLICY_REUSE = "reuse"    # 命中即复用已有诗歌
+    POLICY_VARY = "vary"      # 未满 CACHE_POEM_VARIANTS 首时生成新诗，满后轮换
+    POLICY_FRESH = "fresh"    # 描述走缓存，诗歌总是重新生成
+
+    # 新增条目后延迟写盘的秒数（期间的多次新增合并为一次写入）
+    SAVE_DELAY = 2.0
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.path = path or config.cache_dir / "ai_cache.json"
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._captions: dict[str, _Entry] = {}
+        self._poems: dict[str, _Entry] = {}
+        self._save_timer: Optional[threading.Timer] = None
+        # 串行化写盘（后台写盘与关闭时的 flush 可能同时进行）
+        self._write_lock = threading.Lock()
+        # 命中时更新了使用记录但尚未写盘
+        self._dirty = False
+        self._load()
+
+    # ------------------------------------------------------------------
+    # 描述缓存
+    # ------------------------------------------------------------------
+
+    def get_caption(self, image_hash: int) -> Optional[str]:
+        """
+        查找相同或近似场景的图像描述
+
+        Args:
+            image_hash: 图像感知哈希
+
+        Returns:
+            缓存的描述，未命中返回None
+        """
+        with self._lock:
+            self._expire()
+            best_key, best_distance = None, config.cache_hash_distance + 1
+            for key in self._captions:
+                distance = hamming(int(key, 16), image_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+
+            if best_key is None:
+                self.stats.caption_misses += 1
+                return None
+
+            entry = self._touch(self._captions[best_key])
+            self.stats.caption_hits += 1
+            self.stats.saved_seconds += entry.latency
+            self.logger.info(
+                "描述缓存命中 (距离 %s, 节省 %.1fs) | %s",
+                best_distance, entry.latency, self.stats.describe()
+            )
+            self._dirty = True
+            return entry.value[0]
+
+    def put_caption(self, image_hash: int, caption: str, latency: float):
+        """保存图像描述"""
+        with self._lock:
+            now = time.time()
+            self._captions[f"{image_hash:016x}"] = _Entry(
+                value=[caption], latency=latency, created_at=now, last_used=now
+            )
+            self._evict(self._captions)
+            self._schedule_save()
+
+    # ------------------------------------------------------------------
+    # 诗歌缓存
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def poem_key(caption: str, poem_format: str, prompt_version: str) -> str:
+        """诗歌缓存键"""
+        raw = "\x1f".join([caption.strip().lower(), poem_format, prompt_version])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_poem(self, key: str) -> Optional[str]:
+        """
+        按变化策略取出缓存的诗歌
+
+        Args:
+            key: poem_key() 生成的键
+
+        Returns:
+            可复用的诗歌；未命中或策略要求生成新诗时返回None
+        """
+        with self._lock:
+            self._expire()
+            entry = self._poems.get(key)
+            policy = config.cache_vary_policy
+
+            wants_fresh = (
+                entry is None
+                or policy == self.POLICY_FRESH
+                or (policy == self.POLICY_VARY and len(entry.value) < config.cache_poem_variants)
+            )
+            if wants_fresh:
+                self.stats.poem_misses += 1
+                return None
+
+            self._touch(entry)
+            poem = entry.value[(entry.uses - 1) % len(entry.value)]
+            self.stats.poem_hits += 1
+            self.stats.saved_seconds += entry.latency
+            self.logger.info(
+                "诗歌缓存命中 (第 %s/%s 首, 节省 %.1fs) | %s",
+                (entry.uses - 1) % len(entry.value) + 1, len(entry.value),
+                entry.latency, self.stats.describe()
+            )
+            self._dirty = True
+            return poem
+
+    def add_poem(self, key: str, poem: str, latency: float):
+        """追加一首新生成的诗歌"""
+        with self._lock:
+            now = time.time()
+            entry = self._poems.get(key)
+            if entry is None:
+                entry = self._poems[key] = _Entry(
+                    value=[], latency=latency, created_at=now, last_used=now
+                )
+            entry.value.append(poem)
+            # 只保留最近的若干首
+            del entry.value[:-config.cache_poem_variants]
+            entry.latency = (entry.latency + latency) / 2
+            entry.last_used = now
+            self._evict(self._poems)
+            self._schedule_save()
+
+    # ------------------------------------------------------------------
+    # 内部方法
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _touch(entry: _Entry) -> _Entry:
+        entry.last_used = time.time()
+        entry.uses += 1
+        return entry
+
+    def _expire(self):
+        """淘汰超过 TTL 的条目"""
+        if config.cache_ttl <= 0:
+            return
+        cutoff = time.time() - config.cache_ttl
+        for table in (self._captions, self._poems):
+            for key in [k for k, e in table.items() if e.created_at < cutoff]:
+                del table[key]
+
+    @staticmethod
+    def _evict(table: dict[str, _Entry]):
+        """
+        超出 CACHE_MAX_ENTRIES 时按最近最少使用淘汰
+
+        只按条目数限制；描述和诗歌长度有限，缓存文件大小约为
+        条目数 × (0.2 KB + CACHE_POEM_VARIANTS × 0.5 KB)，
+        get_caption 的线性哈希比对次数也以此为上限
+        """
+        overflow = len(table) - config.cache_max_entries
+        if overflow <= 0:
+            return
+        for key, _ in sorted(table.items(), key=lambda item: item[1].last_used)[:overflow]:
+            del table[key]
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            self._captions = {k: _Entry(**v) for k, v in data.get("captions", {}).items()}
+            self._poems = {k: _Entry(**v) for k, v in data.get("poems", {}).items()}
+            self._expire()
+            self.logger.info(
+                "已加载AI缓存: %s 条描述, %s 组诗歌", len(self._captions), len(self._poems)
+            )
+        except Exception:
+            self.logger.exception("读取AI缓存失败，将使用空缓存")
+            self._captions, self._poems = {}, {}
+
+    def _schedule_save(self):
+        """SAVE_DELAY 秒后在后台写盘（调用方持有 _lock，已有待写盘时不重复安排）"""
+        self._dirty = True
+        if self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.SAVE_DELAY, self._save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def flush(self):
+        """立即写入尚未保存的更改（关闭时调用）"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+        self._save()
+
+    def _save(self):
+        """原子写入缓存文件（先写临时文件再改名），在锁内复制数据、锁外写盘"""
+        with self._write_lock:
+            with self._lock:
+                self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = {
+                    "captions": {k: dict(vars(e), value=list(e.value)) for k, e in self._captions.items()},
+                    "poems": {k: dict(vars(e), value=list(e.value)) for k, e in self._poems.items()},
+                }
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix(".tmp")
+                tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+                os.replace(tmp_path, self.path)
+            except Exception:
+                self.logger.exception("写入AI缓存失败")
@@ -3,27 +3,96 @@
 
 封装 Picamera2 相关功能
 """
+import collections
+import contextlib
+import io
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Optional
 
-try:
+from .config import config
+from .image_store import ImageStore
+from .imaging import prepare_for_upload, yuv420_to_rgb
+from .tracing import tracer
+
+if TYPE_CHECKING:
     from picamera2 import Picamera2
-    CAMERA_AVAILABLE = True
-except ImportError:
-    CAMERA_AVAILABLE = False
-    logging.warning("Picamera2 未安装，相机功能将不可用")
 
-from .config import config
+
+def _load_picamera2() -> Optional[type]:
+    """
+    导入 Picamera2（加载 libcamera 绑定较慢，推迟到初始化相机时进行）
+    
+    Returns:
+        Picamera2 类，未安装时返回None
+    """
+    try:
+        from picamera2 import Picamera2
+    except ImportError:
+        return None
+    return Picamera2
+
+
+@dataclass
+class CapturedFrame:
+    """内存中的一帧照片（JPEG编码）"""
+    # 主画面JPEG（lores 模式下未启用归档时为None）
+    data: Optional[bytes]
+    captured_at: datetime
+    # 从 lores 流编码的上传图像
+    upload: Optional[bytes] = None
+
+
+@dataclass
+class RingFrame:
+    """零快门延迟环形缓冲中的一帧（lores YUV420 数组）"""
+    lores: Any
+    # 帧到达时的 time.monotonic()，与按键时间戳可直接比较
+    arrived_at: float
 
 
 class Camera:
     """相机控制类"""
     
-    def __init__(self):
+    def __init__(self, image_store: Optional[ImageStore] = None):
         self.logger = logging.getLogger(__name__)
-        self.camera: Optional[Picamera2] = None
+        self.camera: Optional["Picamera2"] = None
+        # 照片归档（日期分目录、缩略图、容量淘汰）
+        self.image_store = image_store or ImageStore()
         self._initialized = False
+        # 后台写盘线程（照片归档不阻塞拍照流程）
+        self._writer: Optional[ThreadPoolExecutor] = None
+        # lores 流实际尺寸（未启用 lores 时为None）
+        self._lores_size: Optional[tuple[int, int]] = None
+        # 零快门延迟：持续取流，最近若干帧保存在环形缓冲中
+        self._zsl = False
+        self._ring: collections.deque[RingFrame] = collections.deque(maxlen=config.camera_ring_frames)
+        self._ring_lock = threading.Lock()
+        # 进行中的拍照调用的开始时刻（健康检查不与拍照并发探测）
+        self._inflight: list[float] = []
+        self._inflight_lock = threading.Lock()
+        # 健康检查的探测线程（同一时刻最多一个）
+        self._probe: Optional[threading.Thread] = None
+    
+    @property
+    def lores_enabled(self) -> bool:
+        """是否配置了用于上传的 lores 流"""
+        return self._lores_size is not None
+    
+    @property
+    def initialized(self) -> bool:
+        """相机是否已初始化"""
+        return self._initialized
+    
+    @property
+    def zsl_enabled(self) -> bool:
+        """是否处于零快门延迟（持续取流）模式"""
+        return self._zsl
     
     def initialize(self) -> bool:
         """
@@ -32,26 +101,29 @@ class Camera:
         Returns:
             是否成功初始化
         """
-        if not CAMERA_AVAILABLE:
-            self.logger.error("Picamera2 未安装")
+        picamera2_class = _load_picamera2()
+        if picamera2_class is None:
+            self.logger.error("Picamera2 未安装，相机功能将不可用")
             return False
         
         try:
             self.logger.info("正在初始化相机...")
-            self.camera = Picamera2()
+            self.camera = picamera2_class()
             
             # 配置相机
-            camera_config = self.camera.create_still_configuration(
-                main={"size": (config.camera_width, config.camera_height)}
-            )
-            self.camera.configure(camera_config)
+            self._configure()
+            if self._zsl:
+                self.camera.post_callback = self._on_frame
             
             # 启动相机
+            started = time.monotonic()
             self.camera.start()
             
-            # 等待相机稳定
-            import time
-            time.sleep(2)
+            # 等待自动曝光/白平衡收敛
+            if self._wait_until_settled(config.camera_settle_timeout):
+                self.logger.info("曝光已收敛 (%.2fs)", time.monotonic() - started)
+            else:
+                self.logger.warning("等待曝光收敛超时 (%.1fs)，继续启动", config.camera_settle_timeout)
             
             self._initialized = True
             self.logger.info("相机初始化成功")
@@ -61,6 +133,167 @@ class Camera:
             self.logger.error(f"相机初始化失败: {e}", exc_info=True)
             return False
     
+    def _configure(self):
+        """
+        配置相机流
+        
+        零快门延迟模式使用持续取流的双流配置（lores 给AI，main 用于归档），
+        否则使用静态拍照配置；lores 流不可用时退回仅主画面
+        """
+        main = {"size": (config.camera_width, config.camera_height)}
+        if config.camera_zsl:
+            create = self.camera.create_video_configuration
+        else:
+            create = self.camera.create_still_configuration
+        
+        if config.camera_zsl or (config.capture_in_memory and config.upload_from_lores):
+            try:
+                camera_config = create(
+                    main=main,
+                    lores={"size": self._lores_target_size(), "format": "YUV420"}
+                )
+                self.camera.align_configuration(camera_config)
+                self.camera.configure(camera_config)
+                self._lores_size = tuple(camera_config["lores"]["size"])
+                self._zsl = config.camera_zsl
+                self.logger.info(
+                    "已启用 lores 流: %sx%s%s",
+                    *self._lores_size,
+                    " (零快门延迟)" if self._zsl else ""
+                )
+                return
+            except Exception as e:
+                self.logger.warning(f"lores 流配置失败，使用静态拍照模式: {e}")
+                self._lores_size = None
+                self._zsl = False
+        
+        camera_config = self.camera.create_still_configuration(main=main)
+        self.camera.configure(camera_config)
+    
+    def _wait_until_settled(self, timeout: float) -> bool:
+        """
+        通过帧元数据等待自动曝光/白平衡收敛，代替固定的等待时间
+        
+        优先使用 AeLocked；驱动不提供该字段时，以连续几帧的曝光量和
+        白平衡增益变化小于 5% 作为收敛条件
+        
+        Args:
+            timeout: 最长等待时间（秒）
+            
+        Returns:
+            是否在超时前收敛
+        """
+        deadline = time.monotonic() + timeout
+        previous: Optional[tuple[float, ...]] = None
+        stable_frames = 0
+        
+        while time.monotonic() < deadline:
+            metadata = self.camera.capture_metadata()
+            if metadata.get("AeLocked"):
+                return True
+            
+            gains = metadata.get("ColourGains") or (1.0, 1.0)
+            current = (
+                metadata.get("ExposureTime", 0) * metadata.get("AnalogueGain", 1.0),
+                *gains
+            )
+            if previous and all(
+                abs(a - b) <= 0.05 * max(abs(b), 1e-6) for a, b in zip(current, previous)
+            ):
+                stable_frames += 1
+                if stable_frames >= 3:
+                    return True
+            else:
+                stable_frames = 0
+            previous = current
+        return False
+    
+    def _on_frame(self, request):
+        """每帧回调（相机线程）：把 lores 帧放入环形缓冲"""
+        try:
+            frame = RingFrame(lores=request.make_array("lores"), arrived_at=time.monotonic())
+        except Exception as e:
+            self.logger.debug("读取 lores 帧失败: %s", e)
+            return
+        with self._ring_lock:
+            self._ring.append(frame)
+    
+    def _closest_frame(self, timestamp: float) -> Optional[RingFrame]:
+        """环形缓冲中最接近给定时间的帧"""
+        with self._ring_lock:
+            if not self._ring:
+                return None
+            return min(self._ring, key=lambda frame: abs(frame.arrived_at - timestamp))
+    
+    def check_health(self) -> bool:
+        """
+        健康检查：持续取流时最近一帧不能太旧，静态拍照模式下须在限定时间内取到一帧元数据
+        
+        Returns:
+            相机是否仍在出帧
+        """
+        if not self._initialized or self.camera is None:
+            return False
+        
+        if self._zsl:
+            with self._ring_lock:
+                newest = self._ring[-1].arrived_at if self._ring else None
+            return newest is not None and time.monotonic() - newest < config.camera_stall_timeout
+        
+        # 正在拍照时不插入探测，拍照本身超过 CAMERA_STALL_TIMEOUT 未返回视为卡住
+        with self._inflight_lock:
+            oldest = min(self._inflight, default=None)
+        if oldest is not None:
+            return time.monotonic() - oldest < config.camera_stall_timeout
+        
+        # 上一次探测仍未返回时不再启动新的探测线程
+        if self._probe is not None and self._probe.is_alive():
+            self.logger.warning("上一次帧元数据探测仍未返回")
+            return False
+        
+        # capture_metadata 在相机掉线时可能一直阻塞，放到单独线程中限时等待
+        camera = self.camera
+        received = threading.Event()
+        
+        def probe():
+            try:
+                camera.capture_metadata()
+                received.set()
+            except Exception as e:
+                self.logger.warning("读取帧元数据失败: %s", e)
+        
+        self._probe = threading.Thread(target=probe, name="camera-probe", daemon=True)
+        self._probe.start()
+        return received.wait(config.camera_stall_timeout)
+    
+    @contextlib.contextmanager
+    def _capturing(self):
+        """登记一次进行中的拍照调用"""
+        started = time.monotonic()
+        with self._inflight_lock:
+            self._inflight.append(started)
+        try:
+            yield
+        finally:
+            with self._inflight_lock:
+                self._inflight.remove(started)
+    
+    def _lores_target_size(self) -> tuple[int, int]:
+        """
+        按上传配置计算 lores 流尺寸
+        
+        居中裁剪时短边等于上传尺寸，否则长边等于上传尺寸，
+        宽高取偶数（YUV420 要求），且不超过主画面
+        """
+        width, height = config.camera_width, config.camera_height
+        if config.upload_crop == "center":
+            scale = config.upload_max_size / min(width, height)
+        else:
+            scale = config.upload_max_size / max(width, height)
+        scale = min(scale, 1.0)
+        return (int(width * scale) // 2 * 2, int(height * scale) // 2 * 2)
+    
+    @tracer.traced("camera.capture")
     def capture(self, output_path: Optional[Path] = None) -> Optional[Path]:
         """
         拍摄照片
@@ -76,11 +309,16 @@ class Camera:
             return None
         
         try:
-            if output_path is None:
-                output_path = config.images_dir / f"image_{self._get_timestamp()}.jpg"
+            managed = output_path is None
+            if managed:
+                output_path = self.image_store.path_for(datetime.now())
+                output_path.parent.mkdir(parents=True, exist_ok=True)
             
             self.logger.info(f"正在拍照，保存到: {output_path}")
-            self.camera.capture_file(str(output_path))
+            with self._capturing():
+                self.camera.capture_file(str(output_path))
+            if managed:
+                self.image_store.register(output_path)
             
             self.logger.info("拍照成功")
             return output_path
@@ -89,13 +327,195 @@ class Camera:
             self.logger.error(f"拍照失败: {e}", exc_info=True)
             return None
     
-    def _get_timestamp(self) -> str:
-        """获取时间戳字符串"""
-        from datetime import datetime
-        return datetime.now().strftime("%Y%m%d_%H%M%S")
+    @tracer.traced("camera.capture")
+    def capture_bytes(self) -> Optional[CapturedFrame]:
+        """
+        拍摄照片并直接编码为内存中的JPEG，不写入SD卡
+        
+        Returns:
+            内存中的照片，失败返回None
+        """
+        if not self._initialized or self.camera is None:
+            self.logger.error("相机未初始化")
+            return None
+        
+        try:
+            captured_at = datetime.now()
+            buffer = io.BytesIO()
+            with self._capturing():
+                self.camera.capture_file(buffer, format="jpeg")
+            
+            self.logger.info("拍照成功 (内存, %s KB)", buffer.tell() // 1024)
+            return CapturedFrame(data=buffer.getvalue(), captured_at=captured_at)
+            
+        except Exception as e:
+            self.logger.error(f"拍照失败: {e}", exc_info=True)
+            return None
+    
+    @tracer.traced("camera.capture")
+    def capture_for_upload(
+        self,
+        encode_main: bool = True,
+        pressed_at: Optional[float] = None
+    ) -> Optional[CapturedFrame]:
+        """
+        同时取得 lores 上传图像和（可选的）主画面JPEG
+        
+        零快门延迟模式下上传图像取自环形缓冲中最接近按键时刻的帧，
+        主画面取自当前帧（仅归档使用，与按键时刻相差不超过一帧）
+        
+        Args:
+            encode_main: 是否编码全尺寸主画面（仅归档时需要）
+            pressed_at: 按键时刻（time.monotonic()），为None时使用当前帧
+            
+        Returns:
+            内存中的照片，失败返回None
+        """
+        if not self._initialized or self.camera is None:
+            self.logger.error("相机未初始化")
+            return None
+        if not self.lores_enabled:
+            return self.capture_bytes()
+        
+        try:
+            captured_at = datetime.now()
+            ring_frame = None
+            if self._zsl and pressed_at is not None:
+                ring_frame = self._closest_frame(pressed_at)
+            
+            lores = ring_frame.lores if ring_frame else None
+            data = None
+            if lores is None or encode_main:
+                with self._capturing():
+                    request = self.camera.capture_request()
+                try:
+                    if lores is None:
+                        lores = request.make_array("lores")
+                    if encode_main:
+                        buffer = io.BytesIO()
+                        request.save("main", buffer, format="jpeg")
+                        data = buffer.getvalue()
+                finally:
+                    request.release()
+            
+            prepared = prepare_for_upload(yuv420_to_rgb(lores, *self._lores_size))
+            if ring_frame:
+                self.logger.info(
+                    "拍照成功 (环形缓冲帧，距按键 %+.0f ms, 上传图像: %s)",
+                    (ring_frame.arrived_at - pressed_at) * 1000,
+                    prepared.describe()
+                )
+            else:
+                self.logger.info("拍照成功 (lores 上传图像: %s)", prepared.describe())
+            return CapturedFrame(data=data, captured_at=captured_at, upload=prepared.data)
+            
+        except Exception as e:
+            self.logger.error(f"拍照失败: {e}", exc_info=True)
+            return None
+    
+    def upload_at(self, pressed_at: float) -> Optional[bytes]:
+        """
+        零快门延迟模式下取环形缓冲中最接近按键时刻的帧，编码为上传图像
+        （文件拍照模式下交给AI，主画面文件仍在按键后拍摄，仅用于归档）
+        
+        Returns:
+            编码后的上传图像，未启用零快门延迟或缓冲为空时返回None
+        """
+        if not self._zsl:
+            return None
+        ring_frame = self._closest_frame(pressed_at)
+        if ring_frame is None:
+            return None
+        try:
+            prepared = prepare_for_upload(yuv420_to_rgb(ring_frame.lores, *self._lores_size))
+        except Exception as e:
+            self.logger.warning("编码环形缓冲帧失败: %s", e)
+            return None
+        self.logger.info(
+            "上传图像取自环形缓冲帧 (距按键 %+.0f ms, %s)",
+            (ring_frame.arrived_at - pressed_at) * 1000,
+            prepared.describe()
+        )
+        return prepared.data
+    
+    def preview_upload(self) -> Optional[bytes]:
+        """
+        取当前场景的上传尺寸图像（不编码主画面、不打日志，供空闲时预生成使用）
+        
+        零快门延迟模式下直接使用环形缓冲中最新的帧，不额外占用相机
+        
+        Returns:
+            编码后的上传图像，未启用 lores 流或失败时返回None
+        """
+        if not self._initialized or self.camera is None or not self.lores_enabled:
+            return None
+        
+        try:
+            lores = None
+            if self._zsl:
+                with self._ring_lock:
+                    if self._ring:
+                        lores = self._ring[-1].lores
+            if lores is None:
+                with self._capturing():
+                    lores = self.camera.capture_array("lores")
+            return prepare_for_upload(yuv420_to_rgb(lores, *self._lores_size)).data
+        except Exception as e:
+            self.logger.debug("读取预览帧失败: %s", e)
+            return None
+    
+    def capture_array(self) -> Optional[Any]:
+        """
+        拍摄照片并返回原始像素数组（numpy.ndarray，RGB）
+        
+        Returns:
+            像素数组，失败返回None
+        """
+        if not self._initialized or self.camera is None:
+            self.logger.error("相机未初始化")
+            return None
+        
+        try:
+            with self._capturing():
+                return self.camera.capture_array("main")
+        except Exception as e:
+            self.logger.error(f"拍照失败: {e}", exc_info=True)
+            return None
+    
+    def save_async(self, frame: CapturedFrame, output_path: Optional[Path] = None) -> Path:
+        """
+        在后台线程中把内存照片写入归档目录
+        
+        Args:
+            frame: 内存中的照片
+            output_path: 输出文件路径，如果为None则使用默认路径
+            
+        Returns:
+            照片将被写入的路径（调用返回时可能尚未写完）
+        """
+        if output_path is None:
+            output_path = self.image_store.path_for(frame.captured_at)
+        
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-writer")
+        self._writer.submit(self._write_frame, frame, output_path)
+        return output_path
+    
+    def _write_frame(self, frame: CapturedFrame, output_path: Path):
+        """写入照片文件（在后台线程中执行）"""
+        try:
+            self.image_store.save(frame.data, output_path)
+            self.logger.debug("照片已归档: %s", output_path)
+        except Exception as e:
+            self.logger.error(f"照片归档失败: {e}", exc_info=True)
     
     def close(self):
         """关闭相机"""
+        if self._writer is not None:
+            # 等待尚未写完的照片
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        
         if self.camera:
             try:
                 self.logger.info("正在关闭相机...")
@@ -107,6 +527,12 @@ class Camera:
             finally:
                 self.camera = None
                 self._initialized = False
+                self._lores_size = None
+                self._zsl = False
+                # 卡在旧相机上的探测线程随旧相机一起放弃
+                self._probe = None
+                with self._ring_lock:
+                    self._ring.clear()
     
     def __enter__(self):
         """上下文管理器入口"""
@@ -0,0 +1,304 @@
+"""
+图像描述后端模块
+
+AIService 通过 CaptionRouter 调用图像描述后端：
+- remote: Replicate BLIP-2（需上传图像）
+- local: 进程内 llama.cpp 量化视觉模型（CPU，延迟加载后常驻）
+- lan: 局域网内的 llama.cpp server（OpenAI 兼容接口）
+
+auto 模式下按实测延迟选择最快的可用后端，失败时自动切换到下一个；
+每次调用的超时由该后端近期的 p99 推算，并受本次按键剩余时间预算的限制（见 resilience.py）
+"""
+import abc
+import asyncio
+import base64
+import collections
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Callable, Optional, Union
+
+from .config import config
+from .resilience import MIN_SAMPLES, attempt_timeout, backoff, can_retry, percentile
+
+if TYPE_CHECKING:
+    import httpx
+    import replicate
+
+
+ImageInput = Union[Path, bytes]
+
+# 本地/局域网模型使用的提示词（与 BLIP-2 一样输出一句英文描述）
+CAPTION_PROMPT = "Describe this photo in one short English sentence."
+
+
+def data_uri(image: ImageInput, mime_type: str) -> str:
+    """把图像编码为 data URI"""
+    data = image if isinstance(image, bytes) else Path(image).read_bytes()
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+class Captioner(abc.ABC):
+    """图像描述后端接口"""
+
+    name = "base"
+
+    def available(self) -> bool:
+        """当前配置下是否可用"""
+        return True
+
+    @abc.abstractmethod
+    async def caption(self, image: ImageInput, mime_type: str = "image/jpeg") -> str:
+        """
+        生成图像描述
+
+        Args:
+            image: 文件路径或编码后的图像字节
+            mime_type: 图像类型
+
+        Returns:
+            图像描述，失败时抛出异常
+        """
+
+    def warm(self):
+        """预先加载模型（默认无需加载）"""
+
+    def close(self):
+        """释放资源"""
+
+
+class ReplicateCaptioner(Captioner):
+    """Replicate BLIP-2"""
+
+    name = "remote"
+    MODEL = "andreasjansson/blip-2:4b32258c42e9efd4288bb9910bc532a69727f9acd26aa08e175713a0a857a608"
+
+    def __init__(
+        self,
+        client: Callable[[], Optional["replicate.Client"]],
+        open_image: Callable[[ImageInput, str], IO[bytes]]
+    ) -> None:
+        # 客户端在 AIService.initialize() 中才创建，这里只保存取值函数
+        self._client = client
+        self._open_image = open_image
+
+    def available(self) -> bool:
+        return bool(config.replicate_api_token)
+
+    async def caption(self, image: ImageInput, mime_type: str = "image/jpeg") -> str:
+        filename = "image." + mime_type.split("/")[-1]
+        with self._open_image(image, filename) as f:
+            output = await self._client().async_run(
+                self.MODEL,
+                input={
+                    "image": f,
+                    "caption": True,
+                }
+            )
+        return str(output).strip()
+
+
+class LlamaCppCaptioner(Captioner):
+    """进程内 llama.cpp 视觉模型（llama-cpp-python，仅 CPU）"""
+
+    name = "local"
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(__name__)
+        self._llama = None
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def available(self) -> bool:
+        return bool(config.caption_local_model and config.caption_local_clip) and not self._failed
+
+    def _load(self):
+        """首次使用时加载模型，之后常驻内存"""
+        with self._lock:
+            if self._llama is not None:
+                return self._llama
+            try:
+                from llama_cpp import Llama
+                from llama_cpp.llama_chat_format import Llava15ChatHandler
+            except ImportError:
+                self._failed = True
+                raise RuntimeError("未安装 llama-cpp-python，无法使用本地图像描述")
+
+            started = time.monotonic()
+            self._llama = Llama(
+                model_path=config.caption_local_model,
+                chat_handler=Llava15ChatHandler(clip_model_path=config.caption_local_clip, verbose=False),
+                n_ctx=2048,
+                n_threads=config.caption_local_threads or None,
+                verbose=False
+            )
+            self.logger.info("本地图像描述模型已加载 (%.1fs)", time.monotonic() - started)
+            return self._llama
+
+    def warm(self):
+        """在后台线程中预先加载模型"""
+        if not self.available():
+            return
+
+        def load():
+            try:
+                self._load()
+            except Exception as e:
+                self.logger.warning(f"预加载本地图像描述模型失败: {e}")
+
+        threading.Thread(target=load, name="caption-warmup", daemon=True).start()
+
+    def _run(self, image: ImageInput, mime_type: str) -> str:
+        llama = self._load()
+        # llama.cpp 上下文不能并发使用
+        with self._lock:
+            response = llama.create_chat_completion(
+                messages=[{
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"url": data_uri(image, mime_type)}},
+                        {"type": "text", "text": CAPTION_PROMPT},
+                    ],
+                }],
+                max_tokens=60,
+                temperature=0.1
+            )
+        return response["choices"][0]["message"]["content"].strip()
+
+    async def caption(self, image: ImageInput, mime_type: str = "image/jpeg") -> str:
+        return await asyncio.to_thread(self._run, image, mime_type)
+
+    def close(self):
+        with self._lock:
+            self._llama = None
+
+
+class LlamaServerCaptioner(Captioner):
+    """局域网 llama.cpp server（OpenAI 兼容的 /v1/chat/completions）"""
+
+    name = "lan"
+
+    def __init__(self, client: Callable[[], Optional["httpx.AsyncClient"]]) -> None:
+        self._client = client
+
+    def available(self) -> bool:
+        return bool(config.caption_lan_url)
+
+    async def caption(self, image: ImageInput, mime_type: str = "image/jpeg") -> str:
+        response = await self._client().post(
+            config.caption_lan_url.rstrip("/") + "/v1/chat/completions",
+            json={
+                "messages": [{
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"url": data_uri(image, mime_type)}},
+                        {"type": "text", "text": CAPTION_PROMPT},
+                    ],
+                }],
+                "max_tokens": 60,
+                "temperature": 0.1
+            }
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"].strip()
+
+
+class CaptionRouter:
+    """
+    按配置或实测延迟在多个后端之间选择
+
+    CAPTION_BACKEND=auto 时优先使用延迟（指数移动平均）最低的后端，
+    尚未测量过的后端会先各试一次；失败的后端在 CAPTION_FAILURE_COOLDOWN 秒内不再被选中。
+    最多尝试 CAPTION_MAX_ATTEMPTS 次，重试同一后端前按退避等待
+    """
+
+    def __init__(self, captioners: list[Captioner]) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.captioners = {captioner.name: captioner for captioner in captioners}
+        self.latency: dict[str, float] = {}
+        # 最近的延迟样本（用于推算超时）
+        self.samples: dict[str, collections.deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=max(config.llm_latency_window, MIN_SAMPLES))
+        )
+        self._cooldown_until: dict[str, float] = {}
+
+    def candidates(self) -> list[Captioner]:
+        """按优先级排列的可用后端"""
+        available = [c for c in self.captioners.values() if c.available()]
+        backend = config.caption_backend
+        if backend != "auto":
+            # 指定后端优先，其余作为失败时的后备
+            return sorted(available, key=lambda c: c.name != backend)
+
+        now = time.monotonic()
+        return sorted(
+            available,
+            key=lambda c: (
+                self._cooldown_until.get(c.name, 0) > now,
+                self.latency.get(c.name, 0.0)
+            )
+        )
+
+    def warm(self):
+        """预加载将会被用到的后端"""
+        for captioner in self.candidates():
+            captioner.warm()
+
+    def record(self, name: str, seconds: float):
+        """记录一次成功调用的延迟"""
+        previous = self.latency.get(name)
+        alpha = 0.3
+        self.latency[name] = seconds if previous is None else previous * (1 - alpha) + seconds * alpha
+        self.samples[name].append(seconds)
+
+    async def caption(self, image: ImageInput, mime_type: str = "image/jpeg") -> Optional[str]:
+        """
+        依次尝试各后端，返回第一个成功的描述
+
+        Returns:
+            图像描述，全部失败或剩余时间预算不足时返回None
+        """
+        candidates = self.candidates()
+        attempts = max(len(candidates), config.caption_max_attempts) if candidates else 0
+        tried: set[str] = set()
+        retries = 0
+        for i in range(attempts):
+            captioner = candidates[i % len(candidates)]
+            wait, expected = 0.0, None
+            if captioner.name in tried:
+                retries += 1
+                wait, expected = backoff(retries), self.latency.get(captioner.name)
+            if not can_retry(expected, wait):
+                self.logger.warning("剩余时间预算不足，放弃图像描述")
+                return None
+            if wait:
+                self.logger.info("%.2fs 后重试图像描述后端 %s", wait, captioner.name)
+                await asyncio.sleep(wait)
+            tried.add(captioner.name)
+
+            started = time.monotonic()
+            timeout = attempt_timeout(percentile(self.samples[captioner.name], 0.99))
+            try:
+                caption = await asyncio.wait_for(captioner.caption(image, mime_type), timeout)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = RuntimeError(f"超时 ({timeout:.1f}s)")
+                self._cooldown_until[captioner.name] = time.monotonic() + config.caption_failure_cooldown
+                self.logger.warning(f"图像描述后端 {captioner.name} 失败: {e}")
+                continue
+            if not caption:
+                continue
+
+            elapsed = time.monotonic() - started
+            self.record(captioner.name, elapsed)
+            self.logger.info(
+                "图像描述后端: %s (%.2fs, 平均 %.2fs)",
+                captioner.name, elapsed, self.latency[captioner.name]
+            )
+            return caption
+        return None
+
+    def close(self):
+        for captioner in self.captioners.values():
+            captioner.close()
@@ -34,29 +34,206 @@ class Config:
         
         # API配置
         self.deepseek_api_key = os.getenv('DEEPSEEK_API_KEY', '')
+        self.deepseek_model = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
         self.replicate_api_token = os.getenv('REPLICATE_API_TOKEN', '')
+        # Replicate API 地址（留空使用官方地址，基准测试时指向本地模拟服务）
+        self.replicate_base_url = os.getenv('REPLICATE_BASE_URL', '')
         
         # 串口配置
         self.serial_port = os.getenv('SERIAL_PORT', '/dev/serial0')
+        # 开机时串口设备可能晚于程序出现，最多等待该秒数
+        self.serial_wait_timeout = float(os.getenv('SERIAL_WAIT_TIMEOUT', '20'))
         self.printer_baud = int(os.getenv('PRINTER_BAUD', '9600'))
         self.printer_encoding = os.getenv('PRINTER_ENCODING', 'gbk')
+        # 打印机接收缓冲区大小（字节），打印任务按此分块发送
+        self.printer_buffer_size = int(os.getenv('PRINTER_BUFFER_SIZE', '256'))
+        # 打印模式: text=打印机内置字体, raster=自定义字体渲染为位图（GS v 0）
+        self.printer_mode = os.getenv('PRINTER_MODE', 'text').lower()
+        # 打印头点宽（58mm 纸 384 点，80mm 纸 576 点）
+        self.printer_dots = int(os.getenv('PRINTER_DOTS', '384'))
+        # 抖动算法: floyd=Floyd–Steinberg, ordered=Bayer 有序抖动
+        self.printer_dither = os.getenv('PRINTER_DITHER', 'floyd').lower()
+        self.printer_font = os.getenv('PRINTER_FONT', '')
+        self.printer_font_size = int(os.getenv('PRINTER_FONT_SIZE', '24'))
+        # 是否在诗歌前打印照片
+        self.print_photo = os.getenv('PRINT_PHOTO', 'false').lower() == 'true'
+        self.raster_cache_entries = int(os.getenv('RASTER_CACHE_ENTRIES', '32'))
+        # 流控: none=按波特率节流, rtscts/dsrdtr=硬件握手, status=GS r / DLE EOT 状态查询
+        self.printer_flow_control = os.getenv('PRINTER_FLOW_CONTROL', 'none').lower()
+        self.printer_status_interval = float(os.getenv('PRINTER_STATUS_INTERVAL', '0.5'))
+        self.printer_status_timeout = float(os.getenv('PRINTER_STATUS_TIMEOUT', '30'))
+        # 串口写入超时（秒），硬件握手被打印机一直拉住时写入出错而不是永久阻塞
+        self.printer_write_timeout = float(os.getenv('PRINTER_WRITE_TIMEOUT', '10'))
         
         # GPIO配置（避免与串口冲突）
         self.button_pin = int(os.getenv('BUTTON_PIN', '17'))  # GPIO 17 (引脚11)
         self.led_pin = int(os.getenv('LED_PIN', '27'))  # GPIO 27 (引脚13)
+        # 按钮去抖（毫秒）、长按阈值（秒）、双击窗口（秒，0 表示不识别双击）
+        self.button_bounce_ms = int(os.getenv('BUTTON_BOUNCE_MS', '30'))
+        self.button_long_press = float(os.getenv('BUTTON_LONG_PRESS', '2.0'))
+        self.button_double_window = float(os.getenv('BUTTON_DOUBLE_WINDOW', '0'))
         
         # HTTP配置
+        # 读写超时（秒），连接超时单独设置，网络不通时尽早失败
         self.http_timeout = float(os.getenv('HTTP_TIMEOUT', '30'))
+        self.http_connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+        self.http2_enabled = os.getenv('HTTP2_ENABLED', 'true').lower() == 'true'
+        self.http_max_connections = int(os.getenv('HTTP_MAX_CONNECTIONS', '10'))
+        self.http_max_keepalive = int(os.getenv('HTTP_MAX_KEEPALIVE', '5'))
+        self.http_keepalive_expiry = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '300'))
+        
+        # 图像描述后端: remote=Replicate BLIP-2, local=进程内 llama.cpp, lan=局域网 llama.cpp server,
+        # auto=按实测延迟选择；所选后端失败时自动切换到其他可用后端
+        self.caption_backend = os.getenv('CAPTION_BACKEND', 'remote').lower()
+        self.caption_local_model = os.getenv('CAPTION_LOCAL_MODEL', '')
+        self.caption_local_clip = os.getenv('CAPTION_LOCAL_CLIP', '')
+        self.caption_local_threads = int(os.getenv('CAPTION_LOCAL_THREADS', '0'))
+        self.caption_lan_url = os.getenv('CAPTION_LAN_URL', '')
+        self.caption_failure_cooldown = float(os.getenv('CAPTION_FAILURE_COOLDOWN', '300'))
+        # 图像描述最多尝试次数（重试同一后端前按退避等待）
+        self.caption_max_attempts = int(os.getenv('CAPTION_MAX_ATTEMPTS', '2'))
+        
+        # AI 调用方式: two_step=图像描述 + 诗歌生成两次调用, vision=照片直接发给多模态模型一次得到描述和诗歌
+        self.ai_strategy = os.getenv('AI_STRATEGY', 'two_step').lower()
+        # 多模态提供方（OpenAI 兼容接口，格式同 LLM_PROVIDERS）
+        self.vision_providers = os.getenv('VISION_PROVIDERS', '')
+        
+        # 诗歌生成提供方：DeepSeek 之外的 OpenAI 兼容接口（JSON 数组，每项含 name/url/model/api_key）
+        self.llm_providers = os.getenv('LLM_PROVIDERS', '')
+        # 对冲请求：请求超过提供方 p95（样本不足时用 LLM_HEDGE_DELAY 秒）仍未返回时向下一个提供方并发请求
+        self.llm_hedge = os.getenv('LLM_HEDGE', 'true').lower() == 'true'
+        self.llm_hedge_delay = float(os.getenv('LLM_HEDGE_DELAY', '4'))
+        self.llm_latency_window = int(os.getenv('LLM_LATENCY_WINDOW', '50'))
+        # 每次生成最多尝试次数（切换到其他提供方时立即进行，重试同一提供方前按退避等待）
+        self.llm_max_attempts = int(os.getenv('LLM_MAX_ATTEMPTS', '2'))
+        # 熔断：连续失败次数阈值、熔断时长（秒）
+        self.llm_breaker_threshold = int(os.getenv('LLM_BREAKER_THRESHOLD', '3'))
+        self.llm_breaker_cooldown = float(os.getenv('LLM_BREAKER_COOLDOWN', '60'))
+        
+        # 每次按键AI处理的总时间预算（秒，0 表示不限）；用尽时打印备用诗歌
+        self.ai_deadline = float(os.getenv('AI_DEADLINE', '30'))
+        # 图像描述至少可用的预算比例，其余按诗歌生成的近期 p95 预留
+        self.ai_caption_share = float(os.getenv('AI_CAPTION_SHARE', '0.4'))
+        # 单次请求超时 = 近期延迟 p99 × AI_TIMEOUT_FACTOR，限制在 AI_TIMEOUT_MIN 与 HTTP_TIMEOUT 之间
+        self.ai_timeout_factor = float(os.getenv('AI_TIMEOUT_FACTOR', '2'))
+        self.ai_timeout_min = float(os.getenv('AI_TIMEOUT_MIN', '5'))
+        # 重试退避：首次等待上限（秒），之后每次翻倍，不超过 AI_RETRY_BACKOFF_MAX
+        self.ai_retry_backoff = float(os.getenv('AI_RETRY_BACKOFF', '0.5'))
+        self.ai_retry_backoff_max = float(os.getenv('AI_RETRY_BACKOFF_MAX', '4'))
+        # 时间预算用尽时打印一首备用诗歌（不归档），而不是转入离线队列稍后补打
+        self.ai_fallback_poem = os.getenv('AI_FALLBACK_POEM', 'false').lower() == 'true'
+        
+        # 流式生成：诗歌每生成一行立即打印
+        self.poem_streaming = os.getenv('POEM_STREAMING', 'false').lower() == 'true'
+        
+        # AI结果缓存（感知哈希 -> 描述，描述 -> 诗歌）
+        self.cache_enabled = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
+        self.cache_ttl = float(os.getenv('CACHE_TTL', '43200'))
+        # 描述/诗歌各自的条目上限；同时限制了缓存文件大小和每次按键线性比对哈希的次数
+        self.cache_max_entries = int(os.getenv('CACHE_MAX_ENTRIES', '200'))
+        self.cache_hash_distance = int(os.getenv('CACHE_HASH_DISTANCE', '6'))
+        # 默认只缓存图像描述，每次按键都生成新诗
+        self.cache_vary_policy = os.getenv('CACHE_VARY_POLICY', 'fresh').lower()
+        self.cache_poem_variants = int(os.getenv('CACHE_POEM_VARIANTS', '5'))
         
         # 日志和数据目录
         self.log_file = os.getenv('LOG_FILE', 'poetry-camera.log')
         self.log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
         self.data_dir = os.getenv('DATA_DIR', 'data')
         self.poem_archive_dir = os.getenv('POEM_ARCHIVE_DIR', 'poems')
+        # 诗歌归档方式: files=poems.jsonl + poem_*.txt, sqlite=SQLite 数据库（带全文索引）
+        self.archive_backend = os.getenv('ARCHIVE_BACKEND', 'files').lower()
+        self.archive_db = os.getenv('ARCHIVE_DB', 'poems.db')
+        # 后台归档写入：每批最多条数、攒批等待时间（秒）、关闭时等待写完的时间（秒）
+        self.archive_batch_size = int(os.getenv('ARCHIVE_BATCH_SIZE', '16'))
+        self.archive_batch_window = float(os.getenv('ARCHIVE_BATCH_WINDOW', '0.5'))
+        self.archive_close_timeout = float(os.getenv('ARCHIVE_CLOSE_TIMEOUT', '10'))
         
         # 相机配置
         self.camera_width = int(os.getenv('CAMERA_WIDTH', '1920'))
         self.camera_height = int(os.getenv('CAMERA_HEIGHT', '1080'))
+        # 零快门延迟：持续取流，按键时取环形缓冲中最接近按键时刻的帧
+        self.camera_zsl = os.getenv('CAMERA_ZSL', 'true').lower() == 'true'
+        self.camera_ring_frames = int(os.getenv('CAMERA_RING_FRAMES', '8'))
+        # 启动时等待自动曝光/白平衡收敛的最长时间（秒）
+        self.camera_settle_timeout = float(os.getenv('CAMERA_SETTLE_TIMEOUT', '3'))
+        # 内存拍照：照片直接交给AI，不先写SD卡
+        self.capture_in_memory = os.getenv('CAPTURE_IN_MEMORY', 'true').lower() == 'true'
+        # 是否归档照片（内存模式下在后台写入）
+        self.archive_images = os.getenv('ARCHIVE_IMAGES', 'true').lower() == 'true'
+        # 照片存储：缩略图边长、空闲时重压缩质量（0 表示不重压缩）、容量/数量上限（0 表示不限）
+        self.image_thumbnail_size = int(os.getenv('IMAGE_THUMBNAIL_SIZE', '160'))
+        self.image_recompress_quality = int(os.getenv('IMAGE_RECOMPRESS_QUALITY', '75'))
+        self.image_quota_mb = int(os.getenv('IMAGE_QUOTA_MB', '1024'))
+        self.image_quota_count = int(os.getenv('IMAGE_QUOTA_COUNT', '0'))
+        self.image_maintenance_interval = float(os.getenv('IMAGE_MAINTENANCE_INTERVAL', '30'))
+        
+        # 上传预处理（BLIP-2 只使用 224~364 像素的输入，上传前缩小并重新编码）
+        self.upload_preprocess = os.getenv('UPLOAD_PREPROCESS', 'true').lower() == 'true'
+        self.upload_max_size = int(os.getenv('UPLOAD_MAX_SIZE', '512'))
+        self.upload_crop = os.getenv('UPLOAD_CROP', 'center').lower()
+        self.upload_format = os.getenv('UPLOAD_FORMAT', 'jpeg').lower()
+        self.upload_quality = int(os.getenv('UPLOAD_QUALITY', '85'))
+        # 从相机 lores 流取上传图像，主画面只在归档时编码
+        self.upload_from_lores = os.getenv('UPLOAD_FROM_LORES', 'true').lower() == 'true'
+        
+        # 离线队列：网络不可用时暂存照片，恢复后回放
+        self.offline_queue_enabled = os.getenv('OFFLINE_QUEUE', 'true').lower() == 'true'
+        self.offline_probe_interval = float(os.getenv('OFFLINE_PROBE_INTERVAL', '15'))
+        self.offline_probe_timeout = float(os.getenv('OFFLINE_PROBE_TIMEOUT', '5'))
+        self.offline_concurrency = int(os.getenv('OFFLINE_CONCURRENCY', '2'))
+        self.offline_max_attempts = int(os.getenv('OFFLINE_MAX_ATTEMPTS', '5'))
+        # 延迟打印策略: recent=OFFLINE_PRINT_MAX_AGE 秒内补打印, always=总是补打印, never=只归档
+        self.offline_print_policy = os.getenv('OFFLINE_PRINT_POLICY', 'recent').lower()
+        self.offline_print_max_age = float(os.getenv('OFFLINE_PRINT_MAX_AGE', '600'))
+        
+        # 空闲预生成：场景连续 SPECULATE_STABLE_SAMPLES 次采样不变时预先生成诗歌，按键时场景一致则直接打印
+        self.speculate_enabled = os.getenv('SPECULATE', 'false').lower() == 'true'
+        self.speculate_interval = float(os.getenv('SPECULATE_INTERVAL', '10'))
+        self.speculate_stable_samples = int(os.getenv('SPECULATE_STABLE_SAMPLES', '3'))
+        self.speculate_hash_distance = int(os.getenv('SPECULATE_HASH_DISTANCE', '6'))
+        # 预生成结果的有效期（秒）
+        self.speculate_max_age = float(os.getenv('SPECULATE_MAX_AGE', '600'))
+        # 预生成次数预算（API 费用上限）
+        self.speculate_hourly_budget = int(os.getenv('SPECULATE_HOURLY_BUDGET', '6'))
+        self.speculate_daily_budget = int(os.getenv('SPECULATE_DAILY_BUDGET', '40'))
+        
+        # 延迟追踪：各环节耗时写入 JSONL 追踪文件，保留最近 TRACE_WINDOW 个样本计算分位数
+        self.trace_enabled = os.getenv('TRACE_ENABLED', 'true').lower() == 'true'
+        self.trace_file = os.getenv('TRACE_FILE', 'traces.jsonl')
+        self.trace_file_max_mb = float(os.getenv('TRACE_FILE_MAX_MB', '10'))
+        self.trace_window = int(os.getenv('TRACE_WINDOW', '500'))
+        # Prometheus 文本格式指标服务（端口为 0 时不启动）
+        self.metrics_host = os.getenv('METRICS_HOST', '0.0.0.0')
+        self.metrics_port = int(os.getenv('METRICS_PORT', '0'))
+        
+        # 流水线配置（各阶段队列上限）
+        self.pipeline_capture_queue = int(os.getenv('PIPELINE_CAPTURE_QUEUE', '2'))
+        self.pipeline_ai_queue = int(os.getenv('PIPELINE_AI_QUEUE', '2'))
+        self.pipeline_print_queue = int(os.getenv('PIPELINE_PRINT_QUEUE', '4'))
+        
+        # 快速启动：GPIO 就绪后按钮即可使用，相机/打印机/AI服务在后台并行初始化
+        self.fast_start = os.getenv('FAST_START', 'true').lower() == 'true'
+        # 预热未完成时，按下的任务最多等待组件就绪的秒数
+        self.warmup_timeout = float(os.getenv('WARMUP_TIMEOUT', '30'))
+        
+        # 组件自愈：打印机/相机/GPIO 出错时只在后台重新初始化该组件，不再退出进程
+        self.supervisor_enabled = os.getenv('SUPERVISOR', 'true').lower() == 'true'
+        # 健康检查间隔（秒）
+        self.supervisor_interval = float(os.getenv('SUPERVISOR_INTERVAL', '10'))
+        # 重新初始化的退避时间：从初始值起每次翻倍，不超过上限（秒）
+        self.supervisor_backoff_initial = float(os.getenv('SUPERVISOR_BACKOFF_INITIAL', '1'))
+        self.supervisor_backoff_max = float(os.getenv('SUPERVISOR_BACKOFF_MAX', '60'))
+        # 持续取流时超过该秒数没有新帧视为相机故障
+        self.camera_stall_timeout = float(os.getenv('CAMERA_STALL_TIMEOUT', '5'))
+        
+        # 突发模式：连续按键的照片合并处理，描述并发获取，诗歌一次请求批量生成
+        self.burst_enabled = os.getenv('BURST_MODE', 'false').lower() == 'true'
+        # 与突发中第一次按键相隔不超过该秒数的按键合并为一批
+        self.burst_window = float(os.getenv('BURST_WINDOW', '5'))
+        self.burst_max_size = int(os.getenv('BURST_MAX_SIZE', '10'))
+        # 突发中同时进行的图像描述请求数
+        self.burst_caption_concurrency = int(os.getenv('BURST_CAPTION_CONCURRENCY', '4'))
         
         # 创建必要的目录
         self._setup_directories()
@@ -72,6 +249,7 @@ class Config:
         (data_path / 'images').mkdir(exist_ok=True)
         (data_path / 'uploads').mkdir(exist_ok=True)
         (data_path / 'processed').mkdir(exist_ok=True)
+        (data_path / 'cache').mkdir(exist_ok=True)
         (self.project_root / self.poem_archive_dir).mkdir(exist_ok=True, parents=True)
     
     def validate(self) -> tuple[bool, list[str]]:
@@ -83,14 +261,25 @@ class Config:
         """
         errors = []
         
-        if not self.deepseek_api_key:
-            errors.append("未设置 DEEPSEEK_API_KEY")
+        if not self.deepseek_api_key and not self.llm_providers:
+            errors.append("未设置 DEEPSEEK_API_KEY（或 LLM_PROVIDERS）")
         
-        if not self.replicate_api_token:
+        if not self.replicate_api_token and self.ai_strategy != "vision":
             errors.append("未设置 REPLICATE_API_TOKEN")
         
+        if self.ai_strategy == "vision" and not self.vision_providers:
+            errors.append("AI_STRATEGY=vision 需要设置 VISION_PROVIDERS")
+        
         return len(errors) == 0, errors
     
+    @property
+    def trace_path(self) -> Path:
+        """追踪文件路径（相对路径位于数据目录下）"""
+        path = Path(self.trace_file)
+        if not path.is_absolute():
+            path = self.project_root / self.data_dir / path
+        return path
+    
     @property
     def images_dir(self) -> Path:
         """图像保存目录"""
@@ -106,6 +295,11 @@ class Config:
         """已处理目录"""
         return self.project_root / self.data_dir / 'uploads' / 'processed'
     
+    @property
+    def cache_dir(self) -> Path:
+        """AI结果缓存目录"""
+        return self.project_root / self.data_dir / 'cache'
+    
     @property
     def log_path(self) -> Path:
         """日志文件路径"""
@@ -116,6 +310,11 @@ class Config:
         """诗歌归档目录"""
         return self.project_root / self.poem_archive_dir
     
+    @property
+    def archive_db_path(self) -> Path:
+        """诗歌归档数据库路径"""
+        return self.poems_dir / self.archive_db
+    
     def __repr__(self):
         return f"<Config project_root={self.project_root}>"
 
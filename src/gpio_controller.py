@@ -1,10 +1,14 @@
 """
 GPIO控制模块
 
-封装按钮和LED控制
+封装按钮和LED控制；按钮由边沿中断驱动，
+识别出的 SHORT/LONG/DOUBLE 事件带时间戳放入队列，主循环阻塞等待
 """
 import logging
+import queue
+import threading
 import time
+from dataclasses import dataclass
 from typing import Callable, Optional
 
 try:
@@ -17,6 +21,17 @@ except ImportError:
 from .config import config
 
 
+@dataclass
+class ButtonEvent:
+    """按钮事件"""
+    # "SHORT" / "LONG" / "DOUBLE"
+    kind: str
+    # 按下时刻（time.monotonic()，边沿中断中记录）
+    pressed_at: float
+    # 按住时长（秒）
+    duration: float = 0.0
+
+
 class GPIOController:
     """GPIO控制类"""
     
@@ -26,6 +41,15 @@ class GPIOController:
         self.button_pressed = False
         self.button_press_time: Optional[float] = None
         self.enable_led = enable_led  # 是否启用LED
+        
+        # 边沿中断识别出的按钮事件，None 用于唤醒等待者
+        self.events: "queue.Queue[Optional[ButtonEvent]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._long_timer: Optional[threading.Timer] = None
+        self._long_fired = False
+        # 等待双击确认的短按
+        self._pending_short: Optional[ButtonEvent] = None
+        self._short_timer: Optional[threading.Timer] = None
     
     def initialize(self) -> bool:
         """
@@ -49,6 +73,14 @@ class GPIOController:
             # 按钮模块：未按下=LOW，按下=HIGH（需要下拉电阻）
             GPIO.setup(config.button_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
             
+            # 边沿中断（去抖在 RPi.GPIO 的 C 层完成）
+            GPIO.add_event_detect(
+                config.button_pin,
+                GPIO.BOTH,
+                callback=self._on_edge,
+                bouncetime=config.button_bounce_ms
+            )
+            
             # 设置LED引脚（可选）
             if self.enable_led:
                 GPIO.setup(config.led_pin, GPIO.OUT)
@@ -83,61 +115,132 @@ class GPIOController:
             self.logger.error(f"读取按钮状态失败: {e}", exc_info=True)
             return False
     
+    def _on_edge(self, channel: int):
+        """边沿中断回调（RPi.GPIO 事件线程）"""
+        now = time.monotonic()
+        with self._lock:
+            if GPIO.input(channel) == GPIO.HIGH:
+                # 按下
+                self.button_pressed = True
+                self.button_press_time = now
+                self._long_fired = False
+                self._cancel_timer("_long_timer")
+                self._long_timer = threading.Timer(
+                    config.button_long_press, self._on_long_press, args=(now,)
+                )
+                self._long_timer.daemon = True
+                self._long_timer.start()
+                return
+            
+            # 释放
+            pressed_at = self.button_press_time
+            self.button_pressed = False
+            self.button_press_time = None
+            self._cancel_timer("_long_timer")
+            if pressed_at is None or self._long_fired:
+                return
+            
+            duration = now - pressed_at
+            if duration < 0.05:  # 至少按下50ms才算有效
+                return
+            self._on_short_press(ButtonEvent("SHORT", pressed_at, duration))
+    
+    def _on_long_press(self, pressed_at: float):
+        """
+        按住达到长按阈值（计时器线程），无需等待释放即发出事件
+        
+        发出前重新读取引脚：释放沿被去抖吞掉或抖动被误读为按下时，
+        引脚已是未按下状态，此时清除按下状态而不发出 LONG（LONG 会退出程序）
+        """
+        with self._lock:
+            if self.button_press_time != pressed_at:
+                return
+            if GPIO.input(config.button_pin) != GPIO.HIGH:
+                self.logger.debug("长按计时到期时按钮已释放（释放沿丢失），忽略")
+                self.button_pressed = False
+                self.button_press_time = None
+                self._long_timer = None
+                return
+            self._long_fired = True
+        self.logger.info("检测到长按")
+        self.events.put(ButtonEvent("LONG", pressed_at, time.monotonic() - pressed_at))
+    
+    def _on_short_press(self, event: ButtonEvent):
+        """
+        处理一次短按（调用方持有 _lock）
+        
+        未启用双击时立即发出 SHORT；否则等待双击窗口，
+        窗口内的第二次短按合并为 DOUBLE
+        """
+        if config.button_double_window <= 0:
+            self.logger.info("检测到短按")
+            self.events.put(event)
+            return
+        
+        if self._pending_short is not None:
+            self._cancel_timer("_short_timer")
+            first = self._pending_short
+            self._pending_short = None
+            self.logger.info("检测到双击")
+            self.events.put(ButtonEvent("DOUBLE", first.pressed_at, event.duration))
+            return
+        
+        self._pending_short = event
+        self._short_timer = threading.Timer(config.button_double_window, self._flush_short)
+        self._short_timer.daemon = True
+        self._short_timer.start()
+    
+    def _flush_short(self):
+        """双击窗口结束，发出挂起的短按"""
+        with self._lock:
+            event = self._pending_short
+            self._pending_short = None
+        if event is not None:
+            self.logger.info("检测到短按")
+            self.events.put(event)
+    
+    def _cancel_timer(self, name: str):
+        """取消并清除计时器"""
+        timer = getattr(self, name)
+        if timer is not None:
+            timer.cancel()
+            setattr(self, name, None)
+    
+    def wait_for_event(self, timeout: Optional[float] = None) -> Optional[ButtonEvent]:
+        """
+        阻塞等待下一个按钮事件（空闲时进程休眠，不占用CPU）
+        
+        Args:
+            timeout: 超时时间（秒），None表示无限等待
+            
+        Returns:
+            按钮事件，超时或被 wake() 唤醒时返回None
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+    
+    def wake(self):
+        """唤醒阻塞在 wait_for_event 上的线程（例如收到退出信号时）"""
+        self.events.put(None)
+    
     def wait_for_button_press(self, long_press_duration: float = 2.0, timeout: float = None) -> str:
         """
         等待按钮按下
         
         Args:
-            long_press_duration: 长按时间阈值（秒）
+            long_press_duration: 保留参数，长按阈值由 BUTTON_LONG_PRESS 配置
             timeout: 超时时间（秒），None表示无限等待
             
         Returns:
-            "SHORT" 表示短按, "LONG" 表示长按, "TIMEOUT" 表示超时
+            "SHORT" 表示短按, "LONG" 表示长按, "DOUBLE" 表示双击, "TIMEOUT" 表示超时
         """
         if not self._initialized:
             return "TIMEOUT"
         
-        button_press_time = None
-        start_time = time.time()
-        
-        while True:
-            # 检查超时
-            if timeout and (time.time() - start_time) >= timeout:
-                return "TIMEOUT"
-            
-            is_pressed = self.is_button_pressed()
-            
-            if is_pressed:
-                # 按钮被按下
-                if button_press_time is None:
-                    button_press_time = time.time()
-                    
-                # 检查是否长按
-                press_duration = time.time() - button_press_time
-                if press_duration >= long_press_duration:
-                    # 长按
-                    self.logger.info("检测到长按")
-                    # 等待按钮释放
-                    while self.is_button_pressed():
-                        time.sleep(0.05)
-                    return "LONG"
-            else:
-                # 按钮释放
-                if button_press_time is not None:
-                    press_duration = time.time() - button_press_time
-                    
-                    if press_duration >= 0.05:  # 至少按下50ms才算有效
-                        if press_duration < long_press_duration:
-                            # 短按
-                            self.logger.info("检测到短按")
-                            return "SHORT"
-                        else:
-                            self.logger.info("检测到长按")
-                            return "LONG"
-                    
-                    button_press_time = None
-            
-            time.sleep(0.02)  # 20ms 轮询间隔
+        event = self.wait_for_event(timeout)
+        return event.kind if event else "TIMEOUT"
     
     def led_on(self):
         """打开LED"""
@@ -196,6 +299,11 @@ class GPIOController:
         if GPIO_AVAILABLE:
             try:
                 self.logger.info("正在清理GPIO...")
+                with self._lock:
+                    self._cancel_timer("_long_timer")
+                    self._cancel_timer("_short_timer")
+                if self._initialized:
+                    GPIO.remove_event_detect(config.button_pin)
                 GPIO.cleanup()
                 self.logger.info("GPIO已清理")
             except Exception as e:
@@ -0,0 +1,275 @@
+"""
+照片存储管理模块
+
+照片按日期分目录保存（images/YYYY/MM/DD），每张照片旁边保存一张缩略图；
+空闲时在后台重新压缩原图，并按容量/数量上限从最旧的照片开始淘汰：
+先删原图保留缩略图，仍超限时再删缩略图。
+旧版本直接保存在 images/ 下的照片在启动扫描时移入对应的日期目录并补生成缩略图
+"""
+import collections
+import io
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from PIL import Image
+
+from .config import config
+
+
+THUMB_SUFFIX = ".thumb.jpg"
+# 文件名中的拍摄时间（image_YYYYMMDD_HHMMSS，新版本带 _微秒）
+TIMESTAMP_PATTERN = re.compile(r"image_(\d{8}_\d{6})(?:_(\d{6}))?")
+
+
+def thumbnail_path(image_path: Path) -> Path:
+    """照片对应的缩略图路径"""
+    return image_path.with_name(image_path.stem + THUMB_SUFFIX)
+
+
+def captured_at(path: Path) -> datetime:
+    """照片（或缩略图）的拍摄时间：取自文件名，无法解析时用修改时间"""
+    match = TIMESTAMP_PATTERN.match(path.name)
+    if match:
+        try:
+            taken = datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+            return taken.replace(microsecond=int(match.group(2) or 0))
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(path.stat().st_mtime)
+
+
+class ImageStore:
+    """照片存储：日期分目录、缩略图、后台重压缩和容量淘汰"""
+
+    def __init__(self, root: Optional[Path] = None) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.root = root or config.images_dir
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # 路径 -> 字节数，按拍摄时间从旧到新排列
+        self._originals: "collections.OrderedDict[Path, int]" = collections.OrderedDict()
+        self._thumbnails: "collections.OrderedDict[Path, int]" = collections.OrderedDict()
+        # 等待重新压缩的原图
+        self._pending: "collections.deque[Path]" = collections.deque()
+        self._scan()
+
+        self._idle: Callable[[], bool] = lambda: True
+        self._stop = threading.Event()
+        self._maintenance: Optional[threading.Thread] = None
+
+    def _scan(self):
+        """启动时扫描现有照片，建立按拍摄时间排序的容量索引"""
+        originals, thumbnails = [], []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = Path(directory) / name
+                if name.endswith(THUMB_SUFFIX):
+                    thumbnails.append(path)
+                elif name.endswith(".jpg"):
+                    originals.append(path)
+
+        legacy = [path for path in originals if path.parent == self.root]
+        if legacy:
+            self.logger.info("正在把 %s 张旧照片移入日期目录...", len(legacy))
+        for path in legacy:
+            moved = self._migrate(path)
+            if moved is None:
+                continue
+            originals[originals.index(path)] = moved
+            thumb = self._make_thumbnail(moved)
+            if thumb is not None:
+                thumbnails.append(thumb)
+
+        for paths, index in ((originals, self._originals), (thumbnails, self._thumbnails)):
+            dated = []
+            for path in paths:
+                try:
+                    dated.append((captured_at(path), path, path.stat().st_size))
+                except OSError:
+                    continue
+            for _, path, size in sorted(dated):
+                index[path] = size
+
+    def _migrate(self, path: Path) -> Optional[Path]:
+        """把旧版本直接保存在根目录下的照片移入日期目录，返回新路径（失败时返回None）"""
+        try:
+            target = self.root / captured_at(path).strftime("%Y/%m/%d") / path.name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, target)
+            return target
+        except OSError as e:
+            self.logger.warning(f"移动旧照片失败 {path}: {e}")
+            return None
+
+    @property
+    def total_bytes(self) -> int:
+        """原图和缩略图占用的总字节数"""
+        with self._lock:
+            return sum(self._originals.values()) + sum(self._thumbnails.values())
+
+    def path_for(self, captured_at: datetime) -> Path:
+        """按拍摄时间生成分目录的照片路径"""
+        directory = self.root / captured_at.strftime("%Y/%m/%d")
+        return directory / f"image_{captured_at.strftime('%Y%m%d_%H%M%S_%f')}.jpg"
+
+    def save(self, data: bytes, path: Path):
+        """
+        写入照片（先写临时文件再重命名）并登记
+
+        Args:
+            data: JPEG 数据
+            path: 目标路径（通常来自 path_for）
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self.register(path, data)
+
+    def register(self, path: Path, data: Optional[bytes] = None):
+        """
+        登记已写入的照片：生成缩略图、加入重压缩队列并执行容量淘汰
+
+        Args:
+            path: 照片路径
+            data: 照片内容（已在内存中时传入，可省去一次读盘）
+        """
+        thumb = self._make_thumbnail(path, data)
+        with self._lock:
+            self._originals[path] = len(data) if data is not None else path.stat().st_size
+            if thumb is not None:
+                self._thumbnails[thumb] = thumb.stat().st_size
+            if config.image_recompress_quality > 0:
+                self._pending.append(path)
+        self.enforce_quota()
+
+    def _make_thumbnail(self, path: Path, data: Optional[bytes] = None) -> Optional[Path]:
+        """生成缩略图，返回其路径（失败时返回None）"""
+        thumb = thumbnail_path(path)
+        try:
+            img = Image.open(io.BytesIO(data) if data is not None else path)
+            size = config.image_thumbnail_size
+            img.draft("RGB", (size, size))
+            img = img.convert("RGB")
+            img.thumbnail((size, size), Image.Resampling.BILINEAR)
+            img.save(thumb, format="JPEG", quality=80)
+            return thumb
+        except Exception as e:
+            self.logger.warning(f"生成缩略图失败: {e}")
+            return None
+
+    def enforce_quota(self):
+        """超出容量或数量上限时从最旧的照片开始淘汰"""
+        max_bytes = config.image_quota_mb * 1024 * 1024
+        max_count = config.image_quota_count
+        evicted = []
+
+        with self._lock:
+            original_bytes = sum(self._originals.values())
+            thumb_bytes = sum(self._thumbnails.values())
+
+            # 第一层：删除原图，保留缩略图
+            while self._originals and (
+                (max_bytes > 0 and original_bytes + thumb_bytes > max_bytes)
+                or (max_count > 0 and len(self._originals) > max_count)
+            ):
+                path, size = self._originals.popitem(last=False)
+                original_bytes -= size
+                evicted.append(path)
+            # 第二层：只剩缩略图仍超限时删除缩略图
+            while self._thumbnails and max_bytes > 0 and thumb_bytes > max_bytes:
+                path, size = self._thumbnails.popitem(last=False)
+                thumb_bytes -= size
+                evicted.append(path)
+
+        for path in evicted:
+            try:
+                path.unlink(missing_ok=True)
+                self._remove_empty_dirs(path.parent)
+            except OSError as e:
+                self.logger.warning(f"删除照片失败 {path}: {e}")
+        if evicted:
+            self.logger.info("照片存储超出上限，已淘汰 %s 个文件", len(evicted))
+
+    def _remove_empty_dirs(self, directory: Path):
+        """删除淘汰后变空的日期目录"""
+        while directory != self.root and self.root in directory.parents:
+            try:
+                directory.rmdir()
+            except OSError:
+                return
+            directory = directory.parent
+
+    def recompress_next(self) -> bool:
+        """
+        重新压缩一张待处理的原图（更小时才替换）
+
+        Returns:
+            是否还有待处理的原图
+        """
+        with self._lock:
+            if not self._pending:
+                return False
+            path = self._pending.popleft()
+            if path not in self._originals:
+                return bool(self._pending)
+
+        try:
+            before = path.stat().st_size
+            buffer = io.BytesIO()
+            with Image.open(path) as img:
+                img.save(
+                    buffer,
+                    format="JPEG",
+                    quality=config.image_recompress_quality,
+                    optimize=True,
+                    exif=img.info.get("exif", b"")
+                )
+            if buffer.tell() < before:
+                tmp_path = path.with_name(path.name + ".tmp")
+                tmp_path.write_bytes(buffer.getvalue())
+                os.replace(tmp_path, path)
+                with self._lock:
+                    if path in self._originals:
+                        self._originals[path] = buffer.tell()
+                self.logger.debug("照片已重新压缩: %s (%s -> %s KB)", path.name, before // 1024, buffer.tell() // 1024)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.warning(f"重新压缩照片失败 {path}: {e}")
+
+        with self._lock:
+            return bool(self._pending)
+
+    def start_maintenance(self, idle: Callable[[], bool]):
+        """
+        启动后台维护线程：设备空闲时逐张重新压缩原图
+
+        Args:
+            idle: 返回设备当前是否空闲（例如流水线无任务）
+        """
+        self._idle = idle
+        if self._maintenance is not None:
+            return
+        self._maintenance = threading.Thread(
+            target=self._run_maintenance, name="image-maintenance", daemon=True
+        )
+        self._maintenance.start()
+
+    def _run_maintenance(self):
+        while not self._stop.wait(config.image_maintenance_interval):
+            while not self._stop.is_set() and self._idle() and self.recompress_next():
+                pass
+
+    def close(self):
+        """停止后台维护线程"""
+        self._stop.set()
+        if self._maintenance is not None:
+            self._maintenance.join(5)
+            self._maintenance = None
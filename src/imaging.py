@@ -0,0 +1,326 @@
+"""
+图像处理模块
+
+上传前对照片做缩小、裁剪和重新编码，减少上行流量；
+BLIP-2 在服务端只使用 224~364 像素的输入，上传全分辨率照片没有意义。
+另提供热敏打印用的光栅化：缩放到打印头宽度、抖动并按行打包
+"""
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from .config import config
+
+
+@dataclass
+class PreparedImage:
+    """预处理后的待上传图像"""
+    data: bytes
+    mime_type: str
+    size: tuple[int, int]
+    encode_ms: float
+    source_bytes: Optional[int] = None
+
+    def describe(self) -> str:
+        """日志描述"""
+        source = f"原始 {self.source_bytes // 1024} KB, " if self.source_bytes else ""
+        return (
+            f"{self.size[0]}x{self.size[1]} {self.mime_type} "
+            f"{len(self.data) // 1024} KB ({source}编码 {self.encode_ms:.0f} ms)"
+        )
+
+
+# 编码格式 -> (PIL 格式名, MIME 类型)
+_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+# MIME 类型 -> 文件扩展名
+EXTENSIONS = {"image/jpeg": ".jpg", "image/webp": ".webp"}
+
+
+def mime_type_of(data: bytes) -> str:
+    """按文件头判断编码后图像的 MIME 类型（只区分上传会用到的 JPEG 和 WebP）"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def yuv420_to_rgb(array: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    将 Picamera2 lores 流的 YUV420 数组转换为 RGB
+
+    Args:
+        array: capture_array("lores") 返回的 (height*3/2, stride) 数组
+        width: 画面宽度
+        height: 画面高度
+
+    Returns:
+        (height, width, 3) 的 uint8 RGB 数组
+    """
+    stride = array.shape[1]
+    y = array[:height, :width].astype(np.float32)
+
+    # U/V 平面每行宽度为 stride/2，在数组中两行拼成一行存放
+    chroma = array[height:height + height // 2].reshape(-1)
+    plane = (height // 2) * (stride // 2)
+    u = chroma[:plane].reshape(height // 2, stride // 2)[:, :width // 2]
+    v = chroma[plane:plane * 2].reshape(height // 2, stride // 2)[:, :width // 2]
+    u = u.repeat(2, axis=0).repeat(2, axis=1).astype(np.float32) - 128
+    v = v.repeat(2, axis=0).repeat(2, axis=1).astype(np.float32) - 128
+
+    rgb = np.empty((height, width, 3), dtype=np.float32)
+    rgb[..., 0] = y + 1.402 * v
+    rgb[..., 1] = y - 0.344136 * u - 0.714136 * v
+    rgb[..., 2] = y + 1.772 * u
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def _open(image: Union[Path, bytes, np.ndarray, Image.Image]) -> tuple[Image.Image, Optional[int]]:
+    """打开任意形式的图像输入（文件只读取头部，尚未解码）"""
+    if isinstance(image, Image.Image):
+        return image, None
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image), None
+
+    if isinstance(image, bytes):
+        source_bytes = len(image)
+        img = Image.open(io.BytesIO(image))
+    else:
+        source_bytes = Path(image).stat().st_size
+        img = Image.open(image)
+    return img, source_bytes
+
+
+def _center_crop(img: Image.Image) -> Image.Image:
+    """居中裁剪为正方形"""
+    width, height = img.size
+    side = min(width, height)
+    left = (width - side) // 2
+    top = (height - side) // 2
+    return img.crop((left, top, left + side, top + side))
+
+
+def prepare_for_upload(image: Union[Path, bytes, np.ndarray, Image.Image]) -> PreparedImage:
+    """
+    按上传配置缩小、裁剪并重新编码图像
+
+    Args:
+        image: 文件路径、JPEG字节、RGB数组或 PIL 图像
+
+    Returns:
+        预处理后的图像
+    """
+    started = time.perf_counter()
+    max_size = config.upload_max_size
+    pil_format, mime_type = _FORMATS.get(config.upload_format, _FORMATS["jpeg"])
+
+    img, source_bytes = _open(image)
+
+    # 已经足够小且格式一致的编码数据直接透传，避免二次有损压缩
+    if (
+        isinstance(image, bytes)
+        and img.format == pil_format
+        and max(img.size) <= max_size
+        and (config.upload_crop != "center" or img.size[0] == img.size[1])
+    ):
+        return PreparedImage(
+            data=image,
+            mime_type=mime_type,
+            size=img.size,
+            encode_ms=(time.perf_counter() - started) * 1000,
+            source_bytes=source_bytes
+        )
+
+    # JPEG 可按 1/2、1/4、1/8 缩放解码，比完整解码再缩小快得多
+    if img.format == "JPEG":
+        img.draft("RGB", (max_size, max_size))
+    if config.upload_crop == "center":
+        img = _center_crop(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((max_size, max_size), Image.Resampling.BICUBIC)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=pil_format, quality=config.upload_quality)
+
+    return PreparedImage(
+        data=buffer.getvalue(),
+        mime_type=mime_type,
+        size=img.size,
+        encode_ms=(time.perf_counter() - started) * 1000,
+        source_bytes=source_bytes
+    )
+
+
+# ----------------------------------------------------------------------
+# 热敏打印光栅化
+# ----------------------------------------------------------------------
+
+@dataclass
+class RasterImage:
+    """按行打包的 1 位光栅图像（1 = 黑点，每行 MSB 在左）"""
+    data: bytes
+    width_bytes: int
+    height: int
+
+    @property
+    def width(self) -> int:
+        """点宽（8 的倍数）"""
+        return self.width_bytes * 8
+
+
+# 8x8 Bayer 矩阵，归一化为 0~255 的阈值
+_BAYER_8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32) * 4 + 2
+
+# 光栅缓存：键 -> RasterImage（LRU）
+_raster_cache: "OrderedDict[str, RasterImage]" = OrderedDict()
+_raster_lock = threading.Lock()
+
+
+def _fit_width(img: Image.Image, width: int) -> Image.Image:
+    """转为灰度并等比缩放到打印头宽度"""
+    if img.format == "JPEG":
+        img.draft("L", (width, width * 4))
+    img = img.convert("L")
+    if img.width != width:
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.Resampling.BILINEAR)
+    return img
+
+
+def dither(img: Image.Image, method: str = "floyd") -> np.ndarray:
+    """
+    将灰度图像抖动为黑白点阵
+
+    Args:
+        img: 灰度图像（L 模式）
+        method: floyd=Floyd–Steinberg（Pillow C 实现），ordered=8x8 Bayer 有序抖动（NumPy）
+
+    Returns:
+        (height, width) 的布尔数组，True 表示黑点
+    """
+    if method == "ordered":
+        pixels = np.asarray(img, dtype=np.float32)
+        height, width = pixels.shape
+        threshold = np.tile(_BAYER_8, (height // 8 + 1, width // 8 + 1))[:height, :width]
+        return pixels < threshold
+
+    # Pillow 的 "1" 模式中 0 为黑
+    return np.asarray(img.convert("1", dither=Image.Dither.FLOYDSTEINBERG)) == 0
+
+
+def pack_raster(dots: np.ndarray) -> RasterImage:
+    """
+    把黑白点阵按行打包为 GS v 0 所需的字节
+
+    Args:
+        dots: (height, width) 的布尔数组，True 表示黑点
+
+    Returns:
+        打包后的光栅图像（宽度不足 8 的倍数时右侧补白）
+    """
+    packed = np.packbits(dots, axis=1)
+    return RasterImage(data=packed.tobytes(), width_bytes=packed.shape[1], height=dots.shape[0])
+
+
+def _cached_raster(key: str, build) -> RasterImage:
+    """按键读取光栅缓存，未命中时生成并写入"""
+    with _raster_lock:
+        raster = _raster_cache.get(key)
+        if raster is not None:
+            _raster_cache.move_to_end(key)
+            return raster
+
+    raster = build()
+    with _raster_lock:
+        _raster_cache[key] = raster
+        while len(_raster_cache) > config.raster_cache_entries:
+            _raster_cache.popitem(last=False)
+    return raster
+
+
+def rasterize_image(image: Union[Path, bytes, np.ndarray, Image.Image], width: Optional[int] = None) -> RasterImage:
+    """
+    将照片缩放到打印头宽度、抖动并打包（结果按内容缓存，重复打印无需重新计算）
+
+    Args:
+        image: 文件路径、JPEG字节、RGB数组或 PIL 图像
+        width: 打印点宽，默认使用 PRINTER_DOTS
+
+    Returns:
+        打包后的光栅图像
+    """
+    width = width or config.printer_dots
+    method = config.printer_dither
+
+    def build() -> RasterImage:
+        img, _ = _open(image)
+        return pack_raster(dither(_fit_width(img, width), method))
+
+    if isinstance(image, bytes):
+        digest = hashlib.sha1(image).hexdigest()
+    elif isinstance(image, Path):
+        stat = image.stat()
+        digest = f"{image}:{stat.st_mtime_ns}:{stat.st_size}"
+    else:
+        # 数组和 PIL 图像没有稳定的内容标识，不缓存
+        return build()
+    return _cached_raster(f"image:{digest}:{width}:{method}", build)
+
+
+def _load_font(size: int) -> ImageFont.ImageFont:
+    """加载打印字体（PRINTER_FONT 未设置时使用 Pillow 内置字体，不含中文字形）"""
+    if config.printer_font:
+        return ImageFont.truetype(config.printer_font, size)
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow < 10.1 的内置字体不支持指定字号（例如 apt 安装的 python3-pil）
+        return ImageFont.load_default()
+
+
+def rasterize_text(text: str, width: Optional[int] = None) -> RasterImage:
+    """
+    用自定义字体把多行文本渲染为光栅图像（结果按内容缓存）
+
+    Args:
+        text: 已按打印宽度换好的文本
+        width: 打印点宽，默认使用 PRINTER_DOTS
+
+    Returns:
+        打包后的光栅图像
+    """
+    width = width or config.printer_dots
+    size = config.printer_font_size
+
+    def build() -> RasterImage:
+        font = _load_font(size)
+        line_height = round(size * 1.4)
+        lines = text.split("\n")
+        img = Image.new("L", (width, max(1, line_height * len(lines))), 255)
+        draw = ImageDraw.Draw(img)
+        for i, line in enumerate(lines):
+            draw.text((0, i * line_height), line, font=font, fill=0)
+        # 文字只有黑白两色，直接阈值化即可
+        return pack_raster(np.asarray(img) < 128)
+
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    return _cached_raster(f"text:{digest}:{width}:{config.printer_font}:{size}", build)
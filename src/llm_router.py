@@ -0,0 +1,446 @@
+"""
+诗歌生成提供方路由模块
+
+诗歌生成可使用任意 OpenAI 兼容的 /v1/chat/completions 接口（DeepSeek、局域网或本机服务等）。
+LLMRouter 为每个提供方记录最近的延迟并计算 p50/p95，优先使用最快的提供方；
+请求超过其 p95 仍未返回时向下一个提供方发出对冲请求，先返回者胜出，另一个被取消。
+每次请求的超时由提供方近期的 p99 推算，并受本次按键剩余时间预算的限制（见 resilience.py）。
+连续失败的提供方会被熔断 LLM_BREAKER_COOLDOWN 秒，之后放行一次试探请求
+"""
+import asyncio
+import collections
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from .config import config
+from .resilience import MIN_SAMPLES, BudgetExhausted, attempt_timeout, backoff, can_retry, current_budget, percentile
+
+if TYPE_CHECKING:
+    import httpx
+
+
+T = TypeVar("T")
+
+DEEPSEEK_URL = "https://api.deepseek.com/v1/chat/completions"
+
+# 延迟类型：complete=非流式请求总耗时, first_token=流式请求首个增量到达耗时,
+# batch=一次生成多首诗的请求总耗时（远长于单首，单独统计以免拉高单首的对冲阈值）
+COMPLETE = "complete"
+FIRST_TOKEN = "first_token"
+BATCH = "batch"
+
+
+def _latency_window() -> "collections.deque[float]":
+    return collections.deque(maxlen=max(config.llm_latency_window, MIN_SAMPLES))
+
+
+@dataclass
+class LLMProvider:
+    """一个 OpenAI 兼容的诗歌生成提供方"""
+    name: str
+    url: str
+    model: str
+    api_key: str = ""
+    latency: dict[str, "collections.deque[float]"] = field(
+        default_factory=lambda: collections.defaultdict(_latency_window), repr=False
+    )
+    # 连续失败次数与熔断截止时间（monotonic）
+    failures: int = 0
+    open_until: float = 0.0
+
+    def headers(self) -> dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    def percentile(self, q: float, kind: str = COMPLETE) -> Optional[float]:
+        """最近延迟的分位数，样本不足时返回None"""
+        return percentile(self.latency[kind], q)
+
+    def p50(self, kind: str = COMPLETE) -> Optional[float]:
+        return self.percentile(0.5, kind)
+
+    def p95(self, kind: str = COMPLETE) -> Optional[float]:
+        return self.percentile(0.95, kind)
+
+    def p99(self, kind: str = COMPLETE) -> Optional[float]:
+        return self.percentile(0.99, kind)
+
+    def hedge_delay(self, kind: str = COMPLETE) -> Optional[float]:
+        """超过该时间仍未返回即发出对冲请求（None 表示不对冲）"""
+        p95 = self.p95(kind)
+        if p95 is not None:
+            return p95
+        # 批量请求的耗时随条数增长，没有测得分位数前不对冲，避免重复付费
+        return None if kind == BATCH else config.llm_hedge_delay
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """熔断器是否闭合（冷却结束后处于半开状态，也视为可用）"""
+        return (now if now is not None else time.monotonic()) >= self.open_until
+
+    def record_success(self, seconds: float, kind: str = COMPLETE):
+        self.latency[kind].append(seconds)
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self) -> bool:
+        """
+        记录一次失败
+
+        Returns:
+            熔断器是否因此断开
+        """
+        self.failures += 1
+        if self.failures >= config.llm_breaker_threshold:
+            self.open_until = time.monotonic() + config.llm_breaker_cooldown
+            return True
+        return False
+
+    def describe(self, kind: str = COMPLETE) -> str:
+        p50, p95 = self.p50(kind), self.p95(kind)
+        if p50 is None:
+            return f"{self.name} (样本 {len(self.latency[kind])})"
+        return f"{self.name} (p50 {p50:.2f}s, p95 {p95:.2f}s)"
+
+
+def parse_providers(specs: str) -> list[LLMProvider]:
+    """
+    解析 JSON 数组形式的提供方配置，每项包含 name、url、model 和可选的 api_key
+
+    无效的配置项记录错误后跳过
+    """
+    logger = logging.getLogger(__name__)
+    if not specs:
+        return []
+    try:
+        items = json.loads(specs)
+    except json.JSONDecodeError as e:
+        logger.error(f"提供方配置不是有效的 JSON: {e}")
+        return []
+
+    providers = []
+    for spec in items:
+        try:
+            providers.append(LLMProvider(
+                name=spec["name"],
+                url=spec["url"],
+                model=spec.get("model", ""),
+                api_key=spec.get("api_key", "")
+            ))
+        except (KeyError, TypeError) as e:
+            logger.error(f"忽略无效的提供方配置 {spec!r}: 缺少 {e}")
+    return providers
+
+
+def providers_from_config() -> list[LLMProvider]:
+    """
+    按配置创建诗歌生成提供方列表
+
+    设置了 DEEPSEEK_API_KEY 时 DeepSeek 排在第一位，其后是 LLM_PROVIDERS 中的提供方
+    """
+    providers = []
+    if config.deepseek_api_key:
+        providers.append(LLMProvider(
+            name="deepseek",
+            url=DEEPSEEK_URL,
+            model=config.deepseek_model,
+            api_key=config.deepseek_api_key
+        ))
+    return providers + parse_providers(config.llm_providers)
+
+
+class LLMRouter:
+    """
+    在多个提供方之间选择、对冲和熔断
+
+    已有延迟样本的提供方按 p50 排序，尚未测量过的排在前面（按配置顺序）以便各试一次
+    """
+
+    def __init__(
+        self,
+        providers: list[LLMProvider],
+        client: Callable[[], Optional["httpx.AsyncClient"]]
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.providers = providers
+        # 客户端在 AIService.initialize() 中才创建，这里只保存取值函数
+        self._client = client
+
+    def candidates(self, kind: str = COMPLETE) -> list[LLMProvider]:
+        """按优先级排列的可用提供方（全部熔断时返回最早恢复的一个）"""
+        now = time.monotonic()
+        available = [p for p in self.providers if p.available(now)]
+        if not available and self.providers:
+            available = [min(self.providers, key=lambda p: p.open_until)]
+
+        order = {p.name: i for i, p in enumerate(self.providers)}
+        return sorted(
+            available,
+            key=lambda p: (p.p50(kind) or 0.0, order[p.name])
+        )
+
+    async def _race(
+        self,
+        start: Callable[[LLMProvider], Awaitable[T]],
+        kind: str,
+        release: Optional[Callable[[T], Awaitable[None]]] = None
+    ) -> tuple[LLMProvider, T]:
+        """
+        依次/对冲地向提供方发出请求，返回第一个成功的结果
+
+        主请求超过其 p95 仍未返回时向另一个提供方发出对冲请求（同时最多两个）；
+        请求失败时立即切换到其他提供方，重试同一提供方前按退避等待。单一提供方时按 LLM_MAX_ATTEMPTS 重试。
+        每次请求的超时由提供方近期 p99 推算；剩余时间预算放不下下一次尝试时放弃
+
+        Args:
+            start: 向一个提供方发出请求
+            kind: 延迟统计类别
+            release: 释放落败但同时成功的结果（例如关闭已打开的流）
+
+        Returns:
+            (胜出的提供方, 结果)
+        """
+        candidates = self.candidates(kind)
+        if not candidates:
+            raise RuntimeError("没有可用的诗歌生成提供方")
+        attempts = max(len(candidates), config.llm_max_attempts)
+        queue = collections.deque(candidates[i % len(candidates)] for i in range(attempts))
+
+        running: dict[asyncio.Task, tuple[LLMProvider, float]] = {}
+        errors: list[str] = []
+        tried: set[str] = set()
+        retries = 0
+
+        def run(provider: LLMProvider) -> LLMProvider:
+            task = asyncio.ensure_future(
+                asyncio.wait_for(start(provider), attempt_timeout(provider.p99(kind)))
+            )
+            running[task] = (provider, time.monotonic())
+            tried.add(provider.name)
+            return provider
+
+        def launch(force: bool = False) -> Optional[LLMProvider]:
+            now = time.monotonic()
+            while queue:
+                provider = queue.popleft()
+                # 本轮中途被熔断的提供方跳过（首个请求总是发出，全部熔断时用于试探）
+                if force or provider.available(now):
+                    return run(provider)
+            return None
+
+        def hedge_target() -> Optional[LLMProvider]:
+            """对冲只发给尚无请求在途的其他提供方（队列中重复的条目只用于失败后重试）"""
+            busy = {p.name for p, _ in running.values()}
+            now = time.monotonic()
+            return next((p for p in queue if p.name not in busy and p.available(now)), None)
+
+        def hedge_deadline(provider: LLMProvider) -> Optional[float]:
+            delay = provider.hedge_delay(kind)
+            if not config.llm_hedge or delay is None or hedge_target() is None:
+                return None
+            return time.monotonic() + delay
+
+        if not can_retry(None, 0.0):
+            raise BudgetExhausted("时间预算已用尽，未发出请求")
+        hedge_at = hedge_deadline(launch(force=True))
+        try:
+            while running:
+                timeout = None if hedge_at is None else max(hedge_at - time.monotonic(), 0)
+                done, _ = await asyncio.wait(
+                    running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    slow = next(iter(running.values()))[0]
+                    # 剩余预算不够对冲请求完成时不再额外付费
+                    target = hedge_target()
+                    budget = current_budget()
+                    hedged = None
+                    if target is not None and (budget is None or budget.fits(target.p50(kind))):
+                        queue.remove(target)
+                        hedged = run(target)
+                    hedge_at = None
+                    if hedged is not None:
+                        self.logger.info(
+                            "%s 超过 %.2fs 未返回，向 %s 发出对冲请求",
+                            slow.name, slow.hedge_delay(kind), hedged.name
+                        )
+                    continue
+
+                winner: Optional[tuple[LLMProvider, T]] = None
+                for task in done:
+                    provider, started = running.pop(task)
+                    try:
+                        result = task.result()
+                    except asyncio.CancelledError:
+                        # 不是提供方的问题，不计入熔断
+                        errors.append(f"{provider.name}: 已取消")
+                        continue
+                    except Exception as e:
+                        if isinstance(e, asyncio.TimeoutError):
+                            e = RuntimeError(f"超时 ({time.monotonic() - started:.1f}s)")
+                        errors.append(f"{provider.name}: {e}")
+                        if provider.record_failure():
+                            self.logger.warning(
+                                "诗歌生成提供方 %s 连续失败 %s 次，熔断 %.0fs",
+                                provider.name, provider.failures, config.llm_breaker_cooldown
+                            )
+                        else:
+                            self.logger.warning(f"诗歌生成提供方 {provider.name} 失败: {e}")
+                        continue
+
+                    elapsed = time.monotonic() - started
+                    provider.record_success(elapsed, kind)
+                    if winner is not None:
+                        # 主请求与对冲请求在同一轮完成：释放落败的结果
+                        await self._release(release, provider, result)
+                        continue
+                    self.logger.info(
+                        "诗歌生成提供方: %s (%.2fs)", provider.describe(kind), elapsed
+                    )
+                    winner = (provider, result)
+                if winner is not None:
+                    return winner
+
+                # 进行中的请求都失败了：切换到下一个，重试已失败过的提供方前先退避
+                if not running:
+                    # 本轮中途被熔断的提供方跳过
+                    now = time.monotonic()
+                    while queue and not queue[0].available(now):
+                        queue.popleft()
+                if not running and queue:
+                    wait = 0.0
+                    if queue[0].name in tried:
+                        retries += 1
+                        wait = backoff(retries)
+                    if not can_retry(queue[0].p50(kind), wait):
+                        self.logger.warning("剩余时间预算不足，放弃重试")
+                        break
+                    if wait:
+                        self.logger.info("%.2fs 后重试 %s", wait, queue[0].name)
+                        await asyncio.sleep(wait)
+                    provider = launch()
+                    if provider is not None:
+                        hedge_at = hedge_deadline(provider)
+        finally:
+            # 取消落败的请求
+            for task in running:
+                task.cancel()
+
+        budget = current_budget()
+        if budget is not None and budget.exhausted:
+            raise BudgetExhausted("时间预算用尽: " + "; ".join(errors))
+        raise RuntimeError("所有诗歌生成提供方均失败: " + "; ".join(errors))
+
+    async def _release(
+        self,
+        release: Optional[Callable[[T], Awaitable[None]]],
+        provider: LLMProvider,
+        result: T
+    ):
+        """释放落败请求的结果，出错只记录日志"""
+        if release is None:
+            return
+        try:
+            await release(result)
+        except Exception as e:
+            self.logger.debug("释放 %s 的结果失败: %s", provider.name, e)
+
+    def _payload(self, provider: LLMProvider, messages: list, stream: bool, **params) -> dict:
+        data = {"messages": messages, "stream": stream, **params}
+        if provider.model:
+            data["model"] = provider.model
+        return data
+
+    async def _post(self, provider: LLMProvider, messages: list, **params) -> dict:
+        response = await self._client().post(
+            provider.url,
+            json=self._payload(provider, messages, False, **params),
+            headers=provider.headers()
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def _stream_provider(self, provider: LLMProvider, messages: list) -> AsyncIterator[str]:
+        """以 SSE 方式调用一个提供方，逐段产出文本增量"""
+        async with self._client().stream(
+            "POST",
+            provider.url,
+            json=self._payload(provider, messages, True),
+            headers=provider.headers()
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+
+                chunk = json.loads(payload)
+                choices = chunk.get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    async def _open_stream(
+        self,
+        provider: LLMProvider,
+        messages: list
+    ) -> tuple[AsyncIterator[str], str]:
+        """开始流式请求并等到首个增量（对冲按首字延迟进行）"""
+        stream = self._stream_provider(provider, messages)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            raise RuntimeError("流式响应为空")
+        except BaseException:
+            await stream.aclose()
+            raise
+        return stream, first
+
+    async def complete(self, messages: list, kind: str = COMPLETE, **params) -> dict:
+        """
+        非流式生成
+
+        Args:
+            messages: 消息列表
+            kind: 延迟类型（批量请求传 BATCH，延迟单独统计）
+            **params: 附加的请求参数（如 response_format、max_tokens）
+
+        Returns:
+            胜出提供方的 API 响应
+        """
+        _, result = await self._race(lambda p: self._post(p, messages, **params), kind)
+        return result
+
+    async def stream(self, messages: list) -> AsyncIterator[str]:
+        """
+        流式生成（在首个增量到达前进行对冲，之后只读取胜出的流）
+
+        Args:
+            messages: 消息列表
+
+        Yields:
+            逐段到达的文本增量
+        """
+        provider, (chunks, first) = await self._race(
+            lambda p: self._open_stream(p, messages), FIRST_TOKEN,
+            release=lambda opened: opened[0].aclose()
+        )
+        try:
+            yield first
+            async for delta in chunks:
+                yield delta
+        except Exception:
+            provider.record_failure()
+            raise
+        finally:
+            await chunks.aclose()
+
+    def describe(self) -> str:
+        """各提供方的延迟与熔断状态"""
+        now = time.monotonic()
+        return ", ".join(
+            p.describe() + ("" if p.available(now) else " [熔断]") for p in self.providers
+        )
@@ -0,0 +1,244 @@
+"""
+离线任务队列模块
+
+网络不可用时，已拍摄但未生成诗歌的照片保存到 data/uploads（重启后仍在），
+后台线程定期探测网络，恢复后以有限并发重新处理，
+并按延迟打印策略决定补打还是只归档
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from .ai_service import AIService, ImageInput, PoemResult
+from .config import config
+from .imaging import EXTENSIONS, mime_type_of
+
+
+@dataclass
+class OfflineJob:
+    """离线队列中的一个任务"""
+    job_id: str
+    image_file: Path
+    created_at: datetime
+    # 归档照片路径（未启用归档时为None）
+    image_path: Optional[Path] = None
+    attempts: int = 0
+    # 队列中图像的实际编码（预处理后的上传图像可能是 WebP）
+    mime_type: str = "image/jpeg"
+
+    @property
+    def meta_file(self) -> Path:
+        return self.image_file.with_suffix(".json")
+
+    @property
+    def age(self) -> float:
+        """任务从拍摄到现在经过的秒数"""
+        return (datetime.now() - self.created_at).total_seconds()
+
+    def to_record(self) -> dict:
+        return {
+            "created_at": self.created_at.isoformat(),
+            "image_path": str(self.image_path) if self.image_path is not None else None,
+            "image_file": self.image_file.name,
+            "mime_type": self.mime_type,
+            "attempts": self.attempts
+        }
+
+    @classmethod
+    def load(cls, meta_file: Path) -> 'OfflineJob':
+        record = json.loads(meta_file.read_text(encoding="utf-8"))
+        return cls(
+            job_id=meta_file.stem,
+            # 旧版本的任务没有记录文件名，一律为 .jpg
+            image_file=meta_file.with_name(record.get("image_file") or f"{meta_file.stem}.jpg"),
+            created_at=datetime.fromisoformat(record["created_at"]),
+            image_path=Path(record["image_path"]) if record.get("image_path") else None,
+            attempts=record.get("attempts", 0),
+            mime_type=record.get("mime_type", "image/jpeg")
+        )
+
+
+def _write_atomic(path: Path, data: bytes):
+    """先写临时文件再重命名"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+class OfflineQueue:
+    """持久化的离线任务队列 + 联网检测与回放"""
+
+    def __init__(self, ai_service: AIService, spool_dir: Optional[Path] = None) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.ai_service = ai_service
+        self.spool_dir = spool_dir or config.uploads_dir
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+
+        # 处理完成的回调：(任务, 结果, 是否打印)
+        self.on_result: Optional[Callable[[OfflineJob, PoemResult, bool], None]] = None
+        # 最近一次已知的联网状态，离线时新任务直接入队，不再等待重试
+        self.online = True
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(list(self.spool_dir.glob("job_*.json")))
+
+    def enqueue(
+        self,
+        image: ImageInput,
+        created_at: Optional[datetime] = None,
+        image_path: Optional[Path] = None
+    ) -> Optional[OfflineJob]:
+        """
+        把未处理的照片放入离线队列
+
+        Args:
+            image: 交给AI的图像（文件路径或编码后的图像，按实际格式保存）
+            created_at: 拍摄时间
+            image_path: 归档照片路径
+
+        Returns:
+            入队的任务，写入失败返回None
+        """
+        created_at = created_at or datetime.now()
+        job_id = f"job_{created_at.strftime('%Y%m%d_%H%M%S_%f')}"
+        try:
+            data = image if isinstance(image, bytes) else Path(image).read_bytes()
+            mime_type = mime_type_of(data)
+            job = OfflineJob(
+                job_id=job_id,
+                image_file=self.spool_dir / f"{job_id}{EXTENSIONS[mime_type]}",
+                created_at=created_at,
+                image_path=image_path,
+                mime_type=mime_type
+            )
+            with self._lock:
+                # 先写图像再写元数据，元数据存在即表示任务完整
+                _write_atomic(job.image_file, data)
+                _write_atomic(job.meta_file, json.dumps(job.to_record()).encode("utf-8"))
+        except Exception as e:
+            self.logger.error(f"写入离线队列失败: {e}", exc_info=True)
+            return None
+
+        self.logger.info("已加入离线队列: %s (共 %s 个)", job_id, len(self))
+        self._wake.set()
+        return job
+
+    def pending(self) -> list[OfflineJob]:
+        """按拍摄顺序列出待处理任务（跳过损坏的元数据）"""
+        jobs = []
+        for meta_file in sorted(self.spool_dir.glob("job_*.json")):
+            try:
+                job = OfflineJob.load(meta_file)
+            except Exception as e:
+                self.logger.warning(f"跳过损坏的离线任务 {meta_file.name}: {e}")
+                continue
+            if job.image_file.exists():
+                jobs.append(job)
+        return jobs
+
+    def _remove(self, job: OfflineJob):
+        with self._lock:
+            job.meta_file.unlink(missing_ok=True)
+            job.image_file.unlink(missing_ok=True)
+
+    def _record_failure(self, job: OfflineJob):
+        """记录一次失败，超过最大尝试次数后放弃"""
+        job.attempts += 1
+        if job.attempts >= config.offline_max_attempts:
+            self.logger.error("离线任务 %s 已失败 %s 次，放弃", job.job_id, job.attempts)
+            self._remove(job)
+            return
+        with self._lock:
+            _write_atomic(job.meta_file, json.dumps(job.to_record()).encode("utf-8"))
+
+    def start(self):
+        """启动后台回放线程（启动时已有的任务也会被处理）"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="offline-drainer", daemon=True)
+        self._thread.start()
+        count = len(self)
+        if count:
+            self.logger.info("离线队列中有 %s 个待处理任务", count)
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(config.offline_probe_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+
+            jobs = self.pending()
+            if not jobs:
+                continue
+
+            self.online = self.ai_service.check_connectivity()
+            if not self.online:
+                self.logger.info("网络仍不可用，%s 个离线任务等待中", len(jobs))
+                continue
+
+            self.logger.info("网络已恢复，开始处理 %s 个离线任务", len(jobs))
+            with ThreadPoolExecutor(
+                max_workers=max(config.offline_concurrency, 1),
+                thread_name_prefix="offline-job"
+            ) as pool:
+                for job in jobs:
+                    if self._stop.is_set():
+                        break
+                    pool.submit(self._process, job)
+
+    def _process(self, job: OfflineJob):
+        """重新处理一个离线任务"""
+        try:
+            result = self.ai_service.process_image_to_poem(job.image_file.read_bytes())
+        except Exception as e:
+            self.logger.error(f"离线任务 {job.job_id} 处理出错: {e}", exc_info=True)
+            result = None
+
+        if not result:
+            self._record_failure(job)
+            return
+
+        should_print = self.should_print(job)
+        self.logger.info(
+            "离线任务 %s 完成 (延迟 %.0fs, %s)",
+            job.job_id, job.age, "补打印" if should_print else "仅归档"
+        )
+        if self.on_result:
+            self.on_result(job, result, should_print)
+        self._remove(job)
+
+    def should_print(self, job: OfflineJob) -> bool:
+        """
+        延迟打印策略
+
+        OFFLINE_PRINT_POLICY:
+            always=总是补打印, never=只归档,
+            recent=拍摄后 OFFLINE_PRINT_MAX_AGE 秒内完成的才补打印（访客可能还在现场）
+        """
+        policy = config.offline_print_policy
+        if policy == "always":
+            return True
+        if policy == "never":
+            return False
+        return job.age <= config.offline_print_max_age
+
+    def stop(self):
+        """停止回放线程（未处理的任务留在磁盘上，下次启动继续）"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(config.http_timeout)
+            self._thread = None
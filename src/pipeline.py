@@ -0,0 +1,648 @@
+"""
+拍照流水线模块
+
+将 拍照 → AI生成 → 打印归档 拆分为三个独立阶段，
+每个阶段拥有自己的有界队列和工作线程，按钮响应不再被网络请求阻塞
+"""
+import itertools
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from .ai_service import AIService, ImageInput, PoemResult
+from .archive import PoemArchive
+from .camera import Camera
+from .config import config
+from .offline_queue import OfflineJob, OfflineQueue
+from .printer import ThermalPrinter
+from .resilience import Budget, new_budget
+from .speculator import Speculator
+from .tracing import new_trace_id, tracer
+from .warmup import AI, CAMERA, LABELS, PRINTER, Warmup
+
+
+@dataclass
+class PoemJob:
+    """一次按钮触发对应的任务"""
+    job_id: int
+    pressed_at: float
+    created_at: datetime = field(default_factory=datetime.now)
+    # 追踪 ID（各阶段的耗时记录共用）
+    trace_id: str = field(default_factory=new_trace_id)
+    # 交给AI的图像（文件路径、内存JPEG或预处理后的上传图像）
+    image: Optional[ImageInput] = None
+    # 归档照片路径（内存模式下异步写入，未启用归档时为None）
+    image_path: Optional[Path] = None
+    result: Optional[PoemResult] = None
+    # 流式模式下逐行传递给打印阶段的队列，None 表示结束
+    poem_lines: Optional["queue.Queue[Optional[str]]"] = None
+    # 流式模式下本次按键的AI时间预算（打印阶段等待诗句不超过其剩余时间）
+    budget: Optional[Budget] = None
+    # 重新打印上一首（不再归档）
+    reprint: bool = False
+    # 是否打印（离线任务按延迟打印策略可能只归档）
+    print_result: bool = True
+
+    @property
+    def age(self) -> float:
+        """任务从按下按钮到现在经过的秒数"""
+        return time.monotonic() - self.pressed_at
+
+
+# 停止信号（沿流水线逐级传递）
+_STOP = object()
+
+
+class PipelineStage:
+    """流水线阶段：一个有界队列 + 一个工作线程"""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[PoemJob], Optional[PoemJob]],
+        maxsize: int,
+        downstream: Optional['PipelineStage'] = None
+    ) -> None:
+        self.logger = logging.getLogger(f"{__name__}.{name}")
+        self.name = name
+        self.handler = handler
+        self.downstream = downstream
+        self.queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self.busy = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动工作线程"""
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"pipeline-{self.name}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def put(self, job, block: bool = True) -> bool:
+        """
+        放入任务
+
+        Args:
+            job: 任务
+            block: 队列满时是否阻塞等待（阻塞即向上游施加背压）
+
+        Returns:
+            是否成功放入
+        """
+        try:
+            self.queue.put(job, block=block)
+            return True
+        except queue.Full:
+            return False
+
+    def depth(self) -> int:
+        """当前排队任务数"""
+        return self.queue.qsize()
+
+    def peek(self):
+        """队首任务（不取出），队列为空时返回None；只应在本阶段工作线程中调用"""
+        with self.queue.mutex:
+            return self.queue.queue[0] if self.queue.queue else None
+
+    def pending(self) -> bool:
+        """是否有排队或处理中的任务"""
+        return self.busy or self.depth() > 0
+
+    def join(self, timeout: Optional[float] = None):
+        """等待工作线程退出"""
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is _STOP:
+                if self.downstream:
+                    self.downstream.put(_STOP)
+                break
+
+            self.busy = True
+            try:
+                with tracer.bind(job.trace_id):
+                    result = self.handler(job)
+            except Exception as e:
+                self.logger.error(f"任务 #{job.job_id} 在 {self.name} 阶段出错: {e}", exc_info=True)
+                result = None
+            finally:
+                self.busy = False
+
+            # 阻塞式投递：下游满时本阶段暂停，背压逐级传回上游
+            if result is not None and self.downstream:
+                self.downstream.put(result)
+
+
+class PoemPipeline:
+    """拍照 → AI → 打印 三阶段流水线"""
+
+    def __init__(
+        self,
+        camera: Camera,
+        ai_service: AIService,
+        printer: ThermalPrinter,
+        archive: PoemArchive,
+        offline_queue: Optional[OfflineQueue] = None,
+        speculator: Optional[Speculator] = None,
+        warmup: Optional[Warmup] = None
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.camera = camera
+        self.ai_service = ai_service
+        self.printer = printer
+        self.archive = archive
+        # 网络不可用时暂存任务，恢复后回放的结果送回打印阶段
+        self.offline_queue = offline_queue
+        if offline_queue is not None:
+            offline_queue.on_result = self.submit_result
+        # 空闲时预生成的结果，按键场景一致时直接使用
+        self.speculator = speculator
+        # 快速启动时组件在后台预热、启用自愈时故障组件在后台恢复，各阶段处理前等待所需组件就绪
+        self.warmup = warmup
+
+        self._ids = itertools.count(1)
+
+        self.print_stage = PipelineStage(
+            "print", self._print_stage, config.pipeline_print_queue
+        )
+        # 突发模式下 AI 队列至少容纳一批，拍完的照片不必等待上一张处理完
+        ai_queue = max(config.pipeline_ai_queue, config.burst_max_size) if config.burst_enabled else config.pipeline_ai_queue
+        self.ai_stage = PipelineStage(
+            "ai", self._ai_stage, ai_queue, self.print_stage
+        )
+        self.capture_stage = PipelineStage(
+            "capture", self._capture_stage, config.pipeline_capture_queue, self.ai_stage
+        )
+        self.stages = [self.capture_stage, self.ai_stage, self.print_stage]
+        self._started = False
+        # 最近一次完成的结果（用于重新打印）
+        self.last_result: Optional[PoemResult] = None
+
+    def start(self):
+        """启动所有阶段"""
+        if self._started:
+            return
+        for stage in self.stages:
+            stage.start()
+            tracer.gauge(f"queue_depth_{stage.name}", stage.depth)
+        self._started = True
+        self.logger.info(
+            "流水线已启动 (队列上限: 拍照 %s / AI %s / 打印 %s)",
+            config.pipeline_capture_queue,
+            config.pipeline_ai_queue,
+            config.pipeline_print_queue
+        )
+
+    def submit(self, pressed_at: Optional[float] = None) -> bool:
+        """
+        提交一次拍照任务（按钮回调中调用，不阻塞）
+
+        Args:
+            pressed_at: 按下按钮的时刻（time.monotonic()），默认为当前时刻
+
+        Returns:
+            是否被接受，拍照队列已满时返回False
+        """
+        job = PoemJob(
+            job_id=next(self._ids),
+            pressed_at=pressed_at if pressed_at is not None else time.monotonic()
+        )
+        if not self.capture_stage.put(job, block=False):
+            self.logger.warning("流水线繁忙，丢弃本次按键 (%s)", self.describe_depths())
+            return False
+
+        self.logger.info("任务 #%s 已排队 (%s)", job.job_id, self.describe_depths())
+        return True
+
+    def submit_result(self, offline_job: OfflineJob, result: PoemResult, should_print: bool):
+        """
+        把离线队列回放得到的结果送入打印阶段（在回放线程中调用，队列满时阻塞）
+
+        Args:
+            offline_job: 离线任务
+            result: 生成结果
+            should_print: 是否打印，否则只归档
+        """
+        job = PoemJob(
+            job_id=next(self._ids),
+            pressed_at=time.monotonic(),
+            created_at=offline_job.created_at,
+            image_path=offline_job.image_path,
+            result=result,
+            print_result=should_print
+        )
+        self.print_stage.put(job)
+
+    def _defer(self, job: PoemJob) -> bool:
+        """
+        把任务放入离线队列
+
+        Returns:
+            是否已入队（未启用离线队列时返回False）
+        """
+        if self.offline_queue is None or job.image is None:
+            return False
+        deferred = self.offline_queue.enqueue(job.image, job.created_at, job.image_path)
+        if deferred:
+            self.logger.warning("任务 #%s 已转入离线队列，联网后继续处理", job.job_id)
+        return deferred is not None
+
+    def _on_ai_failure(self, job: PoemJob):
+        """AI 调用失败：探测网络，不可达时把任务转入离线队列"""
+        if self.offline_queue is None:
+            return
+        self.offline_queue.online = self.ai_service.check_connectivity()
+        if not self.offline_queue.online:
+            self._defer(job)
+
+    def reprint_last(self) -> bool:
+        """
+        把上一首诗重新送去打印（不经过拍照和AI阶段）
+
+        Returns:
+            是否被接受，没有可打印的诗或打印队列已满时返回False
+        """
+        if self.last_result is None:
+            self.logger.info("还没有可重新打印的诗歌")
+            return False
+
+        job = PoemJob(
+            job_id=next(self._ids),
+            pressed_at=time.monotonic(),
+            result=self.last_result,
+            reprint=True
+        )
+        if not self.print_stage.put(job, block=False):
+            self.logger.warning("打印队列已满，忽略重新打印")
+            return False
+        return True
+
+    def queue_depths(self) -> dict[str, int]:
+        """各阶段排队深度"""
+        return {stage.name: stage.depth() for stage in self.stages}
+
+    def describe_depths(self) -> str:
+        """排队深度的日志描述"""
+        return ", ".join(f"{name}={depth}" for name, depth in self.queue_depths().items())
+
+    def is_idle(self) -> bool:
+        """流水线是否空闲（无排队且无处理中的任务）"""
+        return not any(stage.pending() for stage in self.stages)
+
+    def stop(self, timeout: float = 10.0):
+        """
+        停止流水线，已排队的任务会按顺序处理完毕
+
+        Args:
+            timeout: 等待全部阶段退出的总时长（秒）
+        """
+        if not self._started:
+            return
+
+        self.logger.info("正在停止流水线 (%s)", self.describe_depths())
+        self.capture_stage.put(_STOP)
+
+        deadline = time.monotonic() + timeout
+        for stage in self.stages:
+            stage.join(max(0.0, deadline - time.monotonic()))
+
+        self._started = False
+        self.logger.info("流水线已停止")
+
+    # ------------------------------------------------------------------
+    # 各阶段处理函数
+    # ------------------------------------------------------------------
+
+    def _ready(self, name: str, job: PoemJob, hold: bool = False) -> bool:
+        """
+        等待组件就绪（快速启动时按键可能早于组件就绪，组件故障时正在后台恢复）
+
+        Args:
+            hold: 一直等到组件恢复（打印机故障期间保留已生成的诗歌），否则最多等待 WARMUP_TIMEOUT
+        """
+        if self.warmup is None or self.warmup.ready(name):
+            return True
+        self.logger.info("任务 #%s 等待%s就绪...", job.job_id, LABELS[name])
+        if self.warmup.wait(name, None if hold else config.warmup_timeout):
+            return True
+        self.logger.error("❌ 任务 #%s: %s不可用", job.job_id, LABELS[name])
+        return False
+
+    def _capture_stage(self, job: PoemJob) -> Optional[PoemJob]:
+        """拍照阶段"""
+        self.logger.info("=" * 50)
+        self.logger.info("任务 #%s 开始拍照...", job.job_id)
+        if not self._ready(CAMERA, job):
+            return None
+
+        if config.capture_in_memory:
+            if self.camera.lores_enabled:
+                frame = self.camera.capture_for_upload(
+                    encode_main=config.archive_images,
+                    pressed_at=job.pressed_at
+                )
+            else:
+                frame = self.camera.capture_bytes()
+            if not frame:
+                self.logger.error("❌ 任务 #%s 拍照失败", job.job_id)
+                self._on_camera_failure()
+                return None
+
+            # lores 模式下上传图像已在拍照时编码好
+            job.image = frame.upload or frame.data
+            if config.archive_images and frame.data:
+                job.image_path = self.camera.save_async(frame)
+        else:
+            # 零快门延迟：交给AI的图像取自按键时刻的环形缓冲帧（在拍摄主画面之前取，免得被新帧挤出）
+            upload = self.camera.upload_at(job.pressed_at)
+            image_path = self.camera.capture()
+            if not image_path:
+                self.logger.error("❌ 任务 #%s 拍照失败", job.job_id)
+                self._on_camera_failure()
+                return None
+
+            job.image_path = image_path
+            job.image = upload or image_path
+
+        self.logger.info("✓ 任务 #%s 拍照成功 (%.2fs)", job.job_id, job.age)
+        return job
+
+    def _on_camera_failure(self):
+        """拍照失败：交给监管检查相机，故障时在后台重新初始化"""
+        if self.warmup is not None:
+            self.warmup.report_failure(CAMERA)
+
+    def _ai_stage(self, job: PoemJob) -> Optional[PoemJob]:
+        """AI阶段：图像描述 + 诗歌生成"""
+        self.logger.info("任务 #%s 正在处理图像...", job.job_id)
+        if not self._ready(AI, job):
+            return None
+
+        # 突发模式：连续按键的照片合并为一批处理
+        if config.burst_enabled:
+            burst = self._collect_burst(job)
+            if len(burst) > 1:
+                return self._ai_stage_burst(burst)
+
+        # 本次按键的AI时间预算（等待预生成结果也计入）
+        budget = new_budget()
+
+        # 场景与空闲时预生成的一致：直接打印（离线时同样可用）
+        if self.speculator is not None:
+            result = self.speculator.take(job.image, budget=budget)
+            if result:
+                job.result = result
+                self.logger.info("✓ 任务 #%s 使用预生成的诗歌 (%.2fs)", job.job_id, job.age)
+                return job
+
+        # 已知离线时直接入队，不再等待请求超时和重试
+        if self.offline_queue is not None and not self.offline_queue.online and self._defer(job):
+            return None
+
+        # 单次调用模式返回结构化结果，无法逐行流式打印
+        if config.poem_streaming and not self.ai_service.uses_vision:
+            return self._ai_stage_streaming(job, budget)
+
+        result = self.ai_service.process_image_to_poem(job.image, budget=budget)
+        if not result:
+            self.logger.error("❌ 任务 #%s 诗歌生成失败", job.job_id)
+            self._on_ai_failure(job)
+            return None
+
+        job.result = result
+        if result.fallback:
+            self.logger.warning("任务 #%s 超出时间预算，打印备用诗歌 (%.2fs)", job.job_id, job.age)
+            return job
+        self.logger.info("✓ 任务 #%s 诗歌生成成功 (%.2fs)", job.job_id, job.age)
+        self.logger.info("图像描述: %s", result.caption)
+        self.logger.info("生成的诗歌:\n%s", result.poem)
+        return job
+
+    def _collect_burst(self, first: PoemJob) -> list[PoemJob]:
+        """
+        收集与 first 同属一次突发的任务：AI 队列中已有的，以及已按下但仍在拍照的
+        （只等待已经发生的按键，单次按键不增加延迟）
+
+        Returns:
+            按按键顺序排列的任务，至少包含 first
+        """
+        jobs = [first]
+        while len(jobs) < config.burst_max_size:
+            head = self.ai_stage.peek()
+            if head is None:
+                if not self.capture_stage.pending():
+                    break
+                time.sleep(0.02)
+                continue
+            if head is _STOP or head.pressed_at - first.pressed_at > config.burst_window:
+                break
+            jobs.append(self.ai_stage.queue.get_nowait())
+        return jobs
+
+    def _ai_stage_burst(self, jobs: list[PoemJob]) -> None:
+        """
+        突发AI阶段：描述并发获取，诗歌一次请求批量生成，结果按按键顺序送去打印
+        """
+        self.logger.info("突发模式: 合并 %s 个任务 (#%s - #%s)", len(jobs), jobs[0].job_id, jobs[-1].job_id)
+        started = time.monotonic()
+        budget = new_budget()
+
+        pending: list[PoemJob] = []
+        deferred: set[int] = set()
+        for job in jobs:
+            if self.speculator is not None:
+                job.result = self.speculator.take(job.image, budget=budget)
+                if job.result:
+                    continue
+            if self.offline_queue is not None and not self.offline_queue.online and self._defer(job):
+                deferred.add(job.job_id)
+                continue
+            pending.append(job)
+
+        if pending:
+            results = self.ai_service.process_burst(
+                [job.image for job in pending],
+                [job.trace_id for job in pending],
+                budget=budget
+            )
+            for job, result in zip(pending, results):
+                job.result = result
+
+        succeeded, failed = [], []
+        for job in jobs:
+            if job.job_id in deferred:
+                continue
+            if not job.result:
+                self.logger.error("❌ 任务 #%s 诗歌生成失败", job.job_id)
+                failed.append(job)
+                continue
+            succeeded.append(job)
+            self.logger.info("✓ 任务 #%s 诗歌生成成功 (%.2fs)", job.job_id, job.age)
+            self.logger.info("图像描述: %s", job.result.caption)
+            self.logger.info("生成的诗歌:\n%s", job.result.poem)
+
+        # 先记录AI耗时，再交给打印阶段（打印队列的背压不计入AI延迟）
+        elapsed = time.monotonic() - started
+        tracer.record("ai.burst", elapsed, ok=bool(succeeded), size=len(jobs))
+        self.logger.info("突发模式: %s/%s 首完成 (%.2fs)", len(succeeded), len(jobs), elapsed)
+        for job in succeeded:
+            self.print_stage.put(job)
+
+        # 整批只探测一次网络，不可达时失败的任务全部转入离线队列
+        if failed and self.offline_queue is not None:
+            self.offline_queue.online = self.ai_service.check_connectivity()
+            if not self.offline_queue.online:
+                for job in failed:
+                    self._defer(job)
+
+        # 各任务已按顺序直接交给打印阶段
+        return None
+
+    def _ai_stage_streaming(self, job: PoemJob, budget: Optional[Budget]) -> Optional[PoemJob]:
+        """
+        流式AI阶段：拿到图像描述后立即把任务交给打印阶段，
+        诗歌每生成完整一行就送去打印
+        """
+        caption = self.ai_service.generate_image_caption(job.image, budget=budget)
+        if not caption:
+            self.logger.error("❌ 任务 #%s 无法生成图像描述", job.job_id)
+            # 超出时间预算时直接打印备用诗歌
+            job.result = self.ai_service.fallback_result() if budget is not None and budget.exhausted else None
+            if job.result:
+                return job
+            self._on_ai_failure(job)
+            return None
+
+        self.logger.info("图像描述: %s", caption)
+        job.poem_lines = queue.Queue()
+        job.budget = budget
+        self.print_stage.put(job)
+
+        try:
+            try:
+                poem = self.ai_service.generate_poem_stream(caption, job.poem_lines.put, budget=budget)
+            except Exception as e:
+                self.logger.error(f"任务 #{job.job_id} 流式生成出错: {e}", exc_info=True)
+                poem = None
+            if poem:
+                # 预算用尽时流式生成返回的是备用诗歌
+                job.result = PoemResult(caption=caption, poem=poem, fallback=poem in self.ai_service.FALLBACK_POEMS)
+                self.logger.info("✓ 任务 #%s 诗歌生成成功 (%.2fs)", job.job_id, job.age)
+            else:
+                self.logger.error("❌ 任务 #%s 诗歌生成失败", job.job_id)
+        finally:
+            job.poem_lines.put(None)
+        if job.result is None:
+            # 已打印的半首作废，与非流式模式一样在网络不可达时转入离线队列
+            self._on_ai_failure(job)
+
+        # 任务已直接交给打印阶段
+        return None
+
+    def _print_streaming(self, job: PoemJob):
+        """边接收边打印流式生成的诗歌"""
+        if config.print_photo and job.image is not None:
+            self.printer.print_image(job.image)
+        self.printer.begin_poem()
+        self.logger.info("任务 #%s 头部已打印 (%.2fs)", job.job_id, job.age)
+
+        try:
+            first_line = True
+            while True:
+                # 等待不超过本次按键剩余的时间预算（未设预算时按 HTTP_TIMEOUT）
+                timeout = job.budget.remaining() if job.budget is not None else config.http_timeout
+                try:
+                    line = job.poem_lines.get(timeout=timeout)
+                except queue.Empty:
+                    self.logger.error("任务 #%s 等待诗句超时", job.job_id)
+                    break
+                if line is None:
+                    break
+                if first_line:
+                    self.logger.info("任务 #%s 首行开始打印 (%.2fs)", job.job_id, job.age)
+                    first_line = False
+                self.printer.print_line(line)
+
+            if job.result is None:
+                self.printer.print_line("（诗歌生成中断）")
+        finally:
+            self.printer.end_poem()
+
+    def _print_poem(self, job: PoemJob) -> bool:
+        """
+        打印诗歌；打印机出错且正在后台恢复时保留任务，恢复后重新打印
+
+        Returns:
+            是否打印成功
+        """
+        while not self.printer.print_poem(job.result.poem):
+            if self.warmup is None or not self.warmup.report_failure(PRINTER):
+                return False
+            self.logger.warning("任务 #%s 打印失败，等待打印机恢复后重新打印", job.job_id)
+            if not self._ready(PRINTER, job, hold=True):
+                return False
+        return True
+
+    def _print_stage(self, job: PoemJob) -> Optional[PoemJob]:
+        """打印与归档阶段"""
+        # 打印机故障期间一直保留任务，恢复后按顺序打印
+        if not self._ready(PRINTER, job, hold=True):
+            return None
+        self.logger.info("任务 #%s 开始打印...", job.job_id)
+        if job.reprint:
+            if self._print_poem(job):
+                self.logger.info("✓ 任务 #%s 重新打印完成 (%.2fs)", job.job_id, job.age)
+            else:
+                self.logger.error("❌ 任务 #%s 重新打印失败", job.job_id)
+            return job
+
+        printed = True
+        if not job.print_result:
+            self.logger.info("任务 #%s 延迟过久，只归档不打印", job.job_id)
+        elif job.poem_lines is not None:
+            with tracer.span("printer.print_stream"):
+                self._print_streaming(job)
+            if job.result is None:
+                tracer.record("press.total", job.age, ok=False)
+                return None
+        else:
+            if config.print_photo and job.image is not None:
+                self.printer.print_image(job.image)
+            printed = self._print_poem(job)
+            if not printed:
+                self.logger.error("❌ 任务 #%s 打印失败，诗歌仍会归档", job.job_id)
+
+        self.last_result = job.result
+        archived = None
+        if job.result.fallback:
+            # 备用诗歌不是为这张照片写的，不进入归档
+            self.logger.info("任务 #%s 打印的是备用诗歌，不归档", job.job_id)
+        else:
+            archived = self.archive.save(
+                poem=job.result.poem,
+                caption=job.result.caption,
+                image_path=job.image_path
+            )
+        if archived:
+            self.logger.info(
+                "记录已提交归档 -> poem: %s, image: %s",
+                archived.label,
+                archived.image_path.name if archived.image_path else "-"
+            )
+
+        # 从按下按钮到打印完成（只统计经过拍照阶段的任务，离线回放的不计入）
+        if job.print_result and job.image is not None:
+            tracer.record("press.total", job.age, ok=printed)
+        self.logger.info("✓ 任务 #%s 流程完成 (%.2fs, trace %s)", job.job_id, job.age, job.trace_id)
+        self.logger.info("=" * 50)
+        return job
@@ -2,31 +2,212 @@
 热敏打印机控制模块
 支持通用热敏打印机（ESC/POS 协议）
 """
+import contextlib
 import logging
 import serial
+import threading
 import time
-from typing import Optional
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
 from .config import config
+from .imaging import RasterImage, rasterize_image, rasterize_text
+from .tracing import tracer
 from .utils import wrap_text, format_header, format_footer
 
 
+# ESC/POS 命令前缀
+ESC = b'\x1b'
+GS = b'\x1d'
+DLE = b'\x10'
+EOT = b'\x04'
+
+# 流控方式
+FLOW_NONE = 'none'        # 按波特率估算节流
+FLOW_RTSCTS = 'rtscts'    # 打印机 DTR/BUSY 接树莓派 CTS
+FLOW_DSRDTR = 'dsrdtr'
+FLOW_STATUS = 'status'    # GS r / DLE EOT 状态查询
+
+# 对齐方式 -> ESC a n 参数
+ALIGN_COMMANDS = {
+    'left': b'\x00',
+    'center': b'\x01',
+    'right': b'\x02'
+}
+
+
+def encode_line(line: str) -> bytes:
+    """编码为 GB18030（支持中文），失败时退回 UTF-8"""
+    try:
+        return line.encode('gb18030')
+    except UnicodeEncodeError:
+        return line.encode('utf-8', errors='replace')
+
+
+class PrinterError(Exception):
+    """打印机处于无法继续打印的状态（缺纸、开盖、故障）"""
+
+
+@dataclass
+class PrinterStatus:
+    """DLE EOT 实时状态"""
+    paper_out: bool = False
+    paper_near_end: bool = False
+    cover_open: bool = False
+    # 可自动恢复的错误，多数热敏打印机为打印头过热
+    overheated: bool = False
+    # 切刀错误或不可恢复错误
+    error: bool = False
+
+    @classmethod
+    def parse(cls, offline: int, errors: int, paper: int) -> 'PrinterStatus':
+        """
+        解析 DLE EOT 2/3/4 的回应字节
+
+        Args:
+            offline: DLE EOT 2（离线原因）
+            errors: DLE EOT 3（错误原因）
+            paper: DLE EOT 4（纸张传感器）
+        """
+        return cls(
+            paper_out=bool(paper & 0x60 or offline & 0x20),
+            paper_near_end=bool(paper & 0x0C),
+            cover_open=bool(offline & 0x04),
+            overheated=bool(errors & 0x40),
+            error=bool(errors & 0x28)
+        )
+
+    @property
+    def fatal(self) -> bool:
+        """是否需要人工处理"""
+        return self.paper_out or self.cover_open or self.error
+
+    def describe(self) -> str:
+        """日志描述"""
+        flags = [
+            name for name, value in (
+                ("缺纸", self.paper_out),
+                ("纸将用尽", self.paper_near_end),
+                ("开盖", self.cover_open),
+                ("过热", self.overheated),
+                ("故障", self.error),
+            ) if value
+        ]
+        return "、".join(flags) or "正常"
+
+
+class PrintJob:
+    """
+    预编译的打印任务
+    
+    把对齐、字号、文本、走纸和切纸命令依次编码进同一个缓冲区，
+    由 ThermalPrinter.send 一次性发送，代替逐条命令的写入、刷新和等待
+    """
+    
+    def __init__(self):
+        self.buffer = bytearray()
+    
+    def raw(self, data: Union[bytes, bytearray]) -> 'PrintJob':
+        """追加原始命令字节"""
+        self.buffer += data
+        return self
+    
+    def align(self, align: str = 'left') -> 'PrintJob':
+        """ESC a n - 设置对齐方式"""
+        return self.raw(ESC + b'a' + ALIGN_COMMANDS.get(align, b'\x00'))
+    
+    def font_size(self, font_size: int = 1) -> 'PrintJob':
+        """GS ! n - 设置字符大小 (1-8)"""
+        size = min(max(font_size - 1, 0), 7)
+        return self.raw(GS + b'!' + bytes([size | (size << 4)]))
+    
+    def line(self, line: str) -> 'PrintJob':
+        """追加一行文本（已按打印宽度换好）"""
+        return self.raw(encode_line(line) + b'\n')
+    
+    def text(self, text: str, font_size: int = 1, align: str = 'left') -> 'PrintJob':
+        """
+        追加一段文本，输出与 ThermalPrinter.print_text 一致
+        
+        Args:
+            text: 要打印的文本
+            font_size: 字体大小 (1-3)
+            align: 对齐方式 ('left', 'center', 'right')
+        """
+        self.align(align).font_size(font_size)
+        if not text:
+            return self
+        for line in text.split('\n'):
+            self.line(line)
+        # 走纸1行留空隙
+        return self.feed(1)
+    
+    def feed(self, lines: int = 1) -> 'PrintJob':
+        """ESC d n - 走纸 n 行"""
+        return self.raw(ESC + b'd' + bytes([lines]))
+    
+    def raster(self, raster: RasterImage, band_height: int = 128) -> 'PrintJob':
+        """
+        GS v 0 - 打印光栅图像
+        
+        按 band_height 行分段发送，避免单条命令超出打印机缓冲
+        
+        Args:
+            raster: 打包后的光栅图像
+            band_height: 每条 GS v 0 命令包含的行数
+        """
+        row_bytes = raster.width_bytes
+        for top in range(0, raster.height, band_height):
+            rows = min(band_height, raster.height - top)
+            self.raw(
+                GS + b'v0\x00'
+                + bytes([row_bytes & 0xFF, row_bytes >> 8, rows & 0xFF, rows >> 8])
+            )
+            self.raw(raster.data[top * row_bytes:(top + rows) * row_bytes])
+        return self
+    
+    def cut(self) -> 'PrintJob':
+        """走纸后全切（GS V m，打印机不支持时会被忽略）"""
+        return self.feed(5).raw(GS + b'V' + bytes([66, 0]))
+    
+    def to_bytes(self) -> bytes:
+        """编译后的完整字节流"""
+        return bytes(self.buffer)
+    
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+
 class ThermalPrinter:
     """热敏打印机控制类"""
     
     # ESC/POS 命令
-    ESC = b'\x1b'
-    GS = b'\x1d'
+    ESC = ESC
+    GS = GS
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.serial: Optional[serial.Serial] = None
         self.initialized = False
+        self.flow_control = config.printer_flow_control
+        # 实时状态查询期间收到的 GS r 回应数
+        self._acks = 0
+        # 串口读写互斥（健康检查与打印在不同线程中进行）
+        self._lock = threading.RLock()
+        # 持有 _lock 期间最近一次写入进展的时刻（未持有时为None），用于判断写入是否卡住
+        self._progress_at: Optional[float] = None
     
     def initialize(self) -> bool:
         """初始化打印机"""
         try:
+            # 重新初始化时恢复配置的流控方式（上次可能因无回应退回 none）
+            self.flow_control = config.printer_flow_control
             self.logger.info("尝试连接串口: %s", config.serial_port)
-            self.logger.info("波特率: %s", config.printer_baud)
+            self.logger.info("波特率: %s, 流控: %s", config.printer_baud, self.flow_control)
+            
+            if not self._wait_for_port(config.serial_wait_timeout):
+                self.logger.error("串口 %s 不存在 (已等待 %.0fs)", config.serial_port, config.serial_wait_timeout)
+                return False
             
             self.serial = serial.Serial(
                 port=config.serial_port,
@@ -35,28 +216,37 @@ class ThermalPrinter:
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_ONE,
                 timeout=3,
+                # 硬件握手被一直拉住（断开、缺纸）时 write 不会永久阻塞
+                write_timeout=config.printer_write_timeout,
                 xonxoff=False,
-                rtscts=False,
-                dsrdtr=False
+                rtscts=self.flow_control == FLOW_RTSCTS,
+                dsrdtr=self.flow_control == FLOW_DSRDTR
             )
             
-            time.sleep(0.5)  # 等待串口稳定
-            
             self.logger.debug("发送初始化命令")
             
             # 清空缓冲区
             self.serial.reset_input_buffer()
             self.serial.reset_output_buffer()
             
+            # 状态查询模式下以打印机是否回应判断串口就绪，代替固定等待
+            if self.flow_control == FLOW_STATUS:
+                status = self.query_status()
+                if status is None:
+                    self.logger.warning("打印机无状态回应，改为按波特率节流")
+                    self.flow_control = FLOW_NONE
+                else:
+                    self.logger.info("打印机状态: %s", status.describe())
+            
             # ESC @ - 初始化打印机
             self._write(self.ESC + b'@')
-            time.sleep(0.1)
+            self._drain(0.1)
             
             # 设置打印密度和加热时间（可选，根据打印机调整）
             # ESC 7 n1 n2 n3
             self._write(self.ESC + b'\x37')
             self._write(bytes([11, 200, 50]))  # 加热时间、加热间隔、加热密度
-            time.sleep(0.1)
+            self._drain(0.1)
             
             # 设置字符间距
             self._write(self.ESC + b'\x20' + bytes([0]))
@@ -76,13 +266,246 @@ class ThermalPrinter:
             self.logger.exception("打印机初始化失败: %s", e)
             return False
     
+    def _wait_for_port(self, timeout: float) -> bool:
+        """
+        等待串口设备出现（开机时 /dev/serial0 可能晚于程序创建）
+        
+        Returns:
+            设备是否存在（非 /dev 下的端口名直接返回True）
+        """
+        port = Path(config.serial_port)
+        if not config.serial_port.startswith('/dev/'):
+            return True
+        
+        deadline = time.monotonic() + timeout
+        while not port.exists():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+    
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """
+        持有串口锁进行读写，并记录写入进展
+        
+        Raises:
+            PrinterError: 写入超时（打印机断开或缺纸时硬件握手一直不放行）
+        """
+        with self._lock:
+            outer = self._progress_at is None
+            if outer:
+                self._progress_at = time.monotonic()
+            try:
+                yield
+            except serial.SerialTimeoutException as e:
+                raise PrinterError(f"串口写入超时 ({config.printer_write_timeout:.0f}s)，打印机可能已断开或缺纸") from e
+            finally:
+                if outer:
+                    self._progress_at = None
+    
+    def _flush(self):
+        """
+        等待输出缓冲区发送完毕
+        
+        硬件握手模式下 serial.flush()（tcdrain）在打印机一直不放行时会永久阻塞，
+        改为轮询输出缓冲区，最多等待 PRINTER_WRITE_TIMEOUT
+        """
+        if self.flow_control not in (FLOW_RTSCTS, FLOW_DSRDTR):
+            self.serial.flush()
+            return
+        deadline = time.monotonic() + config.printer_write_timeout
+        while self.serial.out_waiting:
+            if time.monotonic() >= deadline:
+                raise serial.SerialTimeoutException("输出缓冲区发送超时")
+            time.sleep(0.01)
+    
     def _write(self, data: bytes):
         """写入数据到串口"""
         if self.serial and self.serial.is_open:
-            self.serial.write(data)
-            self.serial.flush()
-            # 添加小延迟确保数据发送完成
-            time.sleep(0.01)
+            with self._exclusive():
+                self.serial.write(data)
+                self._flush()
+    
+    def send(self, job: PrintJob):
+        """
+        一次性发送预编译的打印任务
+        
+        按打印机缓冲区大小分块写入：
+        - rtscts/dsrdtr：由硬件握手阻塞写入，打印机缓冲能接收多快就写多快
+        - status：每块末尾附加 GS r，打印机处理到该命令才回应，收到回应再写下一块
+        - none：每块按波特率估算的发送时间节流
+        
+        Args:
+            job: 打印任务
+            
+        Raises:
+            PrinterError: 状态查询模式下检测到缺纸、开盖或故障，或写入超时
+        """
+        if not self.serial or not self.serial.is_open:
+            return
+        
+        with self._exclusive():
+            self._send(job.to_bytes())
+    
+    def _send(self, data: bytes):
+        """按流控方式分块写入（调用方持有 _lock）"""
+        chunk_size = max(config.printer_buffer_size, 1)
+        # 每字节 10 位（起始位 + 8 数据位 + 停止位）
+        byte_time = 10 / config.printer_baud
+        started = time.monotonic()
+        
+        for offset in range(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            self._progress_at = time.monotonic()
+            if self.flow_control == FLOW_STATUS:
+                self.serial.write(chunk)
+                self._wait_processed()
+                continue
+            
+            chunk_started = time.monotonic()
+            self.serial.write(chunk)
+            if self.flow_control == FLOW_NONE:
+                remaining = len(chunk) * byte_time - (time.monotonic() - chunk_started)
+                if remaining > 0:
+                    time.sleep(remaining)
+        
+        self._flush()
+        self.logger.debug(
+            "打印任务已发送: %s 字节, %.2fs", len(data), time.monotonic() - started
+        )
+    
+    def _drain(self, fallback: float):
+        """
+        等待打印机处理完已发送的数据
+        
+        Args:
+            fallback: 无法得知打印机进度时（none 流控）的等待时间（秒）
+        """
+        if not self.serial or not self.serial.is_open:
+            return
+        
+        with self._exclusive():
+            self._flush()
+            if self.flow_control == FLOW_STATUS:
+                self._wait_processed()
+            elif self.flow_control == FLOW_NONE:
+                time.sleep(fallback)
+    
+    def _wait_processed(self):
+        """
+        发送 GS r 1 并等待回应（打印机按顺序处理，回应即表示之前的数据已处理完）
+        
+        等待期间每隔 PRINTER_STATUS_INTERVAL 用 DLE EOT 查询实时状态，
+        过热时继续等待，缺纸、开盖或故障时抛出 PrinterError
+        
+        Raises:
+            PrinterError: 打印机无法继续打印或等待超时
+        """
+        self._acks = 0
+        self.serial.write(GS + b'r\x01')
+        deadline = time.monotonic() + config.printer_status_timeout
+        
+        while time.monotonic() < deadline:
+            reply = self._read_byte(config.printer_status_interval, stop_on_ack=True)
+            if reply is None and self._acks == 0:
+                status = self.query_status()
+                if status is not None:
+                    if status.fatal:
+                        raise PrinterError(f"打印机状态异常: {status.describe()}")
+                    if status.overheated:
+                        self.logger.warning("打印头过热，等待冷却...")
+            if self._acks:
+                return
+        
+        raise PrinterError("等待打印机处理超时")
+    
+    def _read_byte(self, timeout: float, stop_on_ack: bool = False) -> Optional[int]:
+        """
+        读取一个实时状态回应字节
+        
+        DLE EOT 回应的第 4 位固定为 1，GS r 回应固定为 0，
+        读到的 GS r 回应计入 _acks
+        
+        Args:
+            timeout: 等待时间（秒）
+            stop_on_ack: 收到 GS r 回应时立即返回None，否则继续等待
+        
+        Returns:
+            实时状态字节，超时返回None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.serial.timeout = remaining
+            data = self.serial.read(1)
+            if not data:
+                return None
+            if data[0] & 0x10:
+                return data[0]
+            self._acks += 1
+            if stop_on_ack:
+                return None
+    
+    def query_status(self, timeout: float = 0.5) -> Optional[PrinterStatus]:
+        """
+        通过 DLE EOT 查询打印机实时状态（打印机忙时也会立即回应）
+        
+        Args:
+            timeout: 每条查询的等待时间（秒）
+            
+        Returns:
+            打印机状态，打印机无回应时返回None
+        """
+        if not self.serial or not self.serial.is_open:
+            return None
+        
+        replies = []
+        with self._exclusive():
+            for n in (2, 3, 4):
+                self.serial.write(DLE + EOT + bytes([n]))
+                reply = self._read_byte(timeout)
+                if reply is None:
+                    return None
+                replies.append(reply)
+        return PrinterStatus.parse(*replies)
+    
+    def check_health(self) -> bool:
+        """
+        健康检查：串口设备仍在且已打开；状态查询模式下打印机须有回应且可以打印
+        
+        正在打印时不插入查询，视为正常（打印出错由调用方另行报告）；
+        但写入长时间没有进展（超过 PRINTER_WRITE_TIMEOUT 与 PRINTER_STATUS_TIMEOUT 之和）时视为卡住
+        
+        Returns:
+            打印机是否可用
+        """
+        if not self.initialized or not self.serial or not self.serial.is_open:
+            return False
+        if config.serial_port.startswith('/dev/') and not Path(config.serial_port).exists():
+            return False
+        if not self._lock.acquire(blocking=False):
+            progress_at = self._progress_at
+            stall = config.printer_write_timeout + config.printer_status_timeout
+            if progress_at is not None and time.monotonic() - progress_at > stall:
+                self.logger.warning("打印机写入已 %.0fs 没有进展", time.monotonic() - progress_at)
+                return False
+            return True
+        try:
+            if self.flow_control != FLOW_STATUS:
+                return True
+            status = self.query_status()
+        finally:
+            self._lock.release()
+        if status is None:
+            self.logger.warning("打印机无状态回应")
+            return False
+        if status.fatal:
+            self.logger.warning("打印机状态异常: %s", status.describe())
+            return False
+        return True
     
     def print_text(self, text: str, font_size: int = 1, align: str = 'left'):
         """
@@ -99,46 +522,7 @@ class ThermalPrinter:
         
         try:
             self.logger.debug("准备打印文本，长度 %s", len(text))
-            
-            # 设置对齐方式
-            align_commands = {
-                'left': b'\x00',
-                'center': b'\x01',
-                'right': b'\x02'
-            }
-            self._write(self.ESC + b'a' + align_commands.get(align, b'\x00'))
-            
-            # 设置字体大小
-            if font_size > 1:
-                # GS ! n - 设置字符大小
-                size = min(font_size - 1, 7)  # 0-7
-                width = size & 0x0F
-                height = (size & 0x0F) << 4
-                self._write(self.GS + b'!' + bytes([width | height]))
-            else:
-                self._write(self.GS + b'!' + bytes([0]))
-            
-            # 打印文本（按行发送）
-            if not text:
-                return
-
-            lines = text.split('\n')
-            for i, line in enumerate(lines):
-                self.logger.debug("发送第 %s/%s 行", i + 1, len(lines))
-                # 编码为 GB18030（支持中文）或 UTF-8
-                try:
-                    encoded = line.encode('gb18030')
-                except:
-                    encoded = line.encode('utf-8', errors='replace')
-                
-                self._write(encoded)
-                self._write(b'\n')  # 换行
-                time.sleep(0.05)  # 给打印机处理时间
-            
-            # 走纸1行留空隙
-            self.logger.debug("发送走纸命令")
-            self.feed(1)
-            
+            self.send(PrintJob().text(text, font_size=font_size, align=align))
             self.logger.debug("文本发送完成")
             
         except Exception as e:
@@ -149,9 +533,8 @@ class ThermalPrinter:
         if not self.initialized or not self.serial:
             return
         
-        # ESC d n - 走纸 n 行
-        self._write(self.ESC + b'd' + bytes([lines]))
-        time.sleep(0.1 * lines)  # 等待走纸完成
+        self.send(PrintJob().feed(lines))
+        self._drain(0.1 * lines)  # 等待走纸完成
     
     def cut_paper(self):
         """切纸（如果打印机支持）"""
@@ -159,11 +542,8 @@ class ThermalPrinter:
             return
         
         try:
-            # 走一些纸再切
-            self.feed(5)
-            # GS V m - 切纸命令
-            self._write(self.GS + b'V' + bytes([66, 0]))  # 全切
-            time.sleep(0.5)
+            self.send(PrintJob().cut())
+            self._drain(0.5)
         except Exception:
             self.logger.exception("切纸失败（打印机可能不支持）")
 
@@ -232,27 +612,105 @@ class ThermalPrinter:
         
         self.logger.info("测试页打印完成")
     
-    def print_poem(self, poem: str):
-        """打印诗歌（带头部和脚注）"""
+    def begin_poem(self):
+        """开始打印一首诗：先打印头部，随后可逐行调用 print_line"""
         if not self.initialized:
             self.logger.error("打印机未初始化")
             return
+        
+        self.logger.info("开始打印诗歌")
+        self.send(PrintJob().text(format_header()).align('left').font_size(1))
+    
+    def print_line(self, line: str):
+        """
+        打印单行（用于流式打印，不附加额外走纸）
+        
+        Args:
+            line: 已按打印宽度换好的一行文本
+        """
+        if not self.initialized or not self.serial:
+            return
+        
+        try:
+            if config.printer_mode == 'raster':
+                self.send(PrintJob().raster(rasterize_text(line)))
+            else:
+                self.send(PrintJob().line(line))
+        except Exception as e:
+            self.logger.exception("打印行失败: %s", e)
+    
+    def end_poem(self):
+        """结束一首诗：打印脚注并走纸"""
+        if not self.initialized:
+            return
+        
+        self.send(PrintJob().feed(1).text(format_footer()).feed(2))
+        self.logger.info("诗歌打印完成")
+    
+    @staticmethod
+    def compile_poem(poem: str) -> PrintJob:
+        """
+        把头部、换行后的诗歌、脚注和走纸编译为一个打印任务
+        
+        光栅模式下诗歌正文用自定义字体渲染为位图（按内容缓存），
+        头部和脚注仍使用打印机内置字体
+        
+        Args:
+            poem: 诗歌文本
+            
+        Returns:
+            打印任务
+        """
+        job = PrintJob().text(format_header())
+        if config.printer_mode == 'raster':
+            job.align('left').raster(rasterize_text(wrap_text(poem))).feed(1)
+        else:
+            job.text(wrap_text(poem))
+        return job.text(format_footer()).feed(2)
+    
+    def print_image(self, image):
+        """
+        以光栅位图打印照片
+        
+        Args:
+            image: 文件路径、JPEG字节、RGB数组或 PIL 图像
+        """
+        if not self.initialized or not self.serial:
+            self.logger.error("打印机未初始化")
+            return
+        
+        try:
+            started = time.monotonic()
+            raster = rasterize_image(image)
+            self.logger.info(
+                "照片光栅化完成: %sx%s (%.0f ms)",
+                raster.width, raster.height, (time.monotonic() - started) * 1000
+            )
+            self.send(PrintJob().align('center').raster(raster).align('left').feed(1))
+        except Exception as e:
+            self.logger.exception("打印照片失败: %s", e)
+    
+    @tracer.traced("printer.print")
+    def print_poem(self, poem: str) -> bool:
+        """
+        打印诗歌（带头部和脚注）
+        
+        Returns:
+            是否打印成功（未初始化或串口出错时返回False）
+        """
+        if not self.initialized or not self.serial or not self.serial.is_open:
+            self.logger.error("打印机未初始化")
+            return False
 
         try:
             self.logger.info("开始打印诗歌")
-            header = format_header()
-            self.print_text(header, align='left')
-
-            wrapped_poem = wrap_text(poem)
-            self.print_text(wrapped_poem, align='left')
-
-            footer = format_footer()
-            self.print_text(footer, align='left')
-
-            self.feed(2)
-            self.logger.info("诗歌打印完成")
+            job = self.compile_poem(poem)
+            self.send(job)
+            self.logger.info("诗歌打印完成 (%s 字节)", len(job))
+            return True
         except Exception as exc:
             self.logger.exception("打印诗歌失败: %s", exc)
+            return False
 
     def close(self):
         """关闭打印机连接"""
@@ -0,0 +1,153 @@
+"""
+AI调用的时间预算、超时与重试策略
+
+- 每次按键的AI处理共用一个时间预算（AI_DEADLINE），图像描述至少可用其中的 AI_CAPTION_SHARE，
+  其余按诗歌生成的近期 p95 预留
+- 单次请求的超时由该提供方/后端近期延迟的 p99 推算（样本不足时为 HTTP_TIMEOUT），且不超过剩余预算
+- 重试同一提供方前按带随机抖动的指数退避等待，剩余预算放不下“退避 + 一次预期耗时”时放弃
+- 预算与追踪 ID 一样随上下文带入协程，下层调用无需逐级传参
+"""
+import contextlib
+import contextvars
+import random
+import time
+from typing import Any, Coroutine, Iterator, Optional, Sequence, TypeVar
+
+from .config import config
+
+
+T = TypeVar("T")
+
+# 样本少于该数量时不计算分位数
+MIN_SAMPLES = 5
+
+
+class BudgetExhausted(TimeoutError):
+    """剩余时间预算放不下下一次尝试"""
+
+
+class Budget:
+    """一次按键的AI时间预算"""
+
+    def __init__(self, seconds: float, parent: Optional["Budget"] = None) -> None:
+        self.expires_at = time.monotonic() + seconds
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+        # 是否有调用因预算不足而放弃
+        self.gave_up = False
+
+    def remaining(self) -> float:
+        """剩余秒数"""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def exhausted(self) -> bool:
+        """预算是否已用尽（据此决定是否改用备用诗歌）"""
+        return self.gave_up or self.remaining() <= 0
+
+    def fits(self, expected: Optional[float], wait: float = 0.0) -> bool:
+        """剩余预算能否放下等待 wait 秒后再进行一次预期耗时 expected 的尝试"""
+        remaining = self.remaining()
+        return remaining > 0 and remaining > wait + (expected or 0.0)
+
+    def give_up(self):
+        """标记因预算不足而放弃"""
+        self.gave_up = True
+
+
+_current_budget: contextvars.ContextVar[Optional[Budget]] = contextvars.ContextVar("ai_budget", default=None)
+
+
+def new_budget() -> Optional[Budget]:
+    """按 AI_DEADLINE 创建一次按键的预算（为 0 时不限时，返回None）"""
+    return Budget(config.ai_deadline) if config.ai_deadline > 0 else None
+
+
+def current_budget() -> Optional[Budget]:
+    """当前上下文的预算"""
+    return _current_budget.get()
+
+
+def budget_exhausted() -> bool:
+    """当前上下文的预算是否已用尽（没有预算时为False）"""
+    budget = _current_budget.get()
+    return budget is not None and budget.exhausted
+
+
+def bind_budget(coro: Coroutine[Any, Any, T], budget: Optional[Budget]) -> Coroutine[Any, Any, T]:
+    """把预算带入要在AI事件循环中执行的协程"""
+    if budget is None:
+        return coro
+
+    async def bound():
+        # 事件循环为每个任务复制上下文，这里的设置不会影响其他任务
+        _current_budget.set(budget)
+        return await coro
+
+    return bound()
+
+
+@contextlib.contextmanager
+def budget_slice(seconds: Optional[float]) -> Iterator[Optional[Budget]]:
+    """
+    在当前预算中划出最多 seconds 秒给一个环节（没有预算或 seconds 为None时不限制）
+
+    环节内因预算不足而放弃时，整体预算同样视为用尽
+    """
+    parent = _current_budget.get()
+    if parent is None or seconds is None:
+        yield parent
+        return
+
+    child = Budget(seconds, parent)
+    token = _current_budget.set(child)
+    try:
+        yield child
+    finally:
+        _current_budget.reset(token)
+        if child.exhausted:
+            parent.give_up()
+
+
+def percentile(samples: Sequence[float], q: float) -> Optional[float]:
+    """样本的分位数，样本不足时返回None"""
+    if len(samples) < MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def attempt_timeout(p99: Optional[float]) -> float:
+    """
+    一次请求的超时
+
+    近期延迟 p99 的 AI_TIMEOUT_FACTOR 倍，限制在 AI_TIMEOUT_MIN 与 HTTP_TIMEOUT 之间
+    （样本不足时为 HTTP_TIMEOUT），且不超过当前预算的剩余时间
+    """
+    if p99 is None:
+        timeout = config.http_timeout
+    else:
+        timeout = min(max(p99 * config.ai_timeout_factor, config.ai_timeout_min), config.http_timeout)
+    budget = _current_budget.get()
+    return timeout if budget is None else min(timeout, budget.remaining())
+
+
+def backoff(retry: int) -> float:
+    """第 retry 次重试前的等待：上限从 AI_RETRY_BACKOFF 起每次翻倍，在上限的一半到上限之间随机"""
+    cap = min(config.ai_retry_backoff * 2 ** (retry - 1), config.ai_retry_backoff_max)
+    return random.uniform(cap / 2, cap)
+
+
+def can_retry(expected: Optional[float], wait: float) -> bool:
+    """
+    剩余预算能否放下退避等待和一次预期耗时的尝试，不能时标记预算已用尽
+
+    Args:
+        expected: 该提供方/后端的预期耗时（未知时为None）
+        wait: 退避等待秒数
+    """
+    budget = _current_budget.get()
+    if budget is None or budget.fits(expected, wait):
+        return True
+    budget.give_up()
+    return False
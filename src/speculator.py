@@ -0,0 +1,222 @@
+"""
+空闲时预生成模块
+
+设备空闲时定期取当前场景的 lores 帧，场景连续若干次采样都不变（感知哈希距离在阈值内）时
+在后台预先生成描述和诗歌；按下按钮时拍到的照片与预生成的场景一致则直接打印，无需等待AI。
+场景变化或结果过期时丢弃预生成结果，预生成次数受每小时/每天预算限制
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from .ai_service import AIService, ImageInput, PoemResult
+from .cache import dhash, hamming
+from .camera import Camera
+from .config import config
+from .resilience import Budget, current_budget
+
+
+@dataclass
+class Speculation:
+    """一次预生成（进行中或已完成）"""
+    image_hash: int
+    future: "Future[Optional[PoemResult]]"
+    started_at: float
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+@dataclass
+class SpeculatorStats:
+    """预生成统计"""
+    generated: int = 0
+    hits: int = 0
+    # 场景变化或过期后被丢弃的预生成结果
+    wasted: int = 0
+
+    def describe(self) -> str:
+        return f"预生成 {self.generated} 次, 命中 {self.hits}, 作废 {self.wasted}"
+
+
+class Speculator:
+    """空闲时按场景预生成诗歌"""
+
+    def __init__(self, camera: Camera, ai_service: AIService) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.camera = camera
+        self.ai_service = ai_service
+        self.stats = SpeculatorStats()
+
+        self._lock = threading.Lock()
+        # 最近一次采样的场景哈希和连续不变的次数
+        self._scene_hash: Optional[int] = None
+        self._stable_samples = 0
+        self._current: Optional[Speculation] = None
+        # 最近 24 小时内预生成的时间戳（预算）
+        self._spent: "collections.deque[float]" = collections.deque()
+        self._budget_logged = False
+        # 相机没有 lores 流时预生成不可用（只提示一次）
+        self._unavailable_logged = False
+
+        self._idle: Callable[[], bool] = lambda: True
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, idle: Callable[[], bool]):
+        """
+        启动后台采样线程
+
+        Args:
+            idle: 返回设备当前是否空闲（流水线无任务且网络可用）
+        """
+        self._idle = idle
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="speculator", daemon=True)
+        self._thread.start()
+        self.logger.info(
+            "空闲预生成已启用 (采样间隔 %.0fs, 预算 %s 次/小时, %s 次/天)",
+            config.speculate_interval, config.speculate_hourly_budget, config.speculate_daily_budget
+        )
+
+    def _run(self):
+        while not self._stop.wait(config.speculate_interval):
+            if not self._idle():
+                continue
+            try:
+                self.sample()
+            except Exception as e:
+                self.logger.warning(f"预生成采样失败: {e}")
+
+    def _matches(self, a: int, b: int) -> bool:
+        return hamming(a, b) <= config.speculate_hash_distance
+
+    def _discard(self, reason: str):
+        """作废当前预生成结果（调用方持有锁）"""
+        if self._current is None:
+            return
+        self._current.future.cancel()
+        self.stats.wasted += 1
+        self.logger.info("预生成结果已作废: %s", reason)
+        self._current = None
+
+    def _within_budget(self) -> bool:
+        """检查并占用一次预生成预算（调用方持有锁）"""
+        now = time.monotonic()
+        while self._spent and now - self._spent[0] > 86400:
+            self._spent.popleft()
+        last_hour = sum(1 for t in self._spent if now - t <= 3600)
+        if last_hour >= config.speculate_hourly_budget or len(self._spent) >= config.speculate_daily_budget:
+            if not self._budget_logged:
+                self.logger.info("预生成预算已用完 (最近 1 小时 %s 次, 24 小时 %s 次)", last_hour, len(self._spent))
+                self._budget_logged = True
+            return False
+        self._budget_logged = False
+        self._spent.append(now)
+        return True
+
+    def sample(self):
+        """采样一次当前场景，场景稳定且预算允许时开始预生成"""
+        data = self.camera.preview_upload()
+        if data is None:
+            if self.camera.initialized and not self.camera.lores_enabled and not self._unavailable_logged:
+                self.logger.warning("相机处于静态拍照模式（没有 lores 流），空闲预生成不可用")
+                self._unavailable_logged = True
+            return
+        image_hash = dhash(data)
+
+        with self._lock:
+            if self._scene_hash is None or not self._matches(image_hash, self._scene_hash):
+                self._scene_hash = image_hash
+                self._stable_samples = 1
+                if self._current is not None and not self._matches(image_hash, self._current.image_hash):
+                    self._discard("场景已变化")
+                return
+            self._stable_samples += 1
+
+            if self._current is not None and self._current.age > config.speculate_max_age:
+                self._discard("已过期")
+            if self._current is not None or self._stable_samples < config.speculate_stable_samples:
+                return
+            if not self._within_budget():
+                return
+            speculation = Speculation(image_hash=image_hash, future=Future(), started_at=time.monotonic())
+            speculation.future.set_running_or_notify_cancel()
+            self._current = speculation
+
+        self.logger.info("场景稳定，开始预生成...")
+        self.stats.generated += 1
+        try:
+            result = self.ai_service.process_image_to_poem(data)
+        except Exception as e:
+            self.logger.warning(f"预生成失败: {e}")
+            result = None
+        speculation.future.set_result(result)
+
+        if result is None:
+            with self._lock:
+                if self._current is speculation:
+                    self._current = None
+        else:
+            self.logger.info("预生成完成 (%.1fs)", speculation.age)
+
+    def take(self, image: ImageInput, budget: Optional[Budget] = None) -> Optional[PoemResult]:
+        """
+        按键拍到的照片与预生成场景一致时取走预生成结果
+
+        预生成仍在进行时等待其完成（已经花掉的时间不必再花一次），
+        最多等到本次按键的时间预算用完（没有预算时为 HTTP_TIMEOUT），超时后返回None改走正常请求
+
+        Args:
+            image: 按键时拍到的照片
+            budget: 本次按键的时间预算，为None时使用当前上下文的预算
+
+        Returns:
+            预生成的结果，不匹配或不可用时返回None
+        """
+        with self._lock:
+            speculation = self._current
+        if speculation is None:
+            return None
+
+        try:
+            if not self._matches(dhash(image), speculation.image_hash):
+                return None
+            if speculation.age > config.speculate_max_age:
+                return None
+            budget = budget or current_budget()
+            timeout = budget.remaining() if budget is not None else config.http_timeout
+            result = speculation.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.logger.info("等待预生成结果超出时间预算 (%.1fs)，改走正常请求", timeout)
+            return None
+        except Exception as e:
+            self.logger.debug("预生成结果不可用: %s", e)
+            return None
+
+        with self._lock:
+            if self._current is not speculation or result is None:
+                return None
+            self._current = None
+            # 同一场景需要重新稳定后才会再次预生成
+            self._stable_samples = 0
+            self.stats.hits += 1
+        self.logger.info("命中预生成结果 (%s)", self.stats.describe())
+        return result
+
+    def stop(self):
+        """停止后台采样线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(config.http_timeout)
+            self._thread = None
+        with self._lock:
+            if self._current is not None and self._current.future.done():
+                self._discard("程序退出")
+        self.logger.info("空闲预生成统计: %s", self.stats.describe())
@@ -0,0 +1,171 @@
+"""
+组件自愈模块
+
+打印机、相机和GPIO各自带健康检查，由后台线程定期检查；出错的组件在后台按指数退避
+（带随机抖动）重新初始化，其余组件保持运行，不再退出进程由 systemd 冷启动全部组件。
+恢复期间流水线中需要该组件的任务保留等待，恢复后继续处理
+"""
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from .config import config
+from .tracing import tracer
+from .warmup import Warmup, WarmupTask
+
+
+@dataclass
+class Component:
+    """受监管组件的初始化、健康检查和复位函数"""
+    init: Callable[[], bool]
+    # 返回组件是否正常，为None时只在初始化失败时重试
+    check: Optional[Callable[[], bool]] = None
+    # 重新初始化前释放旧连接
+    reset: Optional[Callable[[], None]] = None
+    recovering: bool = False
+
+
+class Supervisor(Warmup):
+    """在后台并行初始化组件，并在组件故障时只重新初始化该组件"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.logger = logging.getLogger(__name__)
+        self._components: dict[str, Component] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(
+        self,
+        name: str,
+        init: Callable[[], bool],
+        check: Optional[Callable[[], bool]] = None,
+        reset: Optional[Callable[[], None]] = None
+    ):
+        """
+        在后台线程中初始化组件，失败时按退避重试直到成功
+
+        Args:
+            name: 组件名称
+            init: 初始化函数，返回是否成功
+            check: 健康检查函数，返回组件是否正常
+            reset: 重新初始化前调用的清理函数
+        """
+        self._components[name] = Component(init, check, reset)
+        super().start(name, init)
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._watch, name="supervisor", daemon=True)
+            self._monitor.start()
+
+    def _failed(self, task: WarmupTask):
+        """启动时初始化失败：转入后台重试，不再退出"""
+        self._begin_recovery(task.name, "初始化失败")
+
+    def report_failure(self, name: str) -> bool:
+        """
+        流水线报告组件操作失败：立即做一次健康检查，不通过时开始恢复
+
+        Returns:
+            组件是否正在恢复（调用方可等待就绪后重试）
+        """
+        component = self._components.get(name)
+        if component is None:
+            return False
+        if component.recovering:
+            return True
+        if self._healthy(name, component):
+            return False
+        return self._begin_recovery(name, "操作失败且健康检查未通过")
+
+    def stop(self):
+        """停止健康检查和重试，正在等待恢复的任务随即放弃"""
+        self._stopping.set()
+
+    # ------------------------------------------------------------------
+
+    def _healthy(self, name: str, component: Component) -> bool:
+        if component.check is None:
+            return True
+        try:
+            return bool(component.check())
+        except Exception as e:
+            self.logger.warning("%s健康检查出错: %s", self._tasks[name].label, e)
+            return False
+
+    def _watch(self):
+        """定期检查已就绪组件的健康状态"""
+        while not self._stopping.wait(config.supervisor_interval):
+            for name, component in list(self._components.items()):
+                if component.recovering or not self.ready(name):
+                    continue
+                if not self._healthy(name, component):
+                    self._begin_recovery(name, "健康检查未通过")
+
+    def _begin_recovery(self, name: str, reason: str) -> bool:
+        """
+        把组件标记为不可用并启动恢复线程
+
+        Returns:
+            是否处于恢复中（正在停止时返回False）
+        """
+        task, component = self._tasks[name], self._components[name]
+        with self._lock:
+            if self._stopping.is_set():
+                task.done.set()
+                return False
+            if component.recovering:
+                return True
+            component.recovering = True
+            task.ok = False
+            task.done.clear()
+
+        self.logger.warning("%s%s，开始在后台重新初始化", task.label, reason)
+        threading.Thread(
+            target=self._recover, args=(task, component), name=f"recover-{name}", daemon=True
+        ).start()
+        return True
+
+    def _recover(self, task: WarmupTask, component: Component):
+        """按指数退避重新初始化，直到成功或停止"""
+        started = time.monotonic()
+        delay = config.supervisor_backoff_initial
+        attempts = 0
+        while True:
+            # 退避上限内随机等待，多个组件同时故障时错开重试
+            wait = random.uniform(delay / 2, delay)
+            if attempts:
+                self.logger.info("%s %.1fs 后第 %s 次重试", task.label, wait, attempts + 1)
+            if self._stopping.wait(wait):
+                break
+
+            attempts += 1
+            if component.reset is not None:
+                try:
+                    component.reset()
+                except Exception as e:
+                    self.logger.warning("%s复位出错: %s", task.label, e)
+            try:
+                ok = bool(component.init()) and self._healthy(task.name, component)
+            except Exception as e:
+                self.logger.error(f"{task.label}重新初始化出错: {e}", exc_info=True)
+                ok = False
+
+            if ok:
+                elapsed = time.monotonic() - started
+                tracer.record(f"recover.{task.name}", elapsed, attempts=attempts)
+                with self._lock:
+                    component.recovering = False
+                    task.ok = True
+                    task.done.set()
+                self.logger.info("%s已恢复 (第 %s 次尝试, %.2fs)", task.label, attempts, elapsed)
+                return
+            delay = min(delay * 2, config.supervisor_backoff_max)
+
+        # 停止时释放等待该组件的任务
+        with self._lock:
+            component.recovering = False
+            task.done.set()
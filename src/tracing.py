@@ -0,0 +1,318 @@
+"""
+延迟追踪模块
+
+用单调时钟记录各环节（拍照、图像描述、诗歌生成、打印、归档）的耗时，
+同一次按键的所有环节共享一个追踪 ID。每个环节保留最近的耗时用于计算 p50/p95/p99，
+每条记录追加写入 JSONL 追踪文件，并可通过 HTTP 以 Prometheus 文本格式抓取
+"""
+import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Coroutine, Iterator, Optional, TypeVar
+
+from .config import config
+
+
+T = TypeVar("T")
+
+# 当前线程/协程所属的追踪 ID（流水线各阶段线程和AI事件循环分别绑定）
+_current_trace: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def new_trace_id() -> str:
+    """生成新的追踪 ID"""
+    return uuid.uuid4().hex[:12]
+
+
+def current_trace_id() -> Optional[str]:
+    """当前上下文的追踪 ID"""
+    return _current_trace.get()
+
+
+class SpanStats:
+    """一个环节的滚动耗时样本和累计计数"""
+
+    def __init__(self) -> None:
+        self.samples: "collections.deque[float]" = collections.deque(maxlen=max(config.trace_window, 1))
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def add(self, seconds: float, ok: bool):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        if not ok:
+            self.errors += 1
+
+    def quantiles(self) -> dict[float, float]:
+        """最近样本的分位数"""
+        if not self.samples:
+            return {}
+        ordered = sorted(self.samples)
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+class Tracer:
+    """追踪记录器（全局单例 tracer）"""
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._stats: dict[str, SpanStats] = {}
+        # 额外导出的瞬时值（名称 -> 取值函数），如流水线队列深度
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self._file = None
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # ------------------------------------------------------------------
+    # 记录
+    # ------------------------------------------------------------------
+
+    @contextlib.contextmanager
+    def bind(self, trace_id: Optional[str]) -> Iterator[None]:
+        """在当前线程中绑定追踪 ID"""
+        token = _current_trace.set(trace_id)
+        try:
+            yield
+        finally:
+            _current_trace.reset(token)
+
+    def bind_coro(self, coro: Coroutine[Any, Any, T], trace_id: Optional[str] = None) -> Coroutine[Any, Any, T]:
+        """把追踪 ID（默认为调用方的）带入要在AI事件循环中执行的协程"""
+        trace_id = trace_id if trace_id is not None else current_trace_id()
+        if trace_id is None:
+            return coro
+
+        async def bound():
+            # 事件循环为每个任务复制上下文，这里的设置不会影响其他任务
+            _current_trace.set(trace_id)
+            return await coro
+
+        return bound()
+
+    def record(self, name: str, seconds: float, ok: bool = True, trace_id: Optional[str] = None, **attrs):
+        """
+        记录一个环节的耗时
+
+        Args:
+            name: 环节名称（如 ai.caption）
+            seconds: 耗时
+            ok: 是否成功
+            trace_id: 追踪 ID，默认取当前上下文
+            **attrs: 附加字段（写入追踪文件）
+        """
+        if not config.trace_enabled:
+            return
+        trace_id = trace_id if trace_id is not None else current_trace_id()
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = SpanStats()
+            stats.add(seconds, ok)
+        self._write({
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "trace": trace_id,
+            "span": name,
+            "ms": round(seconds * 1000, 1),
+            "ok": ok,
+            **attrs
+        })
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs) -> Iterator[None]:
+        """以上下文管理器记录一段代码的耗时（抛出异常视为失败）"""
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(name, time.monotonic() - started, ok, **attrs)
+
+    def traced(self, name: str, check_result: bool = True) -> Callable[[Callable[..., T]], Callable[..., T]]:
+        """
+        记录函数耗时的装饰器（支持同步函数和协程函数）
+
+        Args:
+            name: 环节名称
+            check_result: 返回值为 None 或 False 时视为失败（本项目“失败返回None”的约定）；
+                为 False 时只有抛出异常才视为失败
+        """
+        def succeeded(result: Any, finished: bool) -> bool:
+            if not finished:
+                return False
+            return not check_result or (result is not None and result is not False)
+
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    started = time.monotonic()
+                    result, finished = None, False
+                    try:
+                        result = await func(*args, **kwargs)
+                        finished = True
+                        return result
+                    finally:
+                        self.record(name, time.monotonic() - started, succeeded(result, finished))
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.monotonic()
+                result, finished = None, False
+                try:
+                    result = func(*args, **kwargs)
+                    finished = True
+                    return result
+                finally:
+                    self.record(name, time.monotonic() - started, succeeded(result, finished))
+            return wrapper
+        return decorator
+
+    def gauge(self, name: str, getter: Callable[[], float]):
+        """注册一个在抓取时读取的瞬时值"""
+        self._gauges[name] = getter
+
+    # ------------------------------------------------------------------
+    # 追踪文件
+    # ------------------------------------------------------------------
+
+    def _write(self, record: dict):
+        """追加一行到追踪文件（超过上限时轮转为 .1）"""
+        if not config.trace_file:
+            return
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        try:
+            with self._lock:
+                if self._file is None:
+                    config.trace_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._file = open(config.trace_path, "a", encoding="utf-8")
+                self._file.write(line)
+                self._file.flush()
+                if self._file.tell() > config.trace_file_max_mb * 1024 * 1024:
+                    self._file.close()
+                    os.replace(config.trace_path, config.trace_path.with_name(config.trace_path.name + ".1"))
+                    self._file = None
+        except OSError as e:
+            self.logger.debug("写入追踪文件失败: %s", e)
+
+    # ------------------------------------------------------------------
+    # 导出
+    # ------------------------------------------------------------------
+
+    def snapshot(self) -> dict[str, dict]:
+        """各环节的计数、错误数和分位数"""
+        with self._lock:
+            return {
+                name: {
+                    "count": stats.count,
+                    "sum": stats.total,
+                    "errors": stats.errors,
+                    "quantiles": stats.quantiles()
+                }
+                for name, stats in self._stats.items()
+            }
+
+    def describe(self) -> str:
+        """各环节 p50/p95 的单行摘要（用于日志）"""
+        parts = []
+        for name, item in sorted(self.snapshot().items()):
+            q = item["quantiles"]
+            if q:
+                parts.append(f"{name} p50 {q[0.5]:.2f}s / p95 {q[0.95]:.2f}s (n={item['count']})")
+        return ", ".join(parts) or "无数据"
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式的指标"""
+        lines = [
+            "# HELP poetry_camera_span_seconds 各环节耗时（最近样本的分位数）",
+            "# TYPE poetry_camera_span_seconds summary",
+        ]
+        snapshot = self.snapshot()
+        for name, item in sorted(snapshot.items()):
+            for q, value in item["quantiles"].items():
+                lines.append(f'poetry_camera_span_seconds{{span="{name}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'poetry_camera_span_seconds_sum{{span="{name}"}} {item["sum"]:.6f}')
+            lines.append(f'poetry_camera_span_seconds_count{{span="{name}"}} {item["count"]}')
+
+        lines.append("# HELP poetry_camera_span_errors_total 各环节失败次数")
+        lines.append("# TYPE poetry_camera_span_errors_total counter")
+        for name, item in sorted(snapshot.items()):
+            lines.append(f'poetry_camera_span_errors_total{{span="{name}"}} {item["errors"]}')
+
+        for name, getter in sorted(self._gauges.items()):
+            try:
+                value = float(getter())
+            except Exception:
+                continue
+            lines.append(f"# TYPE poetry_camera_{name} gauge")
+            lines.append(f"poetry_camera_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def start_server(self) -> bool:
+        """
+        在后台线程中启动指标 HTTP 服务（METRICS_PORT 为 0 时不启动）
+
+        Returns:
+            是否已启动
+        """
+        if not config.metrics_port or self._server is not None:
+            return False
+
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                tracer.logger.debug("metrics: " + format, *args)
+
+        try:
+            self._server = ThreadingHTTPServer((config.metrics_host, config.metrics_port), Handler)
+        except OSError as e:
+            self.logger.error(f"启动指标服务失败: {e}")
+            return False
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        self.logger.info("指标服务: http://%s:%s/metrics", config.metrics_host, config.metrics_port)
+        return True
+
+    def close(self):
+        """停止指标服务并关闭追踪文件"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if self._stats:
+            self.logger.info("延迟统计: %s", self.describe())
+
+
+# 全局追踪记录器
+tracer = Tracer()
@@ -5,6 +5,19 @@ import textwrap
 from datetime import datetime
 
 
+def char_width(char: str) -> int:
+    """
+    计算字符的打印宽度
+    
+    Args:
+        char: 单个字符
+        
+    Returns:
+        中文等非ASCII字符为2，其余为1
+    """
+    return 2 if ord(char) > 127 else 1
+
+
 def wrap_text(text: str, width: int = 32) -> str:
     """
     按指定宽度换行文本
@@ -30,15 +43,15 @@ def wrap_text(text: str, width: int = 32) -> str:
         current_width = 0
         
         for char in line:
-            char_width = 2 if ord(char) > 127 else 1
+            width_of_char = char_width(char)
             
-            if current_width + char_width > width:
+            if current_width + width_of_char > width:
                 wrapped.append(current_line)
                 current_line = char
-                current_width = char_width
+                current_width = width_of_char
             else:
                 current_line += char
-                current_width += char_width
+                current_width += width_of_char
         
         if current_line:
             wrapped.append(current_line)
@@ -48,6 +61,61 @@ def wrap_text(text: str, width: int = 32) -> str:
     return '\n'.join(wrapped_lines)
 
 
+class LineWrapper:
+    """
+    增量换行器
+    
+    逐段喂入流式文本，按与 wrap_text 相同的宽度规则切出已完成的行
+    """
+    
+    def __init__(self, width: int = 32):
+        self.width = width
+        self._line = ""
+        self._width = 0
+    
+    def feed(self, text: str) -> list[str]:
+        """
+        喂入一段文本
+        
+        Args:
+            text: 新到达的文本片段
+            
+        Returns:
+            本次已完成的行（可能为空列表）
+        """
+        lines = []
+        for char in text:
+            if char == '\n':
+                lines.append(self._line)
+                self._line = ""
+                self._width = 0
+                continue
+            
+            width_of_char = char_width(char)
+            if self._width + width_of_char > self.width:
+                lines.append(self._line)
+                self._line = char
+                self._width = width_of_char
+            else:
+                self._line += char
+                self._width += width_of_char
+        return lines
+    
+    def flush(self) -> list[str]:
+        """
+        取出尚未换行的剩余文本
+        
+        Returns:
+            剩余的最后一行（没有则为空列表）
+        """
+        if not self._line:
+            return []
+        line = self._line
+        self._line = ""
+        self._width = 0
+        return [line]
+
+
 def format_header() -> str:
     """
     生成打印头部（日期和装饰线）
@@ -99,7 +167,7 @@ def center_text(text: str, width: int = 32) -> str:
     
     for line in lines:
         # 计算实际宽度（中文算2个字符）
-        line_width = sum(2 if ord(c) > 127 else 1 for c in line)
+        line_width = sum(char_width(c) for c in line)
         padding = (width - line_width) // 2
         centered_lines.append(' ' * padding + line)
     
@@ -0,0 +1,128 @@
+"""
+后台预热模块
+
+快速启动模式下相机、打印机和AI服务在各自的线程中并行初始化，GPIO 就绪后按钮即可使用；
+预热完成前按下的任务在流水线中排队，各阶段等到所需组件就绪再处理
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .tracing import tracer
+
+
+# 组件名称（流水线各阶段据此等待）
+CAMERA = "camera"
+PRINTER = "printer"
+AI = "ai"
+GPIO = "gpio"
+
+LABELS = {CAMERA: "相机", PRINTER: "打印机", AI: "AI服务", GPIO: "GPIO"}
+
+
+@dataclass
+class WarmupTask:
+    """一个组件的后台初始化"""
+    name: str
+    done: threading.Event = field(default_factory=threading.Event)
+    ok: bool = False
+    elapsed: float = 0.0
+
+    @property
+    def label(self) -> str:
+        return LABELS.get(self.name, self.name)
+
+
+class Warmup:
+    """并行初始化组件并记录各自的就绪状态"""
+
+    def __init__(self, on_failure: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Args:
+            on_failure: 组件初始化失败时的回调（参数为组件名称）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.on_failure = on_failure
+        self._tasks: dict[str, WarmupTask] = {}
+
+    def start(self, name: str, init: Callable[[], bool]):
+        """
+        在后台线程中初始化组件
+
+        Args:
+            name: 组件名称
+            init: 初始化函数，返回是否成功
+        """
+        task = WarmupTask(name)
+        self._tasks[name] = task
+        threading.Thread(target=self._run, args=(task, init), name=f"warmup-{name}", daemon=True).start()
+
+    def _run(self, task: WarmupTask, init: Callable[[], bool]):
+        started = time.monotonic()
+        try:
+            task.ok = bool(init())
+        except Exception as e:
+            self.logger.error(f"{task.label}初始化出错: {e}", exc_info=True)
+            task.ok = False
+        task.elapsed = time.monotonic() - started
+        tracer.record(f"startup.{task.name}", task.elapsed, task.ok)
+
+        if task.ok:
+            task.done.set()
+            self.logger.info("%s预热完成 (%.2fs)", task.label, task.elapsed)
+        else:
+            self.logger.error("%s初始化失败 (%.2fs)", task.label, task.elapsed)
+            self._failed(task)
+
+    def _failed(self, task: WarmupTask):
+        """初始化失败：标记完成并通知回调（子类可改为重试）"""
+        task.done.set()
+        if self.on_failure is not None:
+            self.on_failure(task.name)
+
+    def ready(self, name: str) -> bool:
+        """组件是否已就绪（未交给预热管理的组件视为就绪）"""
+        task = self._tasks.get(name)
+        return task is None or (task.done.is_set() and task.ok)
+
+    def wait(self, name: str, timeout: Optional[float] = None) -> bool:
+        """
+        等待组件初始化完成
+
+        Returns:
+            组件是否可用，初始化失败或超时返回False
+        """
+        task = self._tasks.get(name)
+        if task is None:
+            return True
+        return task.done.wait(timeout) and task.ok
+
+    def report_failure(self, name: str) -> bool:
+        """
+        报告组件在运行中出错
+
+        Returns:
+            组件是否正在恢复（值得等待后重试），不做监管时总是返回False
+        """
+        return False
+
+    def wait_all(self, timeout: Optional[float] = None) -> bool:
+        """等待全部组件初始化完成，返回是否都成功"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ok = True
+        for task in self._tasks.values():
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            ok = task.done.wait(remaining) and task.ok and ok
+        return ok
+
+    def describe(self) -> str:
+        """各组件的预热状态"""
+        parts = []
+        for task in self._tasks.values():
+            if not task.done.is_set():
+                parts.append(f"{task.label} 进行中")
+            else:
+                parts.append(f"{task.label} {task.elapsed:.2f}s {'✓' if task.ok else '✗'}")
+        return ", ".join(parts) or "无"
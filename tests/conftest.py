@@ -0,0 +1,12 @@
+"""
+pytest 配置
+
+tests/ 下的 test_button_simple.py 等是需要真实硬件的手动测试脚本（python tests/xxx.py 运行），
+不参与 pytest 收集
+"""
+collect_ignore = [
+    "test_button_simple.py",
+    "test_camera.py",
+    "test_complete_flow.py",
+    "test_printer.py",
+]
@@ -0,0 +1,104 @@
+"""
+诗歌归档测试：文件归档的崩溃恢复和数据库搜索
+"""
+import json
+from datetime import datetime
+
+import pytest
+
+from src.archive import PoemArchive
+from src.archive_db import PoemDatabase, PoemRecord
+from src.config import config
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "poem_archive_dir", str(tmp_path))
+    monkeypatch.setattr(config, "archive_backend", "files")
+    return tmp_path
+
+
+def _record(poem_file, poem: str) -> str:
+    return json.dumps({
+        "poem_file": str(poem_file),
+        "image": None,
+        "caption": "",
+        "created_at": "2026-01-01T08:00:00",
+        "poem": poem
+    }, ensure_ascii=False) + "\n"
+
+
+def test_recover_truncates_partial_line_and_restores_files(archive_dir):
+    """截掉写了一半的日志行，按日志补回丢失的诗歌文件，清理残留的临时文件"""
+    kept = archive_dir / "poem_1.txt"
+    kept.write_text("已写入", encoding="utf-8")
+    lost = archive_dir / "poem_2.txt"
+    (archive_dir / "poem_3.txt.tmp").write_text("半", encoding="utf-8")
+    good = _record(kept, "已写入") + _record(lost, "春眠不觉晓")
+    index = archive_dir / "poems.jsonl"
+    index.write_bytes(good.encode("utf-8") + b'{"poem_file": "poem_3.txt", "po')
+
+    archive = PoemArchive()
+    archive.close()
+
+    assert index.read_bytes() == good.encode("utf-8")
+    assert lost.read_text(encoding="utf-8") == "春眠不觉晓"
+    assert kept.read_text(encoding="utf-8") == "已写入"
+    assert not (archive_dir / "poem_3.txt.tmp").exists()
+
+
+def test_recover_only_scans_tail(archive_dir):
+    """只检查日志末尾 tail_bytes 字节，之前的记录不再恢复"""
+    old = archive_dir / "poem_old.txt"
+    new = archive_dir / "poem_new.txt"
+    index = archive_dir / "poems.jsonl"
+    tail = _record(new, "新")
+    index.write_text(_record(old, "旧") + tail, encoding="utf-8")
+
+    archive = PoemArchive()
+    archive.close()
+    new.unlink()
+    old.unlink()
+    archive.recover(tail_bytes=len(tail.encode("utf-8")) + 1)
+
+    assert new.exists()
+    assert not old.exists()
+
+
+def test_save_writes_journal_and_poem(archive_dir):
+    archive = PoemArchive()
+    entry = archive.save("春眠不觉晓", "清晨", image_path=None)
+    archive.close()
+
+    assert entry.poem_path.read_text(encoding="utf-8") == "春眠不觉晓"
+    records = [json.loads(line) for line in (archive_dir / "poems.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [r["poem"] for r in records] == ["春眠不觉晓"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = PoemDatabase(tmp_path / "poems.db")
+    db.add_many([
+        PoemRecord(id=None, created_at=datetime(2026, 1, 1, 8), poem="春眠不觉晓", caption="清晨的窗"),
+        PoemRecord(id=None, created_at=datetime(2026, 1, 2, 8), poem="处处闻啼鸟", caption="树上的鸟"),
+        PoemRecord(id=None, created_at=datetime(2026, 1, 3, 8), poem="100%_的春天", caption=""),
+    ])
+    yield db
+    db.close()
+
+
+def test_search_short_keyword(db):
+    """少于 3 个字符的关键词走 LIKE，按时间倒序"""
+    assert [r.poem for r in db.search("春")] == ["100%_的春天", "春眠不觉晓"]
+    assert [r.poem for r in db.search("鸟")] == ["处处闻啼鸟"]
+
+
+def test_search_short_keyword_escapes_wildcards(db):
+    assert [r.poem for r in db.search("%_")] == ["100%_的春天"]
+    assert db.search("_") and db.search("x_") == []
+
+
+def test_search_long_keyword(db):
+    assert [r.poem for r in db.search("春眠不")] == ["春眠不觉晓"]
+    assert [r.poem for r in db.search("树上的")] == ["处处闻啼鸟"]
+    assert db.search("  ") == []
@@ -0,0 +1,105 @@
+"""
+AI结果缓存测试：诗歌变化策略、TTL 和 LRU 淘汰
+"""
+import time
+
+import pytest
+
+from src.cache import AICache
+from src.config import config
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = AICache(tmp_path / "ai_cache.json")
+    yield cache
+    cache.flush()
+
+
+def test_caption_matches_similar_hash(cache, monkeypatch):
+    """汉明距离不超过 CACHE_HASH_DISTANCE 的哈希命中同一条描述"""
+    monkeypatch.setattr(config, "cache_hash_distance", 2)
+    cache.put_caption(0b1010_0000, "湖边的柳树", latency=3.0)
+
+    assert cache.get_caption(0b1010_0011) == "湖边的柳树"
+    assert cache.get_caption(0b1010_0111) is None
+    assert cache.stats.caption_hits == 1
+    assert cache.stats.saved_seconds == 3.0
+
+
+def test_policy_fresh_never_reuses_poem(cache, monkeypatch):
+    monkeypatch.setattr(config, "cache_vary_policy", AICache.POLICY_FRESH)
+    key = AICache.poem_key("湖边的柳树", "五言绝句", "v1")
+    cache.add_poem(key, "诗一", latency=2.0)
+
+    assert cache.get_poem(key) is None
+
+
+def test_policy_reuse_returns_cached_poem(cache, monkeypatch):
+    monkeypatch.setattr(config, "cache_vary_policy", AICache.POLICY_REUSE)
+    key = AICache.poem_key("湖边的柳树", "五言绝句", "v1")
+    assert cache.get_poem(key) is None
+    cache.add_poem(key, "诗一", latency=2.0)
+
+    assert cache.get_poem(key) == "诗一"
+    assert cache.get_poem(key) == "诗一"
+
+
+def test_policy_vary_rotates_after_enough_variants(cache, monkeypatch):
+    """未满 CACHE_POEM_VARIANTS 首时要求生成新诗，满后轮换"""
+    monkeypatch.setattr(config, "cache_vary_policy", AICache.POLICY_VARY)
+    monkeypatch.setattr(config, "cache_poem_variants", 2)
+    key = AICache.poem_key("湖边的柳树", "五言绝句", "v1")
+    cache.add_poem(key, "诗一", latency=2.0)
+    assert cache.get_poem(key) is None
+
+    cache.add_poem(key, "诗二", latency=2.0)
+    assert [cache.get_poem(key) for _ in range(3)] == ["诗一", "诗二", "诗一"]
+
+
+def test_poem_key_ignores_case_and_whitespace():
+    assert AICache.poem_key(" A Lake ", "五言绝句", "v1") == AICache.poem_key("a lake", "五言绝句", "v1")
+    assert AICache.poem_key("a lake", "五言绝句", "v1") != AICache.poem_key("a lake", "五言绝句", "v2")
+
+
+def test_ttl_expires_entries(cache, monkeypatch):
+    monkeypatch.setattr(config, "cache_ttl", 60)
+    monkeypatch.setattr(config, "cache_vary_policy", AICache.POLICY_REUSE)
+    key = AICache.poem_key("湖边的柳树", "五言绝句", "v1")
+    cache.put_caption(1, "湖边的柳树", latency=1.0)
+    cache.add_poem(key, "诗一", latency=1.0)
+
+    now = time.time()
+    monkeypatch.setattr("src.cache.time.time", lambda: now + 61)
+    assert cache.get_caption(1) is None
+    assert cache.get_poem(key) is None
+
+
+def test_lru_eviction(cache, monkeypatch):
+    """超出 CACHE_MAX_ENTRIES 时淘汰最久未使用的描述"""
+    monkeypatch.setattr(config, "cache_max_entries", 2)
+    monkeypatch.setattr(config, "cache_hash_distance", 0)
+    clock = iter(range(1_000_000, 2_000_000))
+    monkeypatch.setattr("src.cache.time.time", lambda: next(clock))
+
+    cache.put_caption(0x1, "一", latency=1.0)
+    cache.put_caption(0x3, "三", latency=1.0)
+    assert cache.get_caption(0x1) == "一"
+    cache.put_caption(0x7, "七", latency=1.0)
+
+    assert cache.get_caption(0x3) is None
+    assert cache.get_caption(0x1) == "一"
+    assert cache.get_caption(0x7) == "七"
+
+
+def test_flush_persists_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "cache_vary_policy", AICache.POLICY_REUSE)
+    key = AICache.poem_key("湖边的柳树", "五言绝句", "v1")
+    cache = AICache(tmp_path / "ai_cache.json")
+    cache.put_caption(0x5, "湖边的柳树", latency=1.0)
+    cache.add_poem(key, "诗一", latency=1.0)
+    cache.flush()
+
+    reloaded = AICache(tmp_path / "ai_cache.json")
+    assert reloaded.get_caption(0x5) == "湖边的柳树"
+    assert reloaded.get_poem(key) == "诗一"
@@ -0,0 +1,114 @@
+"""
+诗歌生成路由测试：用假的提供方检查对冲、切换和熔断
+"""
+import asyncio
+
+import pytest
+
+from src.config import config
+from src.llm_router import LLMProvider, LLMRouter
+
+
+@pytest.fixture(autouse=True)
+def router_config(monkeypatch):
+    monkeypatch.setattr(config, "llm_hedge", True)
+    monkeypatch.setattr(config, "llm_hedge_delay", 0.05)
+    monkeypatch.setattr(config, "llm_max_attempts", 1)
+    monkeypatch.setattr(config, "llm_breaker_threshold", 2)
+    monkeypatch.setattr(config, "llm_breaker_cooldown", 60)
+
+
+def _router(*names: str) -> LLMRouter:
+    return LLMRouter([LLMProvider(name=name, url=f"http://{name}", model="m") for name in names], lambda: None)
+
+
+def _start(behaviour: dict, cancelled: list):
+    """按提供方名字返回结果、抛出异常或一直挂起"""
+    async def start(provider: LLMProvider) -> str:
+        action = behaviour[provider.name]
+        try:
+            if action == "hang":
+                await asyncio.sleep(10)
+            elif isinstance(action, Exception):
+                raise action
+            return f"{provider.name}-poem"
+        except asyncio.CancelledError:
+            cancelled.append(provider.name)
+            raise
+    return start
+
+
+def test_hedge_wins_and_cancels_slow_provider():
+    """主请求超过对冲延迟未返回时向下一个提供方发出请求，先返回者胜出"""
+    router = _router("slow", "fast")
+    cancelled = []
+    provider, result = asyncio.run(
+        router._race(_start({"slow": "hang", "fast": None}, cancelled), "complete")
+    )
+
+    assert (provider.name, result) == ("fast", "fast-poem")
+    assert cancelled == ["slow"]
+    slow = router.providers[0]
+    assert slow.failures == 0 and slow.available()
+
+
+def test_no_hedge_when_disabled(monkeypatch):
+    monkeypatch.setattr(config, "llm_hedge", False)
+    router = _router("slow", "fast")
+    behaviour = {"slow": "hang", "fast": None}
+    started = []
+
+    async def start(provider):
+        started.append(provider.name)
+        return await _start(behaviour, [])(provider)
+
+    async def race():
+        return await asyncio.wait_for(router._race(start, "complete"), 0.3)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(race())
+    assert started == ["slow"]
+
+
+def test_failure_switches_provider_and_opens_breaker():
+    """失败立即切换到下一个提供方；连续失败达到阈值后熔断"""
+    router = _router("bad", "good")
+    behaviour = {"bad": RuntimeError("502"), "good": None}
+
+    for _ in range(2):
+        provider, _ = asyncio.run(router._race(_start(behaviour, []), "complete"))
+        assert provider.name == "good"
+
+    bad = router.providers[0]
+    assert bad.failures == 2
+    assert not bad.available()
+    assert [p.name for p in router.candidates()] == ["good"]
+
+
+def test_success_closes_breaker():
+    router = _router("flaky")
+    flaky = router.providers[0]
+    flaky.record_failure()
+    flaky.record_success(0.5)
+
+    assert flaky.failures == 0 and flaky.available()
+
+
+def test_all_providers_failing_raises():
+    router = _router("a", "b")
+    behaviour = {"a": RuntimeError("502"), "b": ValueError("bad json")}
+
+    with pytest.raises(RuntimeError, match="所有诗歌生成提供方均失败"):
+        asyncio.run(router._race(_start(behaviour, []), "complete"))
+    assert [p.failures for p in router.providers] == [1, 1]
+
+
+def test_candidates_prefer_fastest_measured_provider():
+    """未测量过的提供方排在前面，已测量的按 p50 排序"""
+    router = _router("a", "b", "c")
+    a, b, c = router.providers
+    for _ in range(10):
+        a.record_success(2.0)
+        b.record_success(1.0)
+
+    assert [p.name for p in router.candidates()] == ["c", "b", "a"]
@@ -0,0 +1,88 @@
+"""
+流水线阶段测试：用假的处理函数检查顺序和背压
+"""
+import threading
+import time
+
+from src.pipeline import _STOP, PipelineStage, PoemJob, PoemPipeline
+
+
+def _job(job_id: int) -> PoemJob:
+    return PoemJob(job_id=job_id, pressed_at=time.monotonic())
+
+
+def test_stages_keep_order():
+    """任务按提交顺序经过各阶段"""
+    seen = []
+    done = PipelineStage("print", lambda job: seen.append(job.job_id), maxsize=2)
+    middle = PipelineStage("ai", lambda job: job, maxsize=2, downstream=done)
+    first = PipelineStage("capture", lambda job: job, maxsize=2, downstream=middle)
+    for stage in (first, middle, done):
+        stage.start()
+
+    for job_id in range(1, 11):
+        first.put(_job(job_id))
+    first.put(_STOP)
+    for stage in (first, middle, done):
+        stage.join(5)
+
+    assert seen == list(range(1, 11))
+
+
+def test_failed_job_is_dropped():
+    """处理函数出错或返回None的任务不再传给下游，后续任务不受影响"""
+    seen = []
+
+    def handler(job):
+        if job.job_id == 2:
+            raise RuntimeError("boom")
+        return None if job.job_id == 3 else job
+
+    done = PipelineStage("print", lambda job: seen.append(job.job_id), maxsize=4)
+    first = PipelineStage("ai", handler, maxsize=4, downstream=done)
+    first.start()
+    done.start()
+    for job_id in range(1, 5):
+        first.put(_job(job_id))
+    first.put(_STOP)
+    first.join(5)
+    done.join(5)
+
+    assert seen == [1, 4]
+
+
+def test_back_pressure_blocks_upstream():
+    """下游队列满时上游阶段暂停，非阻塞提交在队列满时被拒绝"""
+    release = threading.Event()
+    started = []
+    done = PipelineStage("print", lambda job: release.wait(5), maxsize=1)
+    first = PipelineStage("ai", lambda job: started.append(job.job_id) or job, maxsize=1, downstream=done)
+    first.start()
+    done.start()
+
+    # 1 在下游处理中，2 占满下游队列，3 被上游处理后阻塞在投递上，4 占满上游队列
+    for job_id in range(1, 5):
+        assert first.put(_job(job_id), block=False)
+        time.sleep(0.1)
+
+    assert started == [1, 2, 3]
+    assert done.depth() == 1
+    assert first.depth() == 1
+    assert not first.put(_job(5), block=False)
+
+    release.set()
+    first.put(_STOP)
+    first.join(5)
+    done.join(5)
+    assert started == [1, 2, 3, 4]
+
+
+def test_submit_rejects_when_capture_queue_full(monkeypatch):
+    """拍照队列已满时按键被丢弃而不阻塞"""
+    monkeypatch.setattr("src.pipeline.config.pipeline_capture_queue", 2)
+    pipeline = PoemPipeline(camera=None, ai_service=None, printer=None, archive=None)
+
+    assert pipeline.submit()
+    assert pipeline.submit()
+    assert not pipeline.submit()
+    assert pipeline.queue_depths()["capture"] == 2
@@ -0,0 +1,53 @@
+"""
+换行与打印机状态解析测试
+"""
+from src.printer import PrinterStatus
+from src.utils import LineWrapper, wrap_text
+
+
+def test_line_wrapper_matches_wrap_text():
+    """分段喂入的结果与一次性 wrap_text 相同"""
+    text = "床前明月光，疑是地上霜。\n举头望明月，低头思故乡。\nMoonlight before my bed"
+    wrapper = LineWrapper(width=10)
+    lines = []
+    for i in range(0, len(text), 3):
+        lines += wrapper.feed(text[i:i + 3])
+    lines += wrapper.flush()
+
+    assert lines == wrap_text(text, width=10).split("\n")
+
+
+def test_line_wrapper_counts_wide_chars():
+    wrapper = LineWrapper(width=5)
+    assert wrapper.feed("ab春") == []
+    assert wrapper.feed("眠c") == ["ab春"]
+    assert wrapper.flush() == ["眠c"]
+    assert wrapper.flush() == []
+
+
+def test_line_wrapper_keeps_empty_lines():
+    wrapper = LineWrapper(width=8)
+    assert wrapper.feed("一\n\n二\n") == ["一", "", "二"]
+    assert wrapper.flush() == []
+
+
+def test_printer_status_normal():
+    status = PrinterStatus.parse(offline=0x12, errors=0x12, paper=0x12)
+    assert not status.fatal
+    assert status.describe() == "正常"
+
+
+def test_printer_status_paper():
+    assert PrinterStatus.parse(0x12, 0x12, 0x72).paper_out
+    assert PrinterStatus.parse(0x32, 0x12, 0x12).paper_out
+    near_end = PrinterStatus.parse(0x12, 0x12, 0x1E)
+    assert near_end.paper_near_end and not near_end.fatal
+
+
+def test_printer_status_cover_and_errors():
+    assert PrinterStatus.parse(0x16, 0x12, 0x12).cover_open
+    overheated = PrinterStatus.parse(0x12, 0x52, 0x12)
+    assert overheated.overheated and not overheated.fatal
+    cutter = PrinterStatus.parse(0x12, 0x1A, 0x12)
+    assert cutter.error and cutter.fatal
+    assert PrinterStatus.parse(0x36, 0x12, 0x12).describe() == "缺纸、开盖"